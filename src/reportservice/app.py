@@ -1,11 +1,13 @@
 import logging
 import asyncio
+from datetime import timedelta
 from contextlib import asynccontextmanager
 from fastapi import Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from apscheduler.jobstores.mongodb import MongoDBJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+from pymongo.errors import PyMongoError
 from .healthcheck import HealthCheck, logic_healthcheck
 from .settings import settings
 from .customlog import formatter
@@ -13,9 +15,13 @@ from .customlog import formatter
 from .routers.stat.router import router as stat_router
 from .routers.config.router import router as config_router
 from .routers.content.router import router as content_router
+from .routers.content import stages as render_stages
 from .routers.task.router import router as task_router
 from .routers.log import create_log_collection, MongoHandler
 from .routers.log.router import router as log_router
+from .routers.stat import AttendanceRollup, DailySketches, LiveCounters, directory_cache
+from .routers.common import AppConfigModel, BlobStore, StageExecutor
+from .indexes import IndexBootstrapMode, bootstrap_indexes
 from .middlewares import register_profiling_middleware
 from . import ExtendedFastAPI
 
@@ -29,6 +35,17 @@ async def log_everythings(request: Request):
         logger.info(f"Received request: {request.method} {request.url}")
 
 
+async def cancel_task(task: asyncio.Task | None):
+    """cancel a background task and wait until it is done"""
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
 async def init_database(app: ExtendedFastAPI):
     """init the database connection"""
     app.logger.info(f"Connecting to database at {settings.DB_URL}...")
@@ -86,13 +103,221 @@ async def close_scheduler(app: ExtendedFastAPI):
     scheduler.shutdown()
 
 
+async def get_app_config(app: ExtendedFastAPI) -> AppConfigModel | None:
+    """the current app config, None if the app is not configured yet"""
+    db: AsyncIOMotorDatabase = app.mongodb_client[settings.DB_REPORT_NAME]
+    latest = await db[settings.DB_COLLECTION_CONFIG].find_one()
+    if not latest:
+        return None
+    latest.pop("_id")
+    return AppConfigModel.model_validate(latest)
+
+
+async def get_faceid_source(app: ExtendedFastAPI):
+    """the BodyFaceName collection in the current app config, None if the app is not configured yet"""
+    config = await get_app_config(app)
+    if config is None:
+        return None
+    return app.mongodb_client[config.faceiddb.database][config.faceiddb.face_collection]
+
+
+async def get_staff_source(app: ExtendedFastAPI):
+    """the staff collection in the current app config, None if the app is not configured yet"""
+    config = await get_app_config(app)
+    if config is None:
+        return None
+    return app.mongodb_client[config.faceiddb.database][config.faceiddb.staff_collection]
+
+
+async def build_indexes(app: ExtendedFastAPI, mode: IndexBootstrapMode):
+    """create (or only report, in dry_run mode) the indexes needed by the generated queries"""
+    app.logger.info(f"Bootstrap the indexes, mode {mode.value}...")
+    try:
+        config = await get_app_config(app)
+        if config is None:
+            app.logger.info("The app is not configured yet, skip the indexes of the FaceID collections")
+        statuses = await bootstrap_indexes(app.mongodb_client, settings, config, mode, app.logger)
+    except PyMongoError as e:
+        app.logger.error(f"Bootstrap the indexes FAILED! {e}")
+        return
+    missing = [s for s in statuses if not s.exists and not s.created]
+    app.logger.info(f"Bootstrap the indexes DONE! {len(missing)} indexes missing")
+
+
+async def init_indexes(app: ExtendedFastAPI):
+    """check (or, in create mode, build) the recommended indexes in background, the app does not wait for them"""
+    app.index_task = None
+    if settings.DB_INDEX_BOOTSTRAP == IndexBootstrapMode.off:
+        return
+    app.index_task = asyncio.create_task(
+        build_indexes(app, settings.DB_INDEX_BOOTSTRAP),
+        name="bootstrap the indexes",
+    )
+
+
+async def close_indexes(app: ExtendedFastAPI):
+    """stop waiting for the index builds, the server carries on with those already started"""
+    await cancel_task(getattr(app, "index_task", None))
+
+
+async def init_rollup(app: ExtendedFastAPI):
+    """init the daily attendance rollup and its background refresher"""
+    app.rollup = None
+    app.rollup_task = None
+    if not settings.ROLLUP_ENABLED:
+        return
+    db: AsyncIOMotorDatabase = app.mongodb_client[settings.DB_REPORT_NAME]
+    rollup = AttendanceRollup(
+        db[settings.DB_COLLECTION_ROLLUP],
+        db[settings.DB_COLLECTION_ROLLUP_STATE],
+        tz=settings.TIMEZONE,
+        lag=timedelta(seconds=settings.ROLLUP_LAG),
+        history=timedelta(days=settings.ROLLUP_HISTORY_DAYS),
+        recheck_days=settings.ROLLUP_RECHECK_DAYS,
+        logger=app.logger,
+    )
+    await rollup.init()
+    app.rollup = rollup
+    app.rollup_task = asyncio.create_task(
+        rollup.run_forever(lambda: get_faceid_source(app), settings.ROLLUP_REFRESH_INTERVAL),
+        name="refresh the attendance rollup",
+    )
+
+
+async def close_rollup(app: ExtendedFastAPI):
+    """stop the background refresher"""
+    await cancel_task(getattr(app, "rollup_task", None))
+
+
+async def init_sketches(app: ExtendedFastAPI):
+    """the store of the daily sketches used by the approximate counts, and their background builder"""
+    app.sketches = None
+    app.sketch_task = None
+    if not settings.SKETCH_ENABLED:
+        return
+    db: AsyncIOMotorDatabase = app.mongodb_client[settings.DB_REPORT_NAME]
+    sketches = DailySketches(
+        db[settings.DB_COLLECTION_SKETCH],
+        tz=settings.TIMEZONE,
+        precision=settings.SKETCH_PRECISION,
+        lag=timedelta(seconds=settings.STAT_CACHE_CLOSED_AFTER),
+        history=timedelta(days=settings.SKETCH_HISTORY_DAYS),
+        recheck_days=settings.SKETCH_RECHECK_DAYS,
+        logger=app.logger,
+    )
+    await sketches.init()
+    app.sketches = sketches
+    app.sketch_task = asyncio.create_task(
+        sketches.run_forever(lambda: get_faceid_source(app), settings.SKETCH_REFRESH_INTERVAL),
+        name="build the daily sketches",
+    )
+
+
+async def close_sketches(app: ExtendedFastAPI):
+    """stop building the daily sketches"""
+    await cancel_task(getattr(app, "sketch_task", None))
+
+
+async def init_live(app: ExtendedFastAPI):
+    """the live counters of today, their watcher is started by the first query"""
+    app.live = None
+    if not settings.LIVE_ENABLED:
+        return
+    app.live = LiveCounters(tz=settings.TIMEZONE, retry_interval=settings.LIVE_RETRY_INTERVAL, logger=app.logger)
+
+
+async def close_live(app: ExtendedFastAPI):
+    """stop the watcher of the live counters"""
+    live: LiveCounters | None = getattr(app, "live", None)
+    if live is not None:
+        await live.close()
+
+
+async def init_directory_watch(app: ExtendedFastAPI):
+    """invalidate the cached staff directory counters when the staff collection changes"""
+    app.directory_task = None
+    if not settings.DIRECTORY_CACHE_ENABLED:
+        return
+    directory_cache.logger = app.logger
+    app.directory_task = asyncio.create_task(
+        directory_cache.run_forever(lambda: get_staff_source(app), settings.DIRECTORY_WATCH_INTERVAL),
+        name="watch the staff collection",
+    )
+
+
+async def close_directory_watch(app: ExtendedFastAPI):
+    """stop watching the staff collection"""
+    await cancel_task(getattr(app, "directory_task", None))
+
+
+async def migrate_excel_files(app: ExtendedFastAPI):
+    """move the excel files kept as base64 strings by the older versions, the renders move the others on demand"""
+    app.logger.info("Migrate the excel files of the contents...")
+    try:
+        migrated = await app.excel_store.migrate()
+    except PyMongoError as e:
+        app.logger.error(f"Migrate the excel files FAILED! {e}")
+        return
+    app.logger.info(f"Migrate the excel files DONE! {migrated} contents moved from base64 strings")
+
+
+async def init_excel_store(app: ExtendedFastAPI):
+    """the store of the excel files of the contents, the files kept as base64 strings are migrated in background"""
+    db: AsyncIOMotorDatabase = app.mongodb_client[settings.DB_REPORT_NAME]
+    app.excel_store = BlobStore(
+        db[settings.DB_COLLECTION_CONTENT],
+        AsyncIOMotorGridFSBucket(db, bucket_name=settings.DB_BUCKET_EXCEL),
+        "excel",
+        inline_max_size=settings.EXCEL_INLINE_MAX_SIZE,
+        logger=app.logger,
+    )
+    app.excel_migration_task = None
+    if not settings.EXCEL_MIGRATE_AT_STARTUP:
+        return
+    app.excel_migration_task = asyncio.create_task(migrate_excel_files(app), name="migrate the excel files")
+
+
+async def close_excel_store(app: ExtendedFastAPI):
+    """stop the migration of the excel files, the next start carries on"""
+    await cancel_task(getattr(app, "excel_migration_task", None))
+
+
+async def init_stage_executor(app: ExtendedFastAPI):
+    """the workers building the tables and excel files of the reports, out of the event loop"""
+    app.stage_executor = StageExecutor(
+        settings.RENDER_EXECUTOR, settings.RENDER_WORKERS, preload=[render_stages.__name__], logger=app.logger
+    )
+    await app.stage_executor.start()
+
+
+async def close_stage_executor(app: ExtendedFastAPI):
+    """stop the render workers"""
+    executor: StageExecutor | None = getattr(app, "stage_executor", None)
+    if executor is not None:
+        executor.shutdown()
+
+
 @asynccontextmanager
 async def lifespan(app: ExtendedFastAPI):
     """manage the database connection, the scheduler using lifespan"""
     await init_database(app)
     await init_dblogger(app)
     await init_scheduler(app)
+    await init_indexes(app)
+    await init_rollup(app)
+    await init_sketches(app)
+    await init_directory_watch(app)
+    await init_live(app)
+    await init_excel_store(app)
+    await init_stage_executor(app)
     yield
+    await close_stage_executor(app)
+    await close_excel_store(app)
+    await close_live(app)
+    await close_directory_watch(app)
+    await close_sketches(app)
+    await close_rollup(app)
+    await close_indexes(app)
     await remove_handler(app)
     await close_database(app)
     await close_scheduler(app)
@@ -19,6 +19,7 @@ def patch_settings(monkeypatch_session, temp_log_file, random_database_name):
     monkeypatch_session.setattr(settings, "LOG_FILE", temp_log_file)
     monkeypatch_session.setattr(settings, "DB_REPORT_NAME", random_database_name)
     monkeypatch_session.setattr(settings, "PROFILING_ENABLED", True)
+    monkeypatch_session.setattr(settings, "TRUSTED_RESPONSES", False)  # keep validating the responses in the tests
     assert settings.LOG_FILE == temp_log_file
     assert settings.DB_REPORT_NAME == random_database_name
     assert settings.PROFILING_ENABLED is True
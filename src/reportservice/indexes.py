@@ -0,0 +1,139 @@
+"""Make sure the indexes needed by the generated queries exist"""
+
+from logging import Logger, getLogger
+from typing import Dict, List, Tuple
+from pydantic import BaseModel, Field
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from .settings import AppSettingsModel, IndexBootstrapMode
+from .routers.common import AppConfigModel
+
+IndexKeys = List[Tuple[str, int]]
+
+
+class IndexSpec(BaseModel):
+    name: str
+    keys: IndexKeys
+    reason: str = Field(description="which query needs this index")
+
+
+class IndexStatus(BaseModel):
+    collection: str
+    name: str
+    keys: IndexKeys
+    reason: str
+    exists: bool = Field(description="True if an index with the same keys exists")
+    created: bool = False
+    error: str | None = None
+
+
+# the face_reg_score is filtered on the fetched records: they are fetched anyway for their staff_id, and an index
+# ending on it could not give the (image_time, _id) order of the record pages
+FACE_INDEXES = [
+    IndexSpec(
+        name="has_mask_image_time_id",
+        keys=[("has_mask", ASCENDING), ("image_time", ASCENDING), ("_id", ASCENDING)],
+        reason="pipeline_count, pipeline_stat_by_camera, rollup refresh, person_record pages",
+    ),
+    IndexSpec(
+        name="staff_id_has_mask_image_time_id",
+        keys=[("staff_id", ASCENDING), ("has_mask", ASCENDING), ("image_time", ASCENDING), ("_id", ASCENDING)],
+        reason="query_find_staff_inout, person_record pages of a staff",
+    ),
+]
+
+STAFF_INDEXES = [
+    IndexSpec(name=f"{field}_1", keys=[(field, ASCENDING)], reason="query_find_staff")
+    for field in ["staff_code", "full_name", "unit", "department", "title", "email", "cellphone"]
+] + [
+    IndexSpec(name="working_state_1", keys=[("working_state", ASCENDING)], reason="count_should_checkinout"),
+    IndexSpec(name="sample_state_1", keys=[("sample_state", ASCENDING)], reason="count_has_sample"),
+]
+
+TASK_INDEXES = [
+    IndexSpec(name="job_id_1", keys=[("job_id", ASCENDING)], reason="remove_orphan_jobs"),
+    IndexSpec(name="content_id_1", keys=[("content_id", ASCENDING)], reason="tasks of a content"),
+]
+
+LOG_INDEXES = [
+    IndexSpec(
+        name="metadata.uid_1_logtime_1",
+        keys=[("metadata.uid", ASCENDING), ("logtime", ASCENDING)],
+        reason="logs of a content or a task",
+    ),
+]
+
+
+def recommended_indexes(
+    client: AsyncIOMotorClient, settings: AppSettingsModel, config: AppConfigModel | None
+) -> List[Tuple[AsyncIOMotorCollection, List[IndexSpec]]]:
+    """the collections with their recommended indexes. FaceID collections are only known once the app is configured"""
+    report_db = client[settings.DB_REPORT_NAME]
+    ret = [
+        (report_db[settings.DB_COLLECTION_TASK], TASK_INDEXES),
+        (report_db[settings.DB_COLLECTION_LOG], LOG_INDEXES),
+    ]
+    if config is not None:
+        faceid_db = client[config.faceiddb.database]
+        ret.append((faceid_db[config.faceiddb.face_collection], FACE_INDEXES))
+        ret.append((faceid_db[config.faceiddb.staff_collection], STAFF_INDEXES))
+    return ret
+
+
+async def ensure_indexes(
+    collection: AsyncIOMotorCollection,
+    specs: List[IndexSpec],
+    mode: IndexBootstrapMode = IndexBootstrapMode.create,
+    logger: Logger | None = None,
+) -> List[IndexStatus]:
+    """compare the existing indexes of `collection` with `specs`, create the missing ones if `mode` is create.
+    An index is considered existing if another index has the same keys, whatever its name."""
+    if logger is None:
+        logger = getLogger()
+    ret: List[IndexStatus] = []
+    try:
+        existing: Dict = await collection.index_information()
+    except PyMongoError as e:
+        logger.warning(f"cannot list the indexes of {collection.full_name}: {e}")
+        existing = {}
+    existing_keys = [[(k, int(v)) for k, v in info["key"]] for info in existing.values()]
+
+    for spec in specs:
+        keys = [(k, int(v)) for k, v in spec.keys]
+        status = IndexStatus(
+            collection=collection.full_name,
+            name=spec.name,
+            keys=keys,
+            reason=spec.reason,
+            exists=keys in existing_keys,
+        )
+        if not status.exists:
+            if mode == IndexBootstrapMode.create:
+                try:
+                    await collection.create_index(keys, name=spec.name)
+                    status.created = True
+                    logger.info(f"created index {spec.name} on {collection.full_name}")
+                except PyMongoError as e:
+                    status.error = str(e)
+                    logger.warning(f"cannot create index {spec.name} on {collection.full_name}: {e}")
+            else:
+                logger.info(f"missing index {spec.name} on {collection.full_name}, needed by {spec.reason}")
+        ret.append(status)
+    return ret
+
+
+async def bootstrap_indexes(
+    client: AsyncIOMotorClient,
+    settings: AppSettingsModel,
+    config: AppConfigModel | None,
+    mode: IndexBootstrapMode,
+    logger: Logger | None = None,
+) -> List[IndexStatus]:
+    """ensure the recommended indexes on all the collections used by the service"""
+    ret: List[IndexStatus] = []
+    if mode == IndexBootstrapMode.off:
+        return ret
+    for collection, specs in recommended_indexes(client, settings, config):
+        ret += await ensure_indexes(collection, specs, mode, logger)
+    return ret
@@ -1,5 +1,9 @@
 from .config_models import AppConfigModel, AppConfigModelUpdate
 from .dependencies import *
+from .concurrency import gather_with_concurrency, timed
+from .lru import LRUCache, CacheStats
+from .executor import StageExecutor, ExecutorKind, ExecutorMetrics
+from .blobs import BlobStore, BlobRef, BlobStorage
 
 # from .email_spammer import EmailSpammer # do not use this anymore
 from .async_email_spammer import AsyncEmailSpammer
@@ -0,0 +1,151 @@
+"""binary files attached to a document: small ones inline as BSON Binary, larger ones in GridFS
+
+The document keeps `<field>_ref` (size, hash and where the file is) and, for the small files, the bytes in `<field>`.
+The routes which only need the metadata project `<field>` out, the file is read (or streamed) on demand.
+"""
+
+import binascii
+import hashlib
+from base64 import b64decode
+from datetime import datetime, timezone
+from enum import Enum
+from logging import Logger, getLogger
+from typing import Any, AsyncIterator, Dict, Optional
+from bson import Binary, ObjectId
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorGridFSBucket
+from pydantic import BaseModel, ConfigDict, Field
+from pymongo import ReturnDocument
+
+
+class BlobStorage(str, Enum):
+    binary = "binary"  # BSON Binary in the document itself
+    gridfs = "gridfs"
+
+
+class BlobRef(BaseModel):
+    model_config = ConfigDict(use_enum_values=True)
+
+    storage: BlobStorage
+    size: int = Field(description="bytes")
+    sha256: str
+    file_id: Optional[str] = Field(None, description="id of the GridFS file")
+    uploaded_at: datetime
+
+
+class BlobStore:
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        bucket: AsyncIOMotorGridFSBucket,
+        field: str,
+        inline_max_size: int = 1024 * 1024,
+        logger: Logger | None = None,
+    ):
+        if logger is None:
+            logger = getLogger()
+        self.collection = collection
+        self.bucket = bucket
+        self.field = field
+        self.ref_field = f"{field}_ref"
+        self.inline_max_size = inline_max_size  # larger files go to GridFS
+        self.logger = logger
+        self.migrated = False  # True once `migrate` went through the whole collection
+
+    async def put(
+        self, doc_id: Any, data: bytes, fields: Dict[str, Any] | None = None, only_if: Dict[str, Any] | None = None
+    ) -> BlobRef | None:
+        """store `data` as the file of the document, `$set` the other `fields` along.
+        Return None if there is no such document (or it does not match `only_if`)"""
+        ref = BlobRef(
+            storage=BlobStorage.binary if len(data) <= self.inline_max_size else BlobStorage.gridfs,
+            size=len(data),
+            sha256=hashlib.sha256(data).hexdigest(),
+            uploaded_at=datetime.now(timezone.utc),
+        )
+        update: Dict[str, Any] = {"$set": dict(fields or {})}
+        if ref.storage == BlobStorage.binary:
+            update["$set"][self.field] = Binary(data)
+        else:
+            file_id = await self.bucket.upload_from_stream(
+                str(doc_id), data, metadata={"doc_id": doc_id, "sha256": ref.sha256}
+            )
+            ref.file_id = str(file_id)
+            update["$unset"] = {self.field: ""}
+        update["$set"][self.ref_field] = ref.model_dump()
+
+        before = await self.collection.find_one_and_update(
+            {**(only_if or {}), "_id": doc_id},
+            update,
+            projection={self.ref_field: 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if before is None:
+            await self.discard(ref)
+            return None
+        # the previous file of the document, if it was in GridFS
+        await self.discard(before.get(self.ref_field))
+        return ref
+
+    async def iter_chunks(self, doc_id: Any, ref: BlobRef) -> AsyncIterator[bytes]:
+        """the file of the document, chunk by chunk (GridFS chunks, or the whole inline file)"""
+        if ref.storage == BlobStorage.binary:
+            doc = await self.collection.find_one({"_id": doc_id}, {self.field: 1})
+            if doc is not None and doc.get(self.field) is not None:
+                yield bytes(doc[self.field])
+            return
+        stream = await self.bucket.open_download_stream(ObjectId(ref.file_id))
+        while chunk := await stream.readchunk():
+            yield chunk
+
+    async def read(self, doc_id: Any, ref: BlobRef) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_chunks(doc_id, ref)])
+
+    async def discard(self, ref: BlobRef | Dict | None):
+        """delete the GridFS file of `ref`, if any. The inline files go away with their document"""
+        if ref is None:
+            return
+        ref = BlobRef.model_validate(ref)
+        if ref.storage != BlobStorage.gridfs:
+            return
+        try:
+            await self.bucket.delete(ObjectId(ref.file_id))
+        except NoFile:
+            pass
+
+    async def resolve(self, doc_id: Any, ref: BlobRef | None) -> BlobRef | None:
+        """`ref`, or while the files are not all migrated, the ref of the base64 string of the document moved now"""
+        if ref is not None or self.migrated:
+            return ref
+        return await self.migrate_one(doc_id)
+
+    async def migrate_one(self, doc_id: Any) -> BlobRef | None:
+        """store the base64 string of one document, if it still has one"""
+        doc = await self.collection.find_one({"_id": doc_id, self.field: {"$type": "string"}}, {self.field: 1})
+        if doc is None:
+            return None
+        ref = await self._migrate(doc)
+        if ref is None:
+            # moved by `migrate` meanwhile
+            doc = await self.collection.find_one({"_id": doc_id}, {self.ref_field: 1})
+            if doc is not None and doc.get(self.ref_field) is not None:
+                ref = BlobRef.model_validate(doc[self.ref_field])
+        return ref
+
+    async def migrate(self) -> int:
+        """store the files kept as base64 strings in `<field>` by the older versions. Return how many were moved"""
+        count = 0
+        async for doc in self.collection.find({self.field: {"$type": "string"}}, {self.field: 1}):
+            if await self._migrate(doc) is not None:
+                count += 1
+        self.migrated = True
+        return count
+
+    async def _migrate(self, doc: Dict) -> BlobRef | None:
+        try:
+            data = b64decode(doc[self.field].encode("utf-8"), validate=True)
+        except (binascii.Error, ValueError) as e:
+            self.logger.warning(f"cannot decode the {self.field} of {doc['_id']}, left as it is: {e}")
+            return None
+        # a document moved by another caller meanwhile is left alone
+        return await self.put(doc["_id"], data, only_if={self.field: {"$type": "string"}})
@@ -0,0 +1,157 @@
+"""Arrow IPC stream and Parquet responses, written in record batches of a fixed number of rows as they come from the
+cursor, so the memory used does not depend on the number of rows.
+The columns are the declared fields of the model, the extra fields are not exported.
+"""
+
+from datetime import date, datetime
+from enum import Enum
+from types import UnionType
+from typing import Annotated, Any, AsyncIterator, List, Type, Union, get_args, get_origin
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+
+class ExportFormat(str, Enum):
+    json = "json"
+    arrow = "arrow"
+    parquet = "parquet"
+
+
+def arrow_type(annotation: Any) -> pa.DataType:
+    """the arrow type of a field annotation, `Optional[X]` is a nullable X. Unknown types are exported as strings"""
+    origin = get_origin(annotation)
+    if origin is Annotated:
+        return arrow_type(get_args(annotation)[0])
+    if origin in (Union, UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        return arrow_type(args[0]) if len(args) == 1 else pa.string()
+    if annotation is bool:
+        return pa.bool_()
+    if annotation is int:
+        return pa.int64()
+    if annotation is float:
+        return pa.float64()
+    if annotation is datetime:
+        # mongo stores UTC, the naive datetimes read from it are UTC
+        return pa.timestamp("ms", tz="UTC")
+    if annotation is date:
+        return pa.date32()
+    return pa.string()
+
+
+def arrow_schema(model: Type[BaseModel]) -> pa.Schema:
+    return pa.schema([(name, arrow_type(field.annotation)) for name, field in model.model_fields.items()])
+
+
+def _column_value(value: Any, type_: pa.DataType) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, Enum):
+        return value.value
+    if pa.types.is_string(type_) and not isinstance(value, str):
+        return str(value)
+    return value
+
+
+def record_batch(items: List[BaseModel], schema: pa.Schema) -> pa.RecordBatch:
+    columns = [
+        pa.array([_column_value(getattr(item, field.name, None), field.type) for item in items], type=field.type)
+        for field in schema
+    ]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def ipc_bytes(items: List[BaseModel], model: Type[BaseModel]) -> bytes:
+    """`items` as an Arrow IPC stream of a single record batch, e.g. to hand them to another process"""
+    schema = arrow_schema(model)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(record_batch(items, schema))
+    return sink.getvalue().to_pybytes()
+
+
+async def iter_batches(
+    items: AsyncIterator[BaseModel], schema: pa.Schema, chunk_size: int
+) -> AsyncIterator[pa.RecordBatch]:
+    chunk: List[BaseModel] = []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield record_batch(chunk, schema)
+            chunk = []
+    if chunk:
+        yield record_batch(chunk, schema)
+
+
+class _Sink:
+    """a write-only file which keeps the bytes written since the last `take`"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+async def columnar_response(
+    items: AsyncIterator[BaseModel],
+    model: Type[BaseModel],
+    export_format: ExportFormat,
+    chunk_size: int = 10000,
+    filename: str = "export",
+) -> StreamingResponse:
+    """stream `items` as an Arrow IPC stream or a Parquet file, one record batch (one row group) per `chunk_size` rows.
+    The first batch is built before the response starts, so that errors in the query still get a proper status code.
+    """
+    schema = arrow_schema(model)
+    batches = iter_batches(items, schema, chunk_size)
+    try:
+        first = await batches.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    sink = _Sink()
+    if export_format == ExportFormat.parquet:
+        writer = pq.ParquetWriter(sink, schema)
+        media_type, extension = PARQUET_MEDIA_TYPE, "parquet"
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        media_type, extension = ARROW_MEDIA_TYPE, "arrow"
+
+    async def chunks():
+        try:
+            if first is not None:
+                writer.write_batch(first)
+                yield sink.take()
+                async for batch in batches:
+                    writer.write_batch(batch)
+                    yield sink.take()
+        finally:
+            writer.close()
+        yield sink.take()
+
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{extension}"'}
+    return StreamingResponse(chunks(), media_type=media_type, headers=headers)
@@ -0,0 +1,50 @@
+"""run many coroutines together without flooding the database"""
+
+import time
+import asyncio
+import inspect
+from logging import Logger, getLogger
+from typing import Any, Awaitable, Dict
+
+
+async def timed(name: str, aw: Awaitable, logger: Logger | None = None) -> Any:
+    """await `aw` and log how long it takes"""
+    if logger is None:
+        logger = getLogger()
+    start = time.perf_counter()
+    try:
+        return await aw
+    finally:
+        logger.debug(f"query {name} took {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+async def gather_with_concurrency(
+    limit: int,
+    aws: Dict[str, Awaitable],
+    logger: Logger | None = None,
+) -> Dict[str, Any]:
+    """run all awaitables in `aws` concurrently, at most `limit` of them at the same time.
+    Return a dict with the same keys as `aws`. The first exception is raised and the others are cancelled.
+    """
+    if limit < 1:
+        limit = 1
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _run(name: str, aw: Awaitable):
+        try:
+            async with semaphore:
+                return await timed(name, aw, logger)
+        finally:
+            # cancelled while waiting for the semaphore, avoid the "never awaited" warning
+            if inspect.iscoroutine(aw) and inspect.getcoroutinestate(aw) == inspect.CORO_CREATED:
+                aw.close()
+
+    tasks = {name: asyncio.ensure_future(_run(name, aw)) for name, aw in aws.items()}
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return {name: task.result() for name, task in tasks.items()}
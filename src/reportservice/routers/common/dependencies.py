@@ -5,6 +5,8 @@ from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorClient, AsyncI
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from .config_models import AppConfigModel
 from .async_email_spammer import AsyncEmailSpammer
+from .executor import StageExecutor
+from .blobs import BlobStore
 from ...settings import AppSettingsModel
 
 __all__ = [
@@ -20,6 +22,8 @@ __all__ = [
     "DepStaffCollection",
     "DepLogger",
     "DepEmailSpammer",
+    "DepStageExecutor",
+    "DepExcelStore",
 ]
 
 
@@ -139,3 +143,17 @@ async def get_spammer(app_config: DepAppConfig) -> Callable[[], AsyncEmailSpamme
 
 
 DepEmailSpammer = Annotated[Callable[[], AsyncEmailSpammer] | None, Depends(get_spammer)]
+
+
+async def get_stage_executor(request: Request) -> StageExecutor | None:
+    return getattr(request.app, "stage_executor", None)
+
+
+DepStageExecutor = Annotated[StageExecutor | None, Depends(get_stage_executor)]
+
+
+async def get_excel_store(request: Request) -> BlobStore:
+    return request.app.excel_store
+
+
+DepExcelStore = Annotated[BlobStore, Depends(get_excel_store)]
@@ -0,0 +1,137 @@
+"""an executor for the CPU bound stages of the requests, e.g. the pandas / openpyxl work of a report render
+
+Running them on the event loop stalls every other request for as long as they take. The stages run in a process
+pool (a thread pool if processes can not be started, or if configured so), or inline when the executor is off.
+The functions and their arguments must be picklable: module level functions taking bytes, strings or Arrow buffers.
+"""
+
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Sequence, Tuple
+from pydantic import BaseModel
+from ...settings import ExecutorKind
+
+
+class StageMetrics(BaseModel):
+    count: int = 0
+    errors: int = 0
+    total_seconds: float = 0  # time spent running the stage in the workers
+    mean_seconds: float = 0
+    max_seconds: float = 0
+    wait_seconds: float = 0  # time spent waiting for a worker, and sending the arguments and the result
+
+
+class ExecutorMetrics(BaseModel):
+    kind: ExecutorKind
+    workers: int
+    in_flight: int  # submitted, not finished
+    queue_depth: int  # submitted, waiting for a worker
+    max_queue_depth: int
+    stages: Dict[str, StageMetrics]
+
+
+def _timed(fn: Callable, *args) -> Tuple[Any, float]:
+    """run in the worker, so that the time of the stage does not include the wait for a worker"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def _preload(modules: Sequence[str]):
+    """run by each worker process when it starts: pandas and openpyxl take seconds to import in a new process"""
+    for module in modules:
+        importlib.import_module(module)
+
+
+def _ping() -> int:
+    return 0
+
+
+class StageExecutor:
+    def __init__(
+        self,
+        kind: ExecutorKind = ExecutorKind.process,
+        workers: int = 2,
+        preload: Sequence[str] = (),
+        logger: logging.Logger | None = None,
+    ):
+        if logger is None:
+            logger = logging.getLogger()
+        self.kind = ExecutorKind(kind)
+        self.workers = workers
+        self.preload = tuple(preload)  # modules imported by the worker processes when they start
+        self.logger = logger
+        self.executor: Executor | None = None
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.stages: Dict[str, StageMetrics] = {}
+
+    async def start(self):
+        """start the workers, fall back to threads if the processes do not start"""
+        if self.kind == ExecutorKind.process:
+            loop = asyncio.get_running_loop()
+            try:
+                # spawn, not fork: the parent runs the event loop and the threads of the mongo client
+                self.executor = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_preload,
+                    initargs=(self.preload,),
+                )
+                # start the workers now rather than on the first stage
+                await asyncio.gather(*[loop.run_in_executor(self.executor, _ping) for _ in range(self.workers)])
+            except Exception as e:
+                self.logger.warning(f"Cannot start the worker processes, fall back to threads: {e}")
+                self.shutdown()
+                self.kind = ExecutorKind.thread
+        if self.kind == ExecutorKind.thread:
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="stage")
+        self.logger.info(f"Stage executor started: {self.kind.value}, {self.workers} workers")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.workers)
+
+    async def run(self, stage: str, fn: Callable, *args) -> Any:
+        """run `fn(*args)` in a worker and record the time of `stage`"""
+        metrics = self.stages.setdefault(stage, StageMetrics())
+        start = time.perf_counter()
+        self.in_flight += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            if self.executor is None:
+                result, seconds = _timed(fn, *args)
+            else:
+                loop = asyncio.get_running_loop()
+                result, seconds = await loop.run_in_executor(self.executor, partial(_timed, fn, *args))
+        except Exception:
+            metrics.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        metrics.count += 1
+        metrics.total_seconds += seconds
+        metrics.mean_seconds = metrics.total_seconds / metrics.count
+        metrics.max_seconds = max(metrics.max_seconds, seconds)
+        metrics.wait_seconds += time.perf_counter() - start - seconds
+        return result
+
+    def metrics(self) -> ExecutorMetrics:
+        return ExecutorMetrics(
+            kind=self.kind if self.executor is not None else ExecutorKind.off,
+            workers=self.workers if self.executor is not None else 0,
+            in_flight=self.in_flight,
+            queue_depth=self.queue_depth,
+            max_queue_depth=self.max_queue_depth,
+            stages={name: metrics.model_copy() for name, metrics in self.stages.items()},
+        )
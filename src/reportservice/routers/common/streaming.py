@@ -0,0 +1,47 @@
+"""newline delimited JSON responses, one document per line, written as they come from the cursor"""
+
+import json
+from typing import Any, AsyncIterator, Callable, Dict
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# for the `responses` argument of the routes which can stream
+NDJSON_RESPONSES: Dict[int | str, Dict[str, Any]] = {
+    200: {"content": {NDJSON_MEDIA_TYPE: {}}, "description": "one document per line, then a trailer line"}
+}
+
+_EMPTY = object()
+
+
+def wants_ndjson(request: Request, stream: bool = False) -> bool:
+    """True if the client asked for NDJSON, with `stream=true` or the Accept header"""
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def ndjson_response(
+    items: AsyncIterator[BaseModel],
+    trailer: Callable[[int], Dict[str, Any]] = lambda count: {"count": count},
+    dump: Callable[[BaseModel], str] = lambda item: item.model_dump_json(),
+) -> StreamingResponse:
+    """stream `items` one per line, each serialized by `dump`, then the trailer line built from the number of items.
+    The first item is read before the response starts, so that errors in the query still get a proper status code.
+    """
+    try:
+        first = await items.__anext__()
+    except StopAsyncIteration:
+        first = _EMPTY
+
+    async def lines():
+        count = 0
+        if first is not _EMPTY:
+            yield dump(first) + "\n"
+            count += 1
+            async for item in items:
+                yield dump(item) + "\n"
+                count += 1
+        yield json.dumps(trailer(count), default=str) + "\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
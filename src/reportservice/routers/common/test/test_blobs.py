@@ -0,0 +1,79 @@
+from base64 import b64encode
+import pytest
+import pytest_asyncio
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from ..blobs import BlobRef, BlobStorage, BlobStore
+from ....settings import AppSettingsModel
+
+
+@pytest_asyncio.fixture
+async def blob_store(testsettings: AppSettingsModel):
+    mongo = AsyncIOMotorClient(testsettings.DB_URL, uuidRepresentation="standard")
+    database = mongo[testsettings.DB_REPORT_NAME]
+    collection = database["TestBlobs"]
+    bucket = AsyncIOMotorGridFSBucket(database, bucket_name="TestBlobs")
+    yield BlobStore(collection, bucket, "data", inline_max_size=1000)
+    await collection.drop()
+    await database["TestBlobs.files"].drop()
+    await database["TestBlobs.chunks"].drop()
+    mongo.close()
+
+
+@pytest.mark.asyncio
+async def test_blob_store(blob_store: BlobStore):
+    await blob_store.collection.insert_one({"_id": "doc", "name": "blob"})
+    small, large = b"small" * 10, bytes(range(256)) * 1000
+
+    ref = await blob_store.put("doc", small, {"name": "small"})
+    assert ref.storage == BlobStorage.binary
+    assert await blob_store.read("doc", ref) == small
+    doc = await blob_store.collection.find_one({"_id": "doc"})
+    assert doc["name"] == "small" and doc["data_ref"]["sha256"] == ref.sha256
+
+    ref = await blob_store.put("doc", large)
+    assert ref.storage == BlobStorage.gridfs
+    assert ref.size == len(large)
+    assert await blob_store.read("doc", ref) == large
+    assert "data" not in await blob_store.collection.find_one({"_id": "doc"})
+
+    # the GridFS file is deleted once replaced
+    await blob_store.put("doc", small)
+    assert await blob_store.bucket.find({}).to_list(None) == []
+
+    assert await blob_store.put("missing", large) is None
+    assert await blob_store.bucket.find({}).to_list(None) == []
+
+
+@pytest.mark.asyncio
+async def test_blob_store_migrate(blob_store: BlobStore):
+    small, large = b"small" * 10, b"large" * 1000
+    await blob_store.collection.insert_many(
+        [
+            {"_id": "small", "data": b64encode(small).decode("utf-8")},
+            {"_id": "large", "data": b64encode(large).decode("utf-8")},
+            {"_id": "invalid", "data": "not base64!"},
+        ]
+    )
+    assert await blob_store.migrate() == 2
+    assert await blob_store.migrate() == 0
+
+    for doc_id, data in [("small", small), ("large", large)]:
+        doc = await blob_store.collection.find_one({"_id": doc_id})
+        assert await blob_store.read(doc_id, BlobRef.model_validate(doc["data_ref"])) == data
+
+
+@pytest.mark.asyncio
+async def test_blob_store_resolve(blob_store: BlobStore):
+    large = b"large" * 1000
+    await blob_store.collection.insert_many(
+        [{"_id": "legacy", "data": b64encode(large).decode("utf-8")}, {"_id": "empty"}]
+    )
+    # not migrated yet, the file is moved on demand
+    ref = await blob_store.resolve("legacy", None)
+    assert await blob_store.read("legacy", ref) == large
+    assert await blob_store.resolve("legacy", ref) == ref
+    assert await blob_store.resolve("empty", None) is None
+
+    assert await blob_store.migrate() == 0
+    assert blob_store.migrated
+    assert await blob_store.bucket.find({}).to_list(None) != []
@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Optional
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from pydantic import AnyHttpUrl, BaseModel, ConfigDict
+from ..columnar import ARROW_MEDIA_TYPE, PARQUET_MEDIA_TYPE, ExportFormat, arrow_schema, columnar_response
+
+
+class State(str, Enum):
+    on = "on"
+    off = "off"
+
+
+class Row(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    name: str
+    score: float
+    count: Optional[int] = None
+    state: State = State.on
+    time: Optional[datetime] = None
+    link: Optional[AnyHttpUrl] = None
+
+
+async def _rows(n: int, fail: bool = False):
+    if fail:
+        raise ValueError("bad query")
+    for i in range(n):
+        yield Row(
+            name=f"row{i}",
+            score=i / 2,
+            count=i if i % 2 else None,
+            state=State.off,
+            time=datetime(2023, 12, 27, 8, i, tzinfo=timezone.utc),
+            link="http://example.com/a.jpg",
+            ignored=i,
+        )
+
+
+async def _body(response) -> bytes:
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+def test_arrow_schema():
+    schema = arrow_schema(Row)
+    assert schema.names == ["name", "score", "count", "state", "time", "link"]
+    assert schema.field("count").type == pa.int64()
+    assert schema.field("state").type == pa.string()
+    assert schema.field("time").type == pa.timestamp("ms", tz="UTC")
+    assert schema.field("link").type == pa.string()
+
+
+@pytest.mark.asyncio
+async def test_arrow_response():
+    response = await columnar_response(_rows(5), Row, ExportFormat.arrow, chunk_size=2)
+    assert response.media_type == ARROW_MEDIA_TYPE
+    reader = pa.ipc.open_stream(await _body(response))
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [2, 2, 1]
+    table = pa.Table.from_batches(batches)
+    assert table.column("name").to_pylist() == [f"row{i}" for i in range(5)]
+    assert table.column("count").to_pylist() == [None, 1, None, 3, None]
+    assert table.column("state").to_pylist() == ["off"] * 5
+    assert table.column("link").to_pylist() == ["http://example.com/a.jpg"] * 5
+    assert table.column("time").to_pylist()[1] == datetime(2023, 12, 27, 8, 1, tzinfo=timezone.utc)
+
+
+@pytest.mark.asyncio
+async def test_parquet_response():
+    response = await columnar_response(_rows(5), Row, ExportFormat.parquet, chunk_size=2)
+    assert response.media_type == PARQUET_MEDIA_TYPE
+    parquet = pq.ParquetFile(pa.BufferReader(await _body(response)))
+    assert parquet.metadata.num_row_groups == 3
+    assert parquet.read().column("score").to_pylist() == [0, 0.5, 1, 1.5, 2]
+
+    # an empty result is still a valid file with the schema
+    response = await columnar_response(_rows(0), Row, ExportFormat.parquet)
+    table = pq.read_table(pa.BufferReader(await _body(response)))
+    assert table.num_rows == 0
+    assert table.schema.names == arrow_schema(Row).names
+
+
+@pytest.mark.asyncio
+async def test_columnar_response_error():
+    # raised before the response starts
+    with pytest.raises(ValueError):
+        await columnar_response(_rows(3, fail=True), Row, ExportFormat.arrow)
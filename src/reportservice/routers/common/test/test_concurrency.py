@@ -0,0 +1,43 @@
+import time
+import asyncio
+import pytest
+from ..concurrency import gather_with_concurrency
+
+
+async def _sleep_and_return(value, delay=0.05):
+    await asyncio.sleep(delay)
+    return value
+
+
+@pytest.mark.asyncio
+async def test_gather_with_concurrency():
+    start = time.perf_counter()
+    results = await gather_with_concurrency(10, {str(i): _sleep_and_return(i) for i in range(5)})
+    elapsed = time.perf_counter() - start
+    assert results == {str(i): i for i in range(5)}
+    assert elapsed < 0.2  # close to the slowest one, not the sum
+
+
+@pytest.mark.asyncio
+async def test_gather_with_concurrency_limit():
+    running = 0
+    max_running = 0
+
+    async def _track():
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    await gather_with_concurrency(2, {str(i): _track() for i in range(6)})
+    assert max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_gather_with_concurrency_error():
+    async def _fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await gather_with_concurrency(1, {"fail": _fail(), "slow": _sleep_and_return(1, 10)})
@@ -0,0 +1,39 @@
+import asyncio
+import operator
+import time
+import pytest
+from ..executor import ExecutorKind, StageExecutor
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", [ExecutorKind.off, ExecutorKind.thread, ExecutorKind.process])
+async def test_stage_executor(kind):
+    executor = StageExecutor(kind, workers=2)
+    await executor.start()
+    try:
+        results = await asyncio.gather(*[executor.run("add", operator.add, i, 1) for i in range(5)])
+        assert results == [1, 2, 3, 4, 5]
+        with pytest.raises(TypeError):
+            await executor.run("add", operator.add, "a", 1)
+
+        metrics = executor.metrics()
+        assert metrics.kind == kind
+        assert metrics.in_flight == 0
+        assert metrics.stages["add"].count == 5
+        assert metrics.stages["add"].errors == 1
+        assert metrics.stages["add"].max_seconds >= metrics.stages["add"].mean_seconds
+    finally:
+        executor.shutdown()
+    assert executor.metrics().kind == ExecutorKind.off
+
+
+@pytest.mark.asyncio
+async def test_stage_executor_queue_depth():
+    executor = StageExecutor(ExecutorKind.thread, workers=1)
+    await executor.start()
+    try:
+        await asyncio.gather(*[executor.run("sleep", time.sleep, 0.01) for _ in range(3)])
+        assert executor.metrics().max_queue_depth == 2
+        assert executor.metrics().stages["sleep"].wait_seconds > 0
+    finally:
+        executor.shutdown()
@@ -0,0 +1,51 @@
+import json
+import pytest
+from pydantic import BaseModel
+from starlette.requests import Request
+from ..streaming import NDJSON_MEDIA_TYPE, ndjson_response, wants_ndjson
+
+
+class Item(BaseModel):
+    value: int
+
+
+async def _items(n: int, fail: bool = False):
+    if fail:
+        raise ValueError("bad query")
+    for i in range(n):
+        yield Item(value=i)
+
+
+async def _body(response) -> list:
+    lines = [line async for line in response.body_iterator]
+    return [json.loads(line) for line in "".join(lines).splitlines()]
+
+
+def _request(accept: str) -> Request:
+    return Request({"type": "http", "headers": [(b"accept", accept.encode())]})
+
+
+def test_wants_ndjson():
+    assert wants_ndjson(_request(NDJSON_MEDIA_TYPE))
+    assert wants_ndjson(_request("application/json"), stream=True)
+    assert not wants_ndjson(_request("application/json"))
+
+
+@pytest.mark.asyncio
+async def test_ndjson_response():
+    response = await ndjson_response(_items(3))
+    assert response.media_type == NDJSON_MEDIA_TYPE
+    assert await _body(response) == [{"value": 0}, {"value": 1}, {"value": 2}, {"count": 3}]
+
+    response = await ndjson_response(_items(0), lambda n: {"count": n, "next": None})
+    assert await _body(response) == [{"count": 0, "next": None}]
+
+    response = await ndjson_response(_items(2), dump=lambda item: json.dumps({"v": item.value}))
+    assert await _body(response) == [{"v": 0}, {"v": 1}, {"count": 2}]
+
+
+@pytest.mark.asyncio
+async def test_ndjson_response_error():
+    # raised before the response starts
+    with pytest.raises(ValueError):
+        await ndjson_response(_items(3, fail=True))
@@ -1,17 +1,20 @@
+import asyncio
 import logging
 from base64 import b64encode, b64decode
 from datetime import datetime
 from motor.motor_asyncio import AsyncIOMotorCollection
 from ..stat import (
-    get_people_count,
-    get_inout_count,
-    get_has_sample_count,
-    get_people_inout,
-    get_should_checkinout_count,
+    AttendanceRollup,
+    PersonInout,
+    get_directory_summary,
+    get_inout_count_windows,
+    get_people_inout_adaptive,
 )
-from ..common import AsyncEmailSpammer
-from .excel import fill_personinout_to_excel, excel_to_html, convert_personinout_to_excel
+from ..common import AsyncEmailSpammer, ExecutorKind, StageExecutor, gather_with_concurrency
+from ..common.columnar import ipc_bytes
+from ...settings import settings
 from .models import ContentModel, ContentModelRendered, ContentQueryResult
+from .stages import render_attachment, render_table
 
 
 def get_weekday_vn(today):
@@ -30,42 +33,62 @@ async def query(
     content: ContentModel,
     query_date: datetime,
     logger: logging.Logger,
+    concurrency: int | None = None,
+    rollup: AttendanceRollup | None = None,
 ) -> ContentQueryResult:
+    """run all the queries of a content concurrently, at most `concurrency` queries at the same time.
+    Default concurrency is taken from `settings.QUERY_CONCURRENCY`"""
+    if concurrency is None:
+        concurrency = settings.QUERY_CONCURRENCY
     day_begin = datetime.combine(date=query_date.date(), time=datetime.min.time())
     day_end = datetime.combine(date=query_date.date(), time=datetime.max.time())
     in_begin = datetime.combine(date=query_date.date(), time=content.checkin_begin.time())
     in_end = in_begin + content.checkin_duration
     out_begin = datetime.combine(date=query_date.date(), time=content.checkout_begin.time())
     out_end = out_begin + content.checkout_duration
-    people_count = await get_people_count(staff_collection)
-    has_sample_count = await get_has_sample_count(staff_collection)
-    checkin_count = await get_inout_count(bodyfacename_collection, in_begin, in_end)
-    checkout_count = await get_inout_count(bodyfacename_collection, out_begin, out_end)
-    total_count = await get_inout_count(bodyfacename_collection, day_begin, day_end)
-
-    people_inout = await get_people_inout(
-        staff_collection, bodyfacename_collection, content.query_parameters, day_begin, day_end, logger
-    )
 
-    should_checkinout_count = await get_should_checkinout_count(staff_collection)
-
-    return ContentQueryResult(
-        query_time=query_date,
-        people_count=people_count,
-        checkin_count=checkin_count,
-        checkout_count=checkout_count,
-        total_count=total_count,
-        people_inout=people_inout,
-        should_checkinout_count=should_checkinout_count,
-        has_sample_count=has_sample_count,
+    # these queries do not depend on each other
+    results = await gather_with_concurrency(
+        concurrency,
+        {
+            "directory": get_directory_summary(staff_collection),
+            "inout_counts": get_inout_count_windows(
+                bodyfacename_collection,
+                {
+                    "checkin_count": (in_begin, in_end),
+                    "checkout_count": (out_begin, out_end),
+                    "total_count": (day_begin, day_end),
+                },
+            ),
+            "people_inout": get_people_inout_adaptive(
+                staff_collection,
+                bodyfacename_collection,
+                content.query_parameters,
+                day_begin,
+                day_end,
+                logger,
+                rollup=rollup,
+            ),
+        },
+        logger,
     )
 
+    results.update(results.pop("inout_counts"))
+    results.update(results.pop("directory").model_dump())
+
+    return ContentQueryResult(query_time=query_date, **results)
+
 
 async def render(
     query_result: ContentQueryResult,
     content: ContentModel,
+    executor: StageExecutor | None = None,
+    excel: bytes | None = None,
 ) -> ContentModelRendered:
-    """render the content to a ContentModelRendered"""
+    """render the content to a ContentModelRendered, `excel` is the file uploaded for the content, if any.
+    The table and the excel file are built by `executor`, on the event loop if it is None"""
+    if executor is None:
+        executor = StageExecutor(ExecutorKind.off)
 
     data = {  # noqa: F841
         "year": query_result.query_time.year,
@@ -86,17 +109,15 @@ async def render(
         "table": "",
     }
 
-    # convert query_result.people_inout to excel table
-    excel_bytes = b64decode(str(content.excel).encode("utf-8"))  # noqa: F841
+    # the table is rendered from the report dataframe, the excel file is only written to be attached
+    inout = ipc_bytes(query_result.people_inout.values, PersonInout)
+    table = executor.run("table", render_table, inout, content.id, excel)
     fill_excel_bytes = None
-    if content.is_excel_uploaded():
-        fill_excel_bytes = fill_personinout_to_excel(query_result.people_inout, excel_bytes)
-        html = excel_to_html(fill_excel_bytes)
-        data["table"] = html
+    if content.attach is True:
+        attachment = executor.run("attachment", render_attachment, inout, content.id, excel)
+        data["table"], fill_excel_bytes = await asyncio.gather(table, attachment)
     else:
-        fill_excel_bytes = convert_personinout_to_excel(query_result.people_inout)
-        html = excel_to_html(fill_excel_bytes)
-        data["table"] = html
+        data["table"] = await table
 
     to = ",".join(content.to)
     cc = ",".join(content.cc)
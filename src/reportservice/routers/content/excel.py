@@ -46,7 +46,7 @@ def read_excel_validate(excel_bytes: bytes) -> pd.DataFrame | None:
     return df
 
 
-def fill_excel(excel_bytes: bytes, filldata: pd.DataFrame) -> bytes | None:
+def fill_excel(excel_bytes: bytes, filldata: pd.DataFrame, columns: pd.Index | None = None) -> bytes | None:
     """fill the data from `filldata` into the excel file stored in `excel_bytes`
     `filldate` must have all the same columns, with same order, as `excel_bytes`
     By doing this, all the cell format in excel_bytes will not be changes.
@@ -58,13 +58,15 @@ def fill_excel(excel_bytes: bytes, filldata: pd.DataFrame) -> bytes | None:
             excel_bytes = f.read()
         ```
         filldata (pd.DataFrame): data to fill into excel_bytes
+        columns (pd.Index | None): the columns of `excel_bytes` if they are already known, read from it if None
 
     Returns:
         bytes | None: return None if there is something wrong
     """
     # Validate the `excel_bytes` and `filldata` has the same columns
-    df = read_excel_validate(excel_bytes)
-    if not df.columns.equals(filldata.columns):
+    if columns is None:
+        columns = read_excel_validate(excel_bytes).columns
+    if not columns.equals(filldata.columns):
         return None
 
     file_like_object = BytesIO(excel_bytes)
@@ -89,44 +91,40 @@ def fill_excel(excel_bytes: bytes, filldata: pd.DataFrame) -> bytes | None:
     return virtual_workbook.getvalue()
 
 
-def excel_to_html(excelbytes: bytes) -> str:
-    """given the excel file, convert it to html using pandas"""
-    df = read_excel_validate(excel_bytes=excelbytes)
+def frame_to_html(df: pd.DataFrame) -> str:
+    """convert a report dataframe to html, the same table as `excel_to_html` gives for the excel file written from it:
+    lower case headers, no unnamed columns, every cell as a string and empty cells blank"""
+    df = df.copy()
+    df.columns = [str(x).lower().strip() for x in df.columns]
 
     # Remove leading empty column
     df = df.loc[:, ~df.columns.str.startswith("unnamed:")]
 
-    return df.fillna("").to_html(index=False)
+    return df.fillna("").astype(str).to_html(index=False)
 
 
-def fill_personinout_to_excel(
-    people_inout: PersonInoutCollection,
-    excelbytes: bytes,
-) -> bytes:
-    """Fill excel file with PersonInout
-    In the excel file, only following columns will be filled:
-    - staffcode
-    - first recognition time
-    - last recognition time
-    - has_sample
+def excel_to_html(excelbytes: bytes) -> str:
+    """given the excel file, convert it to html using pandas"""
+    return frame_to_html(read_excel_validate(excel_bytes=excelbytes))
 
-    Args:
-        people_inout (PersonInoutCollection): the data to fill into excel file
-        excelbytes (bytes): bytestream of the excel file. Can be provide as
-        ```
-        with open('example.xlsx', 'rb') as f:
-            excel_bytes = f.read()
-        ```
 
-    Returns:
-        bytes: result excel file as bytestream
-    """
-    origin_df = read_excel_validate(excelbytes)
+def personinout_dataframe(people_inout: PersonInoutCollection | pd.DataFrame) -> pd.DataFrame:
+    """one row per PersonInout. A dataframe, e.g. read from an Arrow buffer, is copied"""
+    if isinstance(people_inout, pd.DataFrame):
+        return people_inout.copy()
+    return pd.DataFrame(jsonable_encoder(people_inout.values))
 
-    if people_inout.count == 0:
-        return excelbytes
 
-    result_df = pd.DataFrame(jsonable_encoder(people_inout.values))
+def fill_personinout_frame(
+    people_inout: PersonInoutCollection | pd.DataFrame, origin_df: pd.DataFrame
+) -> pd.DataFrame:
+    """the rows of the uploaded excel file `origin_df` (as read by `read_excel_validate`), with the columns
+    staffcode, first recognition time, last recognition time and has_sample filled from `people_inout`.
+    The columns and their order are the ones of `origin_df`"""
+    result_df = personinout_dataframe(people_inout)
+    if len(result_df) == 0:
+        return origin_df
+
     # TODO: ensure column name
     result_df.rename(
         columns={
@@ -153,25 +151,49 @@ def fill_personinout_to_excel(
     df[ExcelColumn.ELASTT] = (
         pd.to_datetime(df[ExcelColumn.ELASTT], utc=True).dt.tz_convert("Asia/Ho_Chi_Minh").dt.strftime("%H:%M:%S")
     )
-
-    outbytes = fill_excel(excelbytes, df)
-    return outbytes
+    return df
 
 
-def convert_personinout_to_excel(
+def fill_personinout_to_excel(
     people_inout: PersonInoutCollection,
+    excelbytes: bytes,
 ) -> bytes:
+    """Fill excel file with PersonInout
+    In the excel file, only following columns will be filled:
+    - staffcode
+    - first recognition time
+    - last recognition time
+    - has_sample
+
+    Args:
+        people_inout (PersonInoutCollection): the data to fill into excel file
+        excelbytes (bytes): bytestream of the excel file. Can be provide as
+        ```
+        with open('example.xlsx', 'rb') as f:
+            excel_bytes = f.read()
+        ```
+
+    Returns:
+        bytes: result excel file as bytestream
+    """
+    origin_df = read_excel_validate(excelbytes)
+
     if people_inout.count == 0:
+        return excelbytes
+
+    df = fill_personinout_frame(people_inout, origin_df)
+    outbytes = fill_excel(excelbytes, df, origin_df.columns)
+    return outbytes
+
+
+def personinout_frame(people_inout: PersonInoutCollection | pd.DataFrame) -> pd.DataFrame:
+    """the report dataframe of `people_inout` when no excel file is uploaded: sorted by unit, department and title,
+    numbered, with the recognition times formatted in local time"""
+    result_df = personinout_dataframe(people_inout)
+    if len(result_df) == 0:
         # create empty df with columns from ExcelColumn
-        empty_df = pd.DataFrame(
-            columns=[ExcelColumn.ESTAFF, ExcelColumn.EFIRST, ExcelColumn.ELASTT, ExcelColumn.ESAMPL]
-        )
-        # convert to excel
-        virtual_workbook = BytesIO()
-        empty_df.to_excel(virtual_workbook, startrow=2, index=False)  # startrow=2 is fixed to match input excel file
-        return virtual_workbook.getvalue()
-
-    result_df = pd.DataFrame(jsonable_encoder(people_inout.values))
+        return pd.DataFrame(columns=[ExcelColumn.ESTAFF, ExcelColumn.EFIRST, ExcelColumn.ELASTT, ExcelColumn.ESAMPL])
+
     result_df.fillna("", inplace=True)
     result_df.rename(
         columns={
@@ -249,9 +271,17 @@ def convert_personinout_to_excel(
         "haha",
     ]
     columns = [x for x in columns if x in result_df.columns]
-    result_df = result_df[columns]
+    return result_df[columns]
 
-    # convert to excel
+
+def frame_to_excel(df: pd.DataFrame) -> bytes:
+    """write a report dataframe to a new excel file, with the heading at the row 3 like the uploaded files"""
     virtual_workbook = BytesIO()
-    result_df.to_excel(virtual_workbook, startrow=2, index=False)  # startrow=2 is fixed to match input excel file
+    df.to_excel(virtual_workbook, startrow=2, index=False)  # startrow=2 is fixed to match input excel file
     return virtual_workbook.getvalue()
+
+
+def convert_personinout_to_excel(
+    people_inout: PersonInoutCollection,
+) -> bytes:
+    return frame_to_excel(personinout_frame(people_inout))
@@ -0,0 +1,75 @@
+"""light listings of the contents: only the metadata fields asked for, in pages resumed on _id
+
+The full content documents used to be read and validated for a listing, excel file and templates included.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Any, AsyncIterator, Dict, List
+from bson import json_util
+from motor.motor_asyncio import AsyncIOMotorCollection
+from ..stat.models import QueryException
+from .models import ContentModelSummary, ContentModelSummaryCollection
+
+# the fields which can be listed, the _id is always there
+LISTED_FIELDS = [name for name in ContentModelSummary.model_fields if name != "id"]
+# listed by default: everything but the templates (the excel file is never listed)
+DEFAULT_FIELDS = [name for name in LISTED_FIELDS if name not in ("subject_template", "body_template")]
+
+
+def parse_fields(fields: str | None) -> List[str]:
+    """the comma separated `fields`, DEFAULT_FIELDS if None. Raise QueryException on an unknown field"""
+    if fields is None:
+        return DEFAULT_FIELDS
+    ret = []
+    for name in fields.split(","):
+        name = name.strip()
+        if name in ("", "id", "_id"):
+            continue
+        if name not in LISTED_FIELDS:
+            raise QueryException(f"unknown field {name}, the fields are {', '.join(LISTED_FIELDS)}")
+        ret.append(name)
+    return ret
+
+
+def encode_token(content_id: Any) -> str:
+    raw = json_util.dumps({"i": content_id})
+    return urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_token(token: str) -> Any:
+    try:
+        raw = urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("utf-8")
+        return json_util.loads(raw)["i"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise QueryException(f"invalid continuation token: {token}") from e
+
+
+async def iter_contents(
+    collection: AsyncIOMotorCollection,
+    fields: List[str],
+    offset: int = 0,
+    limit: int = 0,
+    after: str | None = None,
+    page: ContentModelSummaryCollection | None = None,
+) -> AsyncIterator[ContentModelSummary]:
+    """yield the contents sorted by _id, with only `fields`, `limit` at a time (0: all of them).
+    The token of the next page is set in `page.next` once the contents are exhausted.
+    Raise QueryException if `after` is not a valid token."""
+    query: Dict[str, Any] = {}
+    if after is not None:
+        query["_id"] = {"$gt": decode_token(after)}
+    projection = dict.fromkeys(fields, 1)
+    # one more content tells whether there is a next page
+    cursor = collection.find(query, projection or {"_id": 1}).sort("_id", 1).skip(offset)
+    if limit > 0:
+        cursor = cursor.limit(limit + 1)
+    count = 0
+    last_id = None
+    async for doc in cursor:
+        if limit > 0 and count == limit:
+            if page is not None:
+                page.next = encode_token(last_id)
+            break
+        count += 1
+        last_id = doc["_id"]
+        yield ContentModelSummary.model_validate(doc)
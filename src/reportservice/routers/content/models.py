@@ -7,6 +7,7 @@ from pydantic.functional_validators import AfterValidator
 from jinja2 import Environment, BaseLoader, Template
 from jinja2.exceptions import TemplateSyntaxError
 from ..stat import PersonInoutCollection
+from ..common.blobs import BlobRef
 from ..models import QueryParamters, ContentId
 
 
@@ -19,7 +20,6 @@ def validate_jinja(v: str) -> str:
 
 
 JinjaStr = Annotated[str, AfterValidator(validate_jinja)]
-ExcelAsStr = Annotated[str, "excel file in base64 string"]
 
 
 class ContentModelBase(BaseModel):
@@ -57,10 +57,41 @@ class ContentModelBase(BaseModel):
 
 
 class ContentModel(ContentModelBase):
-    excel: Optional[ExcelAsStr] = Field(None)
+    excel_ref: Optional[BlobRef] = Field(None, description="the uploaded excel file, download it from /{id}/download")
 
     def is_excel_uploaded(self):
-        return self.excel is not None
+        return self.excel_ref is not None
+
+
+class ContentModelSummary(BaseModel):
+    """a content in the listings, with only the fields asked for. Unset fields are left out of the responses"""
+
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: ContentId = Field(alias="_id")
+    name: Optional[str] = None
+    description: Optional[str] = None
+    to: Optional[List[str]] = None
+    cc: Optional[List[str]] = None
+    bcc: Optional[List[str]] = None
+    subject_template: Optional[str] = None
+    body_template: Optional[str] = None
+    attach: Optional[bool] = None
+    attach_name_template: Optional[str] = None
+    checkin_begin: Optional[datetime] = None
+    checkin_duration: Optional[timedelta] = None
+    checkout_begin: Optional[datetime] = None
+    checkout_duration: Optional[timedelta] = None
+    query_parameters: Optional[QueryParamters] = None
+    excel_ref: Optional[BlobRef] = None
+
+    def dump_json(self) -> str:
+        return self.model_dump_json(by_alias=True, exclude_unset=True)
+
+
+class ContentModelSummaryCollection(BaseModel):
+    values: List[ContentModelSummary] = []
+    next: Optional[str] = Field(None, description="token of the next page, None if this is the last page")
 
 
 class ContentModelCreate(ContentModelBase):
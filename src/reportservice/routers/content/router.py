@@ -1,42 +1,83 @@
-from base64 import b64encode, b64decode
 from typing import List, Optional
-from fastapi import APIRouter, HTTPException, status, UploadFile, File, Response
+from fastapi import APIRouter, HTTPException, status, UploadFile, File, Query, Request
 from datetime import datetime
 from pymongo.results import UpdateResult
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
-from .excel import read_excel_validate, ExcelInvalidException, ExcelColumn
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import NonNegativeInt
+from .excel import ExcelInvalidException
 from .models import (
     ContentModel,
     ContentModelCreate,
     ContentModelRendered,
+    ContentModelSummary,
+    ContentModelSummaryCollection,
     ContentModelUpdate,
     ContentQueryResult,
 )
 from ..models import TaskId, QueryParamters, ContentId
 from .content import render, send, query
+from .listing import iter_contents, parse_fields
+from .templates import ExcelTemplate
 from ..common import DepAppConfig, DepContentCollection, DepTaskCollection
 from ..common import DepStaffCollection, DepBodyFaceNameCollection, DepLogger
-from ..common import DepEmailSpammer
+from ..stat import DepRollup
+from ..common import DepEmailSpammer, DepStageExecutor, DepExcelStore, ExecutorMetrics
+from ..common.streaming import NDJSON_RESPONSES, ndjson_response, wants_ndjson
+from ..stat.models import QueryException
+from ..stat.explain import ExplainCollection, ExplainRecorder
 
 router = APIRouter()
 responses = {404: {"description": "No content found"}}
 
+# the excel file is only read by the renders and the download, never sent along with the content
+EXCEL_PROJECTION = {"excel": 0}
 
-@router.get("/", response_model=List[ContentModel])
-async def list_contents(collection: DepContentCollection, offset: int = 0, limit: int = 0):
-    """Get all contents"""
-    contents: List[ContentModel] = []
-    for doc in await collection.find().skip(offset).limit(limit).to_list(100):
-        this_content = ContentModel.model_validate(doc)
-        contents.append(this_content.model_dump())
-    return contents
+
+@router.get("/", response_model=List[ContentModelSummary], responses=NDJSON_RESPONSES)
+async def list_contents(
+    request: Request,
+    collection: DepContentCollection,
+    offset: NonNegativeInt = 0,
+    limit: NonNegativeInt = 0,
+    after: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="comma separated fields to list, the _id is always listed"),
+    stream: bool = False,
+):
+    """Get the contents sorted by id, `limit` at a time (0: all of them).
+    Only the metadata are listed: all the fields but the templates by default, or the `fields` asked for.
+    The excel file is never listed, download it from /{id}/download.
+    If there are more contents, the token of the next page is in the `X-Next-Token` header, pass it as `after`.
+    With `stream=true` or `Accept: application/x-ndjson`, the contents are streamed one per line,
+    followed by a trailer line `{"count": n, "next": token or null}`"""
+    try:
+        page = ContentModelSummaryCollection()
+        contents = iter_contents(collection, parse_fields(fields), offset, limit, after, page=page)
+        if wants_ndjson(request, stream):
+            return await ndjson_response(
+                contents, lambda n: {"count": n, "next": page.next}, dump=ContentModelSummary.dump_json
+            )
+        page.values = [content async for content in contents]
+    except QueryException as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    body = "[" + ",".join(content.dump_json() for content in page.values) + "]"
+    headers = {"X-Next-Token": page.next} if page.next is not None else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/executor/metrics")
+async def get_executor_metrics(executor: DepStageExecutor) -> ExecutorMetrics:
+    """Get the queue depth and the time of each stage of the render executor"""
+    if executor is None:
+        raise HTTPException(status_code=404, detail="The render executor is not started")
+    return executor.metrics()
 
 
 @router.get("/{id}", response_model=ContentModel, responses=responses)
 async def get_content(collection: DepContentCollection, id: ContentId):
     """Get a content by id"""
-    content = await collection.find_one({"_id": id})
+    content = await collection.find_one({"_id": id}, EXCEL_PROJECTION)
     if content is not None:
         return content
 
@@ -62,9 +103,14 @@ async def create_content(collection: DepContentCollection, content: ContentModel
     response_model=bool,
     responses=responses,
 )
-async def upload_excel(collection: DepContentCollection, id: ContentId, excelfile: UploadFile = File(...)):
+async def upload_excel(
+    collection: DepContentCollection, excel_store: DepExcelStore, id: ContentId, excelfile: UploadFile = File(...)
+):
     """upload the excel file for the content.\n
     NOTE: when upload excel file, the content will update its staff_codes"""
+    # before the file is read and stored
+    if await collection.find_one({"_id": id}, {"_id": 1}) is None:
+        raise HTTPException(status_code=404, detail=f"Content {id} not found")
     excel = await excelfile.read()
     # NOTE: check the len, if too large then should not be upload
     max_file_size = 10 * 1024 * 1024  # 10 MB in bytes
@@ -73,44 +119,39 @@ async def upload_excel(collection: DepContentCollection, id: ContentId, excelfil
         raise HTTPException(status_code=413, detail=error_message)
 
     try:
-        df = read_excel_validate(excel)
+        template = ExcelTemplate(excel)
     except ExcelInvalidException as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
 
-    new_staff_codes = df[ExcelColumn.ESTAFF].dropna().tolist()
+    new_staff_codes = template.staff_codes
 
     new_query_parameteres = QueryParamters(staffcodes=new_staff_codes)
 
-    base64_str = b64encode(excel).decode("utf-8")
-    result = await collection.update_one(
-        {"_id": id}, {"$set": {"excel": base64_str, "query_parameters": new_query_parameteres.model_dump()}}
-    )
+    ref = await excel_store.put(id, excel, {"query_parameters": new_query_parameteres.model_dump()})
 
-    if result.matched_count == 0:
+    if ref is None:
         raise HTTPException(status_code=404, detail=f"Content {id} not found")
-
-    return result.acknowledged
+    return True
 
 
 @router.get("/{id}/download", responses=responses)
-async def download_excel(collection: DepContentCollection, id: ContentId):
+async def download_excel(collection: DepContentCollection, excel_store: DepExcelStore, id: ContentId):
     """Download the excel file of the content"""
-    content = await collection.find_one({"_id": id})
-
-    if content is None:
-        raise HTTPException(status_code=404, detail=f"Content {id} not found")
+    content = await get_content(collection, id=id)
+    content = ContentModel.model_validate(content)
 
-    if "excel" not in content:
+    ref = await excel_store.resolve(id, content.excel_ref)
+    if ref is None:
         raise HTTPException(status_code=404, detail=f"The content {id} do not have excel")
 
-    excel_bytes = b64decode(str(content["excel"]).encode("utf-8"))
-    response = Response(content=excel_bytes, media_type="application/octet-stream")
-
     # Set the Content-Disposition header to suggest a filename
     filename = "data.xlsx"
-    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
-
-    return response
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Content-Length": str(ref.size),
+        "ETag": f'"{ref.sha256}"',
+    }
+    return StreamingResponse(excel_store.iter_chunks(id, ref), media_type="application/octet-stream", headers=headers)
 
 
 @router.delete(
@@ -123,7 +164,10 @@ async def download_excel(collection: DepContentCollection, id: ContentId):
     },
 )
 async def delete_content(
-    content_collection: DepContentCollection, task_collection: DepTaskCollection, id: ContentId
+    content_collection: DepContentCollection,
+    task_collection: DepTaskCollection,
+    excel_store: DepExcelStore,
+    id: ContentId,
 ) -> None:
     """delete a content which linked with no task. If there are tasks using this content, abort and raise error"""
     task = await task_collection.find_one({"content_id": id})
@@ -133,9 +177,10 @@ async def delete_content(
             detail="There are tasks using this content, query to {content_id}/tasks to view them",
         )
 
-    delete_result = await content_collection.delete_one({"_id": id})
+    deleted = await content_collection.find_one_and_delete({"_id": id}, projection={"excel_ref": 1})
 
-    if delete_result.deleted_count == 1:
+    if deleted is not None:
+        await excel_store.discard(deleted.get("excel_ref"))
         return JSONResponse(status_code=status.HTTP_204_NO_CONTENT, content=f"Content {id} has been deleted")
 
     raise HTTPException(status_code=404, detail=f"Content {id} not found")
@@ -169,32 +214,50 @@ async def update_content(content_collection: DepContentCollection, id: ContentId
             {"_id": id}, {"$set": jsonable_encoder(content)}
         )
         if update_result.modified_count == 1:
-            if (updated_content := await content_collection.find_one({"_id": id})) is not None:
+            if (updated_content := await content_collection.find_one({"_id": id}, EXCEL_PROJECTION)) is not None:
                 return updated_content
 
-    if (existing_content := await content_collection.find_one({"_id": id})) is not None:
+    if (existing_content := await content_collection.find_one({"_id": id}, EXCEL_PROJECTION)) is not None:
         return existing_content
 
     raise HTTPException(status_code=404, detail=f"Content {id} not found")
 
 
-@router.get("/{id}/query", response_description="Query Result", response_model=ContentQueryResult, responses=responses)
+@router.get(
+    "/{id}/query",
+    response_description="Query Result",
+    response_model=ContentQueryResult | ExplainCollection,
+    responses=responses,
+)
 async def query_content(
     content_collection: DepContentCollection,
     app_config: DepAppConfig,
     staff_collection: DepStaffCollection,
     bodyfacename_collection: DepBodyFaceNameCollection,
     logger: DepLogger,
+    rollup: DepRollup,
     id: ContentId,
     query_date: Optional[datetime] = None,
+    explain: bool = False,
 ):
-    """Query the content with the data of query_date, default for today"""
+    """Query the content with the data of query_date, default for today.
+    If explain is true, return the execution stats of the pipelines instead"""
     if query_date is None:
         query_date = datetime.now()
     content = await get_content(content_collection, id=id)
     content = ContentModel.model_validate(content)
 
-    query_result = await query(staff_collection, bodyfacename_collection, content, query_date, logger)
+    recorder = ExplainRecorder(enabled=explain)
+    query_result = await query(
+        recorder.wrap(staff_collection),
+        recorder.wrap(bodyfacename_collection),
+        content,
+        query_date,
+        logger,
+        rollup=rollup,
+    )
+    if explain:
+        return await recorder.explain()
 
     logger.debug(query_result, extra={"id": id})
     return query_result
@@ -209,16 +272,23 @@ async def query_render_content(
     staff_collection: DepStaffCollection,
     bodyfacename_collection: DepBodyFaceNameCollection,
     logger: DepLogger,
+    rollup: DepRollup,
+    executor: DepStageExecutor,
+    excel_store: DepExcelStore,
     id: ContentId,
     render_date: Optional[datetime] = None,
 ):
     """Render the content with the data of render_date, default for today"""
-    query_result = await query_content(
-        content_collection, app_config, staff_collection, bodyfacename_collection, logger, id, render_date
-    )
+    if render_date is None:
+        render_date = datetime.now()
+    # read once, for the queries and the render
     content = await get_content(content_collection, id=id)
     content = ContentModel.model_validate(content)
-    text = await render(query_result, content)
+    query_result = await query(staff_collection, bodyfacename_collection, content, render_date, logger, rollup=rollup)
+    logger.debug(query_result, extra={"id": id})
+    ref = await excel_store.resolve(content.id, content.excel_ref)
+    excel = await excel_store.read(content.id, ref) if ref is not None else None
+    text = await render(query_result, content, executor, excel)
     return text
 
 
@@ -229,6 +299,9 @@ async def render_and_send(
     staff_collection: DepStaffCollection,
     bodyfacename_collection: DepBodyFaceNameCollection,
     logger: DepLogger,
+    rollup: DepRollup,
+    executor: DepStageExecutor,
+    excel_store: DepExcelStore,
     spammer_getter: DepEmailSpammer,
     id: ContentId,
     render_date: Optional[datetime] = None,
@@ -237,7 +310,16 @@ async def render_and_send(
     if render_date is None:
         render_date = datetime.now()
     text = await query_render_content(
-        content_collection, app_config, staff_collection, bodyfacename_collection, logger, id, render_date
+        content_collection,
+        app_config,
+        staff_collection,
+        bodyfacename_collection,
+        logger,
+        rollup,
+        executor,
+        excel_store,
+        id,
+        render_date,
     )
 
     spammer = spammer_getter()
@@ -0,0 +1,36 @@
+"""The CPU bound stages of a render, run by the stage executor out of the event loop
+
+They take the people in-out as an Arrow IPC buffer and the excel file of the content, and return strings or bytes,
+so they can run in a worker process. Each process has its own template cache, filled by the renders only: the entries
+are keyed by the hash of the excel, a new upload is parsed again by the workers and the old entries age out.
+"""
+
+import pandas as pd
+import pyarrow as pa
+from .excel import fill_personinout_frame, frame_to_excel, frame_to_html, personinout_frame
+from .templates import template_cache
+
+
+def _read_inout(inout: bytes) -> pd.DataFrame:
+    return pa.ipc.open_stream(inout).read_pandas()
+
+
+def render_table(inout: bytes, content_id: str, excel: bytes | None) -> str:
+    """the html table of the report"""
+    df = _read_inout(inout)
+    if excel is None:
+        return frame_to_html(personinout_frame(df))
+    template = template_cache.lookup(content_id, excel)
+    return frame_to_html(fill_personinout_frame(df, template.frame))
+
+
+def render_attachment(inout: bytes, content_id: str, excel: bytes | None) -> bytes:
+    """the excel file of the report"""
+    df = _read_inout(inout)
+    if excel is None:
+        return frame_to_excel(personinout_frame(df))
+    template = template_cache.lookup(content_id, excel)
+    if len(df) == 0:
+        # nothing to fill, the uploaded file is attached as it is
+        return template.excel_bytes
+    return template.fill(fill_personinout_frame(df, template.frame))
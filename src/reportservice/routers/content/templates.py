@@ -0,0 +1,78 @@
+"""Cache of the uploaded excel templates, parsed once per content
+
+A render used to read the excel file of the content with pandas to get its columns, and load it again
+with openpyxl to fill it. The template keeps the parsed rows (staff codes and header layout) and the raw file,
+cached by content id and a hash of the excel, so a new upload never hits an old entry: there is nothing to invalidate.
+Each process has its own cache (see stages.py), the entry of a replaced file is dropped by the first render of the new
+one, the entry of a deleted content ages out of the LRU.
+No workbook is shared between the renders: each fill loads its own from the raw file, a fill can not leak
+anything (cells, styles, dimensions) into the next one.
+"""
+
+import hashlib
+import threading
+from typing import Hashable, List
+import pandas as pd
+from ..common.lru import LRUCache, CacheStats
+from ...settings import settings
+from .excel import fill_excel, read_excel_validate
+from .models import ExcelColumn
+
+
+class ExcelTemplate:
+    """an uploaded excel file, parsed once. `frame` is shared by all the renders and must not be modified"""
+
+    def __init__(self, excel_bytes: bytes):
+        self.excel_bytes = excel_bytes
+        self.frame = read_excel_validate(excel_bytes)
+        self.columns: pd.Index = self.frame.columns
+        self.staff_codes: List[str] = self.frame[ExcelColumn.ESTAFF].dropna().tolist()
+
+    def fill(self, filldata: pd.DataFrame) -> bytes | None:
+        """same as `fill_excel` on the template, without reading its columns again.
+        None if `filldata` does not have the columns of the template"""
+        return fill_excel(self.excel_bytes, filldata, self.columns)
+
+
+class TemplateCache:
+    """also used from the worker threads of the render stages, the LRU is guarded by a lock"""
+
+    def __init__(self, maxsize: int = 32):
+        self.lru = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(content_id: str, excel: bytes) -> Hashable:
+        return (content_id, hashlib.sha256(excel).hexdigest())
+
+    def lookup(self, content_id: str, excel: bytes) -> ExcelTemplate:
+        """the parsed template of the excel file of the content.
+        Raise ExcelInvalidException if the file can not be read"""
+        key = self.make_key(content_id, excel)
+        with self._lock:
+            template = self.lru.get(key)
+        if template is None:
+            template = ExcelTemplate(excel)
+            self.put(content_id, excel, template)
+        return template
+
+    def put(self, content_id: str, excel: bytes, template: ExcelTemplate):
+        """cache the template of the content, its previous templates are dropped"""
+        with self._lock:
+            self._drop(content_id)
+            self.lru.set(self.make_key(content_id, excel), template)
+
+    def _drop(self, content_id: str):
+        for key in self.lru.keys():
+            if key[0] == content_id:
+                self.lru.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self.lru.clear()
+
+    def stats(self) -> CacheStats:
+        return self.lru.stats()
+
+
+template_cache = TemplateCache(maxsize=settings.TEMPLATE_CACHE_MAXSIZE)
@@ -1 +1,89 @@
+from base64 import b64decode
+from datetime import datetime
+import pytest
+from ...common import ExecutorKind, StageExecutor
+from ...common.columnar import ipc_bytes
+from ...stat import PersonInout, PersonInoutCollection
+from ..excel import excel_to_html, fill_personinout_frame, frame_to_html, personinout_frame
+from ..models import ContentModel, ContentQueryResult
 from ..content import render
+from ..stages import render_table
+from ..templates import ExcelTemplate
+
+
+@pytest.mark.parametrize("with_template", [False, True])
+def test_render_table_from_arrow(excelbytes, with_template):
+    """the table rendered from the Arrow buffer is the one rendered from the collection"""
+    template = ExcelTemplate(excelbytes)
+    records = [
+        (datetime(2021, 1, 1, 8), datetime(2021, 1, 1, 17)),
+        (None, None),
+        (datetime(2021, 1, 1, 8, 30), None),
+        (None, datetime(2021, 1, 1, 16, 45)),
+    ]
+    values = [
+        PersonInout(
+            staff_code=code,
+            sample_state="ready_to_checkin_checkout",
+            first_record=first,
+            last_record=last,
+            working_state="zombie",
+        )
+        # staffs of the template, so that their rows are filled
+        for code, (first, last) in zip(template.staff_codes, records, strict=False)
+    ]
+    collection = PersonInoutCollection(count=len(values), values=values)
+    if with_template:
+        excel = excelbytes
+        expected = frame_to_html(fill_personinout_frame(collection, template.frame))
+    else:
+        excel = None
+        expected = frame_to_html(personinout_frame(collection))
+    assert render_table(ipc_bytes(values, PersonInout), "render", excel) == expected
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", [ExecutorKind.thread, ExecutorKind.process])
+async def test_render_in_executor(excelbytes, kind):
+    values = [
+        PersonInout(
+            staff_code=code,
+            sample_state="ready_to_checkin_checkout",
+            first_record=datetime(2021, 1, 1, 8),
+            last_record=datetime(2021, 1, 1, 17),
+            working_state="zombie",
+        )
+        for code in ["206424", "220560"]
+    ]
+    query_result = ContentQueryResult(
+        query_time=datetime(2021, 1, 1, 18),
+        people_count=2,
+        checkin_count=2,
+        checkout_count=2,
+        should_checkinout_count=2,
+        has_sample_count=2,
+        total_count=2,
+        people_inout=PersonInoutCollection(count=len(values), values=values),
+    )
+    executor = StageExecutor(kind, workers=2)
+    await executor.start()
+    assert executor.kind == kind
+    try:
+        for excel in (None, excelbytes):
+            content = ContentModel(
+                name="render",
+                to=["example@example.com"],
+                subject_template="subject",
+                body_template="{{table}}",
+                attach=True,
+                checkin_begin="2000-01-01 07:00:00",
+                checkout_begin="2000-01-01 17:00:00",
+            )
+            inline = await render(query_result, content, excel=excel)
+            offloaded = await render(query_result, content, executor, excel)
+            assert offloaded.body == inline.body
+            assert excel_to_html(b64decode(offloaded.attach)) == excel_to_html(b64decode(inline.attach))
+    finally:
+        executor.shutdown()
+    assert executor.stages["table"].count == 2
+    assert executor.stages["attachment"].count == 2
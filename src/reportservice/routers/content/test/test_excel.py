@@ -10,6 +10,9 @@ from ..excel import (
     fill_personinout_to_excel,
     convert_personinout_to_excel,
     excel_to_html,
+    fill_personinout_frame,
+    frame_to_html,
+    personinout_frame,
 )
 
 
@@ -139,3 +142,13 @@ def test_convert_personinout_to_excel(some_personinout: PersonInoutCollection):
 
     with open("convert.html", "w") as f:
         f.write(excel_to_html(outbytes))
+
+
+def test_frame_to_html(excelbytes, some_personinout: PersonInoutCollection):
+    # the table rendered from the dataframe is the one read back from the excel file written from it
+    for inout in (some_personinout, PersonInoutCollection(count=0, values=[])):
+        html = frame_to_html(fill_personinout_frame(inout, read_excel_validate(excelbytes)))
+        assert html == excel_to_html(fill_personinout_to_excel(inout, excelbytes))
+
+        html = frame_to_html(personinout_frame(inout))
+        assert html == excel_to_html(convert_personinout_to_excel(inout))
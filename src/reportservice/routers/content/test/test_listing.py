@@ -0,0 +1,19 @@
+import pytest
+from ...stat.models import QueryException
+from ..listing import DEFAULT_FIELDS, decode_token, encode_token, parse_fields
+
+
+def test_parse_fields():
+    assert parse_fields(None) == DEFAULT_FIELDS
+    assert "body_template" not in DEFAULT_FIELDS
+    assert parse_fields("name, _id,attach,") == ["name", "attach"]
+    assert parse_fields("") == []
+    with pytest.raises(QueryException):
+        parse_fields("name,excel")
+
+
+def test_token():
+    for content_id in ["6c1b4a3e-0d0e-4bde-9a43-5b2a5e1c8f11", ""]:
+        assert decode_token(encode_token(content_id)) == content_id
+    with pytest.raises(QueryException):
+        decode_token("not a token")
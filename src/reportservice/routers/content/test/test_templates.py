@@ -0,0 +1,56 @@
+import io
+import zipfile
+from datetime import datetime
+import pytest
+from ...stat import PersonInoutCollection, PersonInout
+from ..excel import fill_excel, fill_personinout_frame
+from ..models import ExcelInvalidException
+from ..templates import ExcelTemplate, TemplateCache
+
+
+def _inout(staff_codes, hour: int) -> PersonInoutCollection:
+    values = [
+        PersonInout(
+            staff_code=code,
+            sample_state="ready_to_checkin_checkout",
+            first_record=datetime(2021, 1, 1, hour),
+            last_record=datetime(2021, 1, 1, hour + 1),
+            working_state="zombie",
+        )
+        for code in staff_codes
+    ]
+    return PersonInoutCollection(count=len(values), values=values)
+
+
+def _sheet(excel_bytes: bytes) -> bytes:
+    sheet = zipfile.ZipFile(io.BytesIO(excel_bytes)).read("xl/worksheets/sheet1.xml")
+    # written by openpyxl once the sheet has been saved, the default value
+    return sheet.replace(b' outlineLevelCol="0"', b"")
+
+
+def test_excel_template_fill(excelbytes):
+    template = ExcelTemplate(excelbytes)
+    assert len(template.staff_codes) > 5
+
+    # a fill does not change the next ones
+    for staff_codes, hour in [(template.staff_codes[:5], 1), (template.staff_codes[3:], 5), ([], 2)]:
+        df = fill_personinout_frame(_inout(staff_codes, hour), template.frame)
+        assert _sheet(template.fill(df)) == _sheet(fill_excel(excelbytes, df))
+        shorter = df.iloc[:10]
+        assert _sheet(template.fill(shorter)) == _sheet(fill_excel(excelbytes, shorter))
+
+    assert template.fill(df[df.columns[:2]]) is None
+
+
+def test_template_cache(excelbytes):
+    cache = TemplateCache(maxsize=4)
+    template = cache.lookup("content", excelbytes)
+    assert cache.lookup("content", excelbytes) is template
+    assert cache.stats().hits == 1
+
+    # a new upload is a new entry, the old one is dropped
+    assert cache.lookup("content", excelbytes + b"\0") is not template
+    assert len(cache.lru) == 1
+
+    with pytest.raises(ExcelInvalidException):
+        cache.lookup("content", b"invalid")
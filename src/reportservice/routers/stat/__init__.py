@@ -1,8 +1,18 @@
 from .retrieval import (
     get_people_count,
+    get_directory_summary,
     get_inout_count,
+    get_inout_count_approximate,
+    get_inout_count_windows,
     get_people_inout,
     get_has_sample_count,
     get_should_checkinout_count,
 )
-from .models import PersonInoutCollection, QueryParamters, PersonInout
+from .models import PersonInoutCollection, QueryParamters, PersonInout, TimeWindow, DirectorySummary, ApproximateCount
+from .rollup import AttendanceRollup
+from .live import LiveCounters
+from .sketches import DailySketches
+from .strategy import InoutStrategyName, get_people_inout_adaptive
+from .cache import stat_cache
+from .directory import directory_cache
+from .dependencies import DepRollup, DepLive, DepSketches
@@ -0,0 +1,134 @@
+"""Window-aware cache of the stat queries
+
+The cache key is the target collection plus the pipeline (or the filter), encoded with bson's json_util,
+so the same query on the same time window always hit the same entry.
+Results of windows which ended a while ago are kept for an hour: they rarely change, but the cameras may still upload
+a few late records (the rollup re-checks its recent days for the same reason).
+Results of windows which include "now" are kept only for a few seconds.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Hashable, List
+from bson import json_util
+from motor.motor_asyncio import AsyncIOMotorCollection
+from ..common.lru import LRUCache, CacheStats
+from ...settings import settings
+from .windows import as_utc
+
+
+class UncachedCollection:
+    """A collection proxy whose calls always reach mongo, e.g. to time the queries"""
+
+    bypass_cache = True
+
+    def __init__(self, collection: AsyncIOMotorCollection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+class ResultCache:
+    def __init__(
+        self,
+        maxsize: int = 512,
+        ttl_closed: float = 3600,
+        ttl_open: float = 15,
+        closed_after: timedelta = timedelta(minutes=10),
+        max_documents: int = 20000,
+    ):
+        self.lru = LRUCache(maxsize)
+        self.ttl_closed = ttl_closed
+        self.ttl_open = ttl_open
+        self.closed_after = closed_after
+        self.max_documents = max_documents
+
+    @staticmethod
+    def make_key(operation: str, collection: AsyncIOMotorCollection, command: Any) -> Hashable:
+        return (operation, collection.full_name, json_util.dumps(command))
+
+    def ttl(self, window_end: datetime, now: datetime | None = None) -> float:
+        if now is None:
+            now = datetime.now(timezone.utc)
+        if as_utc(window_end) < as_utc(now) - self.closed_after:
+            return self.ttl_closed
+        return self.ttl_open
+
+    @staticmethod
+    def enabled(collection: AsyncIOMotorCollection) -> bool:
+        return settings.STAT_CACHE_ENABLED and not getattr(collection, "bypass_cache", False)
+
+    async def stream(
+        self,
+        collection: AsyncIOMotorCollection,
+        pipeline: List[Dict],
+        window_end: datetime,
+        max_time_ms: int | None = None,
+    ) -> AsyncIterator[Dict]:
+        """yield the documents of the pipeline, from the cache if possible.
+        On a miss, the documents are yielded as they come from the cursor and cached once the cursor is exhausted.
+        `max_time_ms` bounds the server side execution, it is not part of the cache key.
+        """
+        kwargs = {} if max_time_ms is None else {"maxTimeMS": max_time_ms}
+        if not self.enabled(collection):
+            async for document in collection.aggregate(pipeline, **kwargs):
+                yield document
+            return
+
+        key = self.make_key("aggregate", collection, pipeline)
+        cached = self.lru.get(key)
+        if cached is not None:
+            for document in cached:
+                yield document
+            return
+
+        documents: List[Dict] | None = []
+        async for document in collection.aggregate(pipeline, **kwargs):
+            if documents is not None:
+                documents.append(document)
+                if len(documents) > self.max_documents:
+                    documents = None  # too large, do not keep it in memory
+            yield document
+        if documents is not None:
+            self.lru.set(key, documents, self.ttl(window_end))
+
+    async def aggregate(
+        self,
+        collection: AsyncIOMotorCollection,
+        pipeline: List[Dict],
+        window_end: datetime,
+        max_time_ms: int | None = None,
+    ) -> List[Dict]:
+        return [document async for document in self.stream(collection, pipeline, window_end, max_time_ms)]
+
+    async def count_documents(
+        self,
+        collection: AsyncIOMotorCollection,
+        condition: Dict,
+        window_end: datetime,
+        max_time_ms: int | None = None,
+    ) -> int:
+        kwargs = {} if max_time_ms is None else {"maxTimeMS": max_time_ms}
+        if not self.enabled(collection):
+            return await collection.count_documents(condition, **kwargs)
+        key = self.make_key("count_documents", collection, condition)
+        count = self.lru.get(key)
+        if count is None:
+            count = await collection.count_documents(condition, **kwargs)
+            self.lru.set(key, count, self.ttl(window_end))
+        return count
+
+    def stats(self) -> CacheStats:
+        return self.lru.stats()
+
+    def clear(self):
+        self.lru.clear()
+
+
+stat_cache = ResultCache(
+    maxsize=settings.STAT_CACHE_MAXSIZE,
+    ttl_closed=settings.STAT_CACHE_TTL_CLOSED,
+    ttl_open=settings.STAT_CACHE_TTL_OPEN,
+    closed_after=timedelta(seconds=settings.STAT_CACHE_CLOSED_AFTER),
+    max_documents=settings.STAT_CACHE_MAX_DOCUMENTS,
+)
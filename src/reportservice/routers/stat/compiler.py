@@ -0,0 +1,129 @@
+"""Compile the `$expr` of a custom staff query into a plain match filter
+
+A `$match` with an `$expr` (even inside one branch of an `$or`) can not use the indexes of the staff collection,
+every staff lookup then scans the whole collection. The simple expressions, comparisons of a field with a constant
+combined with `$and` / `$or`, are translated to the equivalent query operators which can use an index.
+Constant expressions are evaluated, so the default "never true" custom query disappears.
+The translation assumes the compared fields hold scalars of a single type, which is the case of the staff fields:
+unlike an expression, a match filter also matches the arrays containing the value and only compares the same types.
+In an expression a null or missing field is lower than any number or date, so `$lt` / `$lte` also match it.
+"""
+
+from datetime import datetime
+from typing import Any, Dict
+
+# the result of an expression which does not depend on the document
+ALWAYS = True
+NEVER = False
+
+_COMPARISONS = {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte"}
+# `5 < $field` is `$field > 5`
+_FLIPPED = {"$eq": "$eq", "$ne": "$ne", "$gt": "$lt", "$gte": "$lte", "$lt": "$gt", "$lte": "$gte"}
+_CONSTANT_TYPES = (str, int, float, bool, datetime)
+
+
+class NotCompilable(Exception):
+    """the expression has no equivalent match filter, it must stay an `$expr`"""
+
+
+def _is_field(operand: Any) -> bool:
+    return isinstance(operand, str) and operand.startswith("$") and not operand.startswith("$$")
+
+
+def _is_constant(operand: Any) -> bool:
+    # None is left out: a missing field compares differently in a match filter and in an expression
+    return isinstance(operand, _CONSTANT_TYPES) and not (isinstance(operand, str) and operand.startswith("$"))
+
+
+def _same_type(left: Any, right: Any) -> bool:
+    if isinstance(left, bool) or isinstance(right, bool):
+        return type(left) is type(right)
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return True
+    return type(left) is type(right)
+
+
+def _compare(op: str, left: Any, right: Any) -> bool:
+    if not _same_type(left, right):
+        # mongo orders the values of different types, python does not
+        raise NotCompilable(f"cannot compare {left!r} and {right!r}")
+    if op == "$eq":
+        return left == right
+    if op == "$ne":
+        return left != right
+    if op == "$gt":
+        return left > right
+    if op == "$gte":
+        return left >= right
+    if op == "$lt":
+        return left < right
+    return left <= right
+
+
+def _compile_comparison(op: str, operands: Any) -> Dict | bool:
+    if not isinstance(operands, list) or len(operands) != 2:
+        raise NotCompilable(f"{op} expects 2 operands")
+    left, right = operands
+    if _is_constant(left) and _is_constant(right):
+        return _compare(op, left, right)
+    if _is_field(right) and _is_constant(left):
+        op, left, right = _FLIPPED[op], right, left
+    if not (_is_field(left) and _is_constant(right)):
+        raise NotCompilable(f"{op} of {operands!r} is not a field compared to a constant")
+    if isinstance(right, str) and op not in ("$eq", "$ne"):
+        # string comparisons depend on the collation of the index, keep the expression
+        raise NotCompilable(f"{op} of a string")
+    field = left[1:]
+    if op == "$eq":
+        return {field: right}
+    if op in ("$lt", "$lte"):
+        # `{field: None}` matches the null and the missing fields, which a match filter never finds lower
+        return {"$or": [{field: {op: right}}, {field: None}]}
+    return {field: {op: right}}
+
+
+def _compile_in(operands: Any) -> Dict | bool:
+    if not isinstance(operands, list) or len(operands) != 2:
+        raise NotCompilable("$in expects 2 operands")
+    field, values = operands
+    if not _is_field(field) or not isinstance(values, list) or not all(_is_constant(v) for v in values):
+        raise NotCompilable(f"$in of {operands!r} is not a field in a list of constants")
+    if not values:
+        return NEVER
+    return {field[1:]: {"$in": values}}
+
+
+def _compile_logical(op: str, operands: Any) -> Dict | bool:
+    if not isinstance(operands, list):
+        raise NotCompilable(f"{op} expects a list")
+    absorbing, neutral = (NEVER, ALWAYS) if op == "$and" else (ALWAYS, NEVER)
+    branches = []
+    for operand in operands:
+        branch = compile_expr(operand)
+        if branch is absorbing:
+            return absorbing
+        if branch is not neutral:
+            branches.append(branch)
+    if not branches:
+        return neutral
+    if len(branches) == 1:
+        return branches[0]
+    return {op: branches}
+
+
+def compile_expr(expr: Any) -> Dict | bool:
+    """the match filter equivalent to the aggregation expression `expr`,
+    or ALWAYS / NEVER if it does not depend on the document.
+    Raise NotCompilable if there is no equivalent filter."""
+    if isinstance(expr, bool):
+        return expr
+    if not isinstance(expr, dict) or len(expr) != 1:
+        raise NotCompilable(f"{expr!r} is not a single operator expression")
+    op, operands = next(iter(expr.items()))
+    if op in _COMPARISONS:
+        return _compile_comparison(op, operands)
+    if op == "$in":
+        return _compile_in(operands)
+    if op in ("$and", "$or"):
+        return _compile_logical(op, operands)
+    raise NotCompilable(f"operator {op} is not supported")
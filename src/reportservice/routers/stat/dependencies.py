@@ -0,0 +1,32 @@
+from typing import Annotated
+from fastapi import Request, Depends
+from .rollup import AttendanceRollup
+from .live import LiveCounters
+from .sketches import DailySketches
+
+__all__ = [
+    "DepRollup",
+    "DepLive",
+    "DepSketches",
+]
+
+
+async def get_rollup(request: Request) -> AttendanceRollup | None:
+    return getattr(request.app, "rollup", None)
+
+
+DepRollup = Annotated[AttendanceRollup | None, Depends(get_rollup)]
+
+
+async def get_live(request: Request) -> LiveCounters | None:
+    return getattr(request.app, "live", None)
+
+
+DepLive = Annotated[LiveCounters | None, Depends(get_live)]
+
+
+async def get_sketches(request: Request) -> DailySketches | None:
+    return getattr(request.app, "sketches", None)
+
+
+DepSketches = Annotated[DailySketches | None, Depends(get_sketches)]
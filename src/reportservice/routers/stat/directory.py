@@ -0,0 +1,97 @@
+"""Cache of the staff directory counters
+
+The counters only change when the staff collection changes, which is rare compared to the report renders.
+A change stream on the staff collection drops the cached counters as soon as a staff is inserted, updated or
+deleted. Change streams need a replica set: on a standalone server the entries simply expire after the ttl.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import OperationFailure
+from ..common.lru import LRUCache, CacheStats
+from ...settings import settings
+from .models import DirectorySummary
+
+
+class DirectoryCache:
+    def __init__(self, ttl: float = 60, logger: logging.Logger | None = None):
+        if logger is None:
+            logger = logging.getLogger()
+        self.lru = LRUCache(maxsize=16)
+        self.ttl = ttl
+        self.logger = logger
+        self.watching: str | None = None  # full name of the watched collection
+        self.warned = False
+        self.generation = 0  # bumped by every invalidation
+
+    @staticmethod
+    def enabled(collection: AsyncIOMotorCollection) -> bool:
+        return settings.DIRECTORY_CACHE_ENABLED and not getattr(collection, "bypass_cache", False)
+
+    def get(self, collection: AsyncIOMotorCollection) -> DirectorySummary | None:
+        if not self.enabled(collection):
+            return None
+        return self.lru.get(collection.full_name)
+
+    def set(self, collection: AsyncIOMotorCollection, summary: DirectorySummary, generation: int):
+        """cache `summary`, counted after `generation` was read. It is dropped if the cache was invalidated since:
+        the counters may have been read before the change"""
+        if self.enabled(collection) and generation == self.generation:
+            self.lru.set(collection.full_name, summary, self.ttl)
+
+    def invalidate(self, collection: AsyncIOMotorCollection | None = None):
+        """drop the counters of `collection`, or of all the collections"""
+        self.generation += 1
+        if collection is None:
+            self.lru.clear()
+        else:
+            self.lru.pop(collection.full_name)
+
+    def stats(self) -> CacheStats:
+        return self.lru.stats()
+
+    async def watch(self, collection: AsyncIOMotorCollection, duration: float):
+        """invalidate the counters of `collection` on every change, for about `duration` seconds"""
+        deadline = time.monotonic() + duration
+        async with collection.watch(max_await_time_ms=1000) as stream:
+            self.watching = collection.full_name
+            # the changes made before the stream was opened are not seen
+            self.invalidate(collection)
+            while stream.alive and time.monotonic() < deadline:
+                change = await stream.try_next()
+                if change is not None:
+                    self.invalidate(collection)
+
+    async def run_forever(
+        self,
+        get_source: Callable[[], Awaitable[AsyncIOMotorCollection | None]],
+        interval: float,
+    ):
+        """watch the staff collection until cancelled. The source is resolved again every `interval` seconds,
+        so a new app config is picked up"""
+        while True:
+            try:
+                source = await get_source()
+                if source is None:
+                    await asyncio.sleep(interval)
+                else:
+                    await self.watch(source, interval)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                # e.g. not a replica set, only warn once as it will not get better
+                if not self.warned:
+                    self.logger.warning(f"cannot watch the staff collection, the cache falls back to the ttl: {e}")
+                    self.warned = True
+                await asyncio.sleep(interval)
+            except Exception as e:
+                self.logger.error(f"cannot watch the staff collection: {e}")
+                await asyncio.sleep(interval)
+            finally:
+                self.watching = None
+
+
+directory_cache = DirectoryCache(ttl=settings.DIRECTORY_CACHE_TTL)
@@ -0,0 +1,255 @@
+"""run the generated pipelines through mongo's explain and summarize the plans"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel, Field
+from motor.motor_asyncio import AsyncIOMotorCollection
+from ...indexes import IndexStatus
+from .models import QueryParamters, StaffCodeStr
+from .queries import (
+    query_find_staff,
+    query_find_staff_inout,
+    query_find_staff_inout_days,
+    pipeline_count,
+    pipeline_directory_summary,
+    pipeline_get_record_by_id,
+    pipeline_stat_by_camera,
+)
+
+
+class PlanSummary(BaseModel):
+    name: str = Field(description="what the pipeline is used for")
+    collection: str
+    stages: List[str] = Field([], description="stages of the winning plan, from the top")
+    indexes: List[str] = Field([], description="indexes used by the winning plan")
+    collscan: bool = Field(False, description="True if the winning plan scans the whole collection")
+
+
+class StageStats(BaseModel):
+    stage: str
+    n_returned: Optional[int] = None
+    docs_examined: Optional[int] = None
+    keys_examined: Optional[int] = None
+    index: Optional[str] = None
+    execution_time_ms: Optional[int] = Field(None, description="estimated time spent in this stage")
+
+
+class ExplainStats(BaseModel):
+    operation: str = Field(description="aggregate, count_documents or distinct")
+    collection: str
+    command: Any = Field(description="the pipeline or the filter sent to mongo")
+    n_returned: Optional[int] = None
+    docs_examined: int = 0
+    keys_examined: int = 0
+    indexes: List[str] = []
+    execution_time_ms: Optional[int] = None
+    stages: List[StageStats] = []
+
+
+class ExplainCollection(BaseModel):
+    count: int
+    values: List[ExplainStats]
+
+
+class IndexReport(BaseModel):
+    indexes: List[IndexStatus] = Field([], description="recommended indexes and whether they exist")
+    plans: List[PlanSummary] = Field([], description="winning plans of the generated pipelines")
+
+
+def _walk(node: Any, key: str, found: List):
+    """collect all values of `key` in a nested explain document, depth first"""
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == key:
+                found.append(v)
+            _walk(v, key, found)
+    elif isinstance(node, list):
+        for item in node:
+            _walk(item, key, found)
+
+
+def _walk_nodes(node: Any, key: str, found: List[Dict]):
+    """collect all sub documents containing `key` in a nested explain document, depth first"""
+    if isinstance(node, dict):
+        if key in node:
+            found.append(node)
+        for v in node.values():
+            _walk_nodes(v, key, found)
+    elif isinstance(node, list):
+        for item in node:
+            _walk_nodes(item, key, found)
+
+
+def winning_plans(explain: Dict) -> List[Dict]:
+    """all the winning plans in an explain output, whether the pipeline was pushed down to the query layer or not"""
+    plans: List[Dict] = []
+    _walk(explain, "winningPlan", plans)
+    return plans
+
+
+def summarize_plan(name: str, collection: str, explain: Dict) -> PlanSummary:
+    stages: List[str] = []
+    indexes: List[str] = []
+    for plan in winning_plans(explain):
+        _walk(plan, "stage", stages)
+        _walk(plan, "indexName", indexes)
+    return PlanSummary(
+        name=name,
+        collection=collection,
+        stages=stages,
+        indexes=list(dict.fromkeys(indexes)),
+        collscan="COLLSCAN" in stages,
+    )
+
+
+def summarize_execution(operation: str, collection: str, command: Any, explain: Dict) -> ExplainStats:
+    """summarize an explain output of verbosity executionStats"""
+    stats = ExplainStats(operation=operation, collection=collection, command=command)
+    execution_stats: List[Dict] = []
+    _walk(explain, "executionStats", execution_stats)
+    for es in execution_stats:
+        stats.docs_examined += es.get("totalDocsExamined", 0)
+        stats.keys_examined += es.get("totalKeysExamined", 0)
+        if "executionTimeMillis" in es:
+            stats.execution_time_ms = max(stats.execution_time_ms or 0, es["executionTimeMillis"])
+        if stats.n_returned is None and "nReturned" in es:
+            stats.n_returned = es["nReturned"]
+
+    # stages of the query layer
+    for es in execution_stats:
+        nodes: List[Dict] = []
+        _walk_nodes(es.get("executionStages", {}), "stage", nodes)
+        for node in nodes:
+            stats.stages.append(
+                StageStats(
+                    stage=node["stage"],
+                    n_returned=node.get("nReturned"),
+                    docs_examined=node.get("docsExamined"),
+                    keys_examined=node.get("keysExamined"),
+                    index=node.get("indexName"),
+                    execution_time_ms=node.get("executionTimeMillisEstimate"),
+                )
+            )
+            if node.get("indexName"):
+                stats.indexes.append(node["indexName"])
+
+    # stages of the aggregation layer, the first one is the $cursor already described above
+    for stage in explain.get("stages", []):
+        name = next((k for k in stage if k.startswith("$")), None)
+        if name is None or name == "$cursor":
+            continue
+        stats.stages.append(
+            StageStats(
+                stage=name,
+                n_returned=stage.get("nReturned"),
+                execution_time_ms=stage.get("executionTimeMillisEstimate"),
+            )
+        )
+
+    stats.indexes = list(dict.fromkeys(stats.indexes))
+    return stats
+
+
+async def explain_aggregate(
+    collection: AsyncIOMotorCollection, pipeline: List[Dict], verbosity: str = "queryPlanner"
+) -> Dict:
+    """explain an aggregation pipeline without returning its documents"""
+    command = {"explain": {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}}, "verbosity": verbosity}
+    return await collection.database.command(command)
+
+
+async def explain_count(
+    collection: AsyncIOMotorCollection, condition: Optional[Dict] = None, verbosity: str = "queryPlanner"
+) -> Dict:
+    """explain a count_documents call, which is an aggregation with $match and $group"""
+    pipeline = [{"$match": condition or {}}, {"$group": {"_id": 1, "n": {"$sum": 1}}}]
+    return await explain_aggregate(collection, pipeline, verbosity)
+
+
+async def explain_distinct(
+    collection: AsyncIOMotorCollection, key: str, condition: Optional[Dict] = None, verbosity: str = "queryPlanner"
+) -> Dict:
+    command = {"explain": {"distinct": collection.name, "key": key, "query": condition or {}}, "verbosity": verbosity}
+    return await collection.database.command(command)
+
+
+class RecordingCollection:
+    """A collection proxy which remembers every pipeline (or filter) sent to the wrapped collection,
+    the calls themselves are forwarded untouched"""
+
+    bypass_cache = True  # the explained calls must really reach mongo
+
+    def __init__(self, collection: AsyncIOMotorCollection, recorded: List[Tuple[str, AsyncIOMotorCollection, Any]]):
+        self._collection = collection
+        self._recorded = recorded
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        self._recorded.append(("aggregate", self._collection, pipeline))
+        return self._collection.aggregate(pipeline, *args, **kwargs)
+
+    async def count_documents(self, filter, *args, **kwargs):
+        self._recorded.append(("count_documents", self._collection, filter))
+        return await self._collection.count_documents(filter, *args, **kwargs)
+
+    async def distinct(self, key, filter=None, *args, **kwargs):
+        self._recorded.append(("distinct", self._collection, {"key": key, "query": filter}))
+        return await self._collection.distinct(key, filter, *args, **kwargs)
+
+
+class ExplainRecorder:
+    """Record the pipelines of a retrieval call, then explain them with executionStats.
+    When disabled, `wrap` and `result` are no-ops so the callers do not need two code paths.
+
+    ```
+    recorder = ExplainRecorder(enabled=explain)
+    count = await get_inout_count(recorder.wrap(collection), begin, end)
+    return await recorder.result(count)
+    ```
+    """
+
+    def __init__(self, enabled: bool = True, verbosity: str = "executionStats"):
+        self.enabled = enabled
+        self.verbosity = verbosity
+        self.recorded: List[Tuple[str, AsyncIOMotorCollection, Any]] = []
+
+    def wrap(self, collection: AsyncIOMotorCollection) -> AsyncIOMotorCollection:
+        if not self.enabled:
+            return collection
+        return RecordingCollection(collection, self.recorded)
+
+    async def explain(self) -> ExplainCollection:
+        values: List[ExplainStats] = []
+        for operation, collection, command in self.recorded:
+            if operation == "aggregate":
+                explain = await explain_aggregate(collection, command, self.verbosity)
+            elif operation == "count_documents":
+                explain = await explain_count(collection, command, self.verbosity)
+            else:
+                explain = await explain_distinct(collection, command["key"], command["query"], self.verbosity)
+            values.append(summarize_execution(operation, collection.full_name, command, explain))
+        return ExplainCollection(count=len(values), values=values)
+
+    async def result(self, value: Any) -> Any:
+        """the explain of the recorded calls if enabled, else `value` itself"""
+        if not self.enabled:
+            return value
+        return await self.explain()
+
+
+def generated_pipelines(
+    begin: datetime, end: datetime, staff_code: StaffCodeStr, threshold: float = 0.63
+) -> List[Tuple[str, str, List[Dict]]]:
+    """(name, "staff" or "face", pipeline) of the pipelines generated by the service, with sample parameters"""
+    return [
+        ("query_find_staff", "staff", query_find_staff(QueryParamters(staffcodes=[staff_code]))),
+        ("directory_summary", "staff", pipeline_directory_summary()),
+        ("count_inout", "face", pipeline_count(begin, end, threshold)),
+        ("query_find_staff_inout", "face", query_find_staff_inout([staff_code], begin, end, threshold, False)),
+        ("query_find_staff_inout_days", "face", query_find_staff_inout_days([staff_code], begin, end, threshold)),
+        ("person_record", "face", pipeline_get_record_by_id(begin, end, None, threshold)),
+        ("person_record_by_id", "face", pipeline_get_record_by_id(begin, end, staff_code, threshold)),
+        ("by_date_cam_stats", "face", pipeline_stat_by_camera(begin, end, None, threshold)),
+    ]
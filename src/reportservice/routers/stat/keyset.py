@@ -0,0 +1,39 @@
+"""opaque continuation tokens for keyset pagination on (image_time, _id), newest first"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import Any, Dict, NamedTuple
+from bson import json_util
+from .models import QueryException
+
+
+class RecordKey(NamedTuple):
+    image_time: datetime
+    id: Any
+
+
+def encode_token(key: RecordKey) -> str:
+    raw = json_util.dumps({"t": key.image_time, "i": key.id})
+    return urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_token(token: str) -> RecordKey:
+    try:
+        raw = urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("utf-8")
+        data = json_util.loads(raw)
+        key = RecordKey(data["t"], data["i"])
+    except (ValueError, TypeError, KeyError) as e:
+        raise QueryException(f"invalid continuation token: {token}") from e
+    if not isinstance(key.image_time, datetime):
+        raise QueryException(f"invalid continuation token: {token}")
+    return key
+
+
+def condition_after(key: RecordKey) -> Dict:
+    """the records strictly after `key` in the (image_time desc, _id desc) order"""
+    return {
+        "$or": [
+            {"image_time": {"$lt": key.image_time}},
+            {"image_time": key.image_time, "_id": {"$lt": key.id}},
+        ]
+    }
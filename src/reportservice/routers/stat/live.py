@@ -0,0 +1,186 @@
+"""Live counters of the current local day
+
+A watcher on the change stream of the BodyFaceName collection keeps, in memory, the distinct staffs and the
+number of records per camera of today. "Today" queries are then answered without touching the database.
+The watcher is started by the first query, rolls over at local midnight and resyncs from a full aggregation
+of the day every time the change stream is (re)opened.
+Only the default recognition conditions (threshold 0.63, no mask) are counted.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Optional, Set
+from zoneinfo import ZoneInfo
+from pydantic import BaseModel
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import OperationFailure
+from .queries import pipeline_live_day
+from .windows import as_utc, local_date, local_day_window
+
+LIVE_THRESHOLD = 0.63
+LIVE_HAS_MASK = False
+
+
+class LiveSnapshot(BaseModel):
+    source: Optional[str] = None
+    day: Optional[date] = None
+    synced: bool = False
+    count: int = 0
+    cameras: Dict[str, int] = {}
+    synced_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+class LiveCounters:
+    def __init__(
+        self,
+        tz: str = "Asia/Ho_Chi_Minh",
+        retry_interval: float = 60,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        if logger is None:
+            logger = logging.getLogger()
+        self.tz = ZoneInfo(tz)
+        self.retry_interval = retry_interval
+        self.logger = logger
+        self.source: str | None = None
+        self.day: date | None = None
+        self.staffs: Set[str] = set()
+        self.cameras: Counter = Counter()
+        self.synced = False
+        self.synced_at: datetime | None = None
+        self.updated_at: datetime | None = None
+        self.warned = False
+        self._task: asyncio.Task | None = None
+
+    def reset(self, day: date):
+        self.day = day
+        self.staffs = set()
+        self.cameras = Counter()
+
+    def rollover(self, now: datetime | None = None):
+        """start a new empty day once the local midnight is passed, nobody has been seen yet"""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        today = local_date(now, self.tz)
+        if self.day != today:
+            self.logger.debug(f"live counters roll over to {today}")
+            self.reset(today)
+
+    def apply(self, document: Dict, now: datetime | None = None):
+        """count an inserted record if it belongs to today"""
+        self.rollover(now)
+        image_time = document.get("image_time")
+        if not isinstance(image_time, datetime) or local_date(image_time, self.tz) != self.day:
+            return
+        if document.get("face_reg_score", 0) < LIVE_THRESHOLD or document.get("has_mask") != LIVE_HAS_MASK:
+            return
+        self.staffs.add(document.get("staff_id"))
+        self.cameras[document.get("camera_id")] += 1
+        self.updated_at = datetime.now(timezone.utc)
+
+    async def resync(self, source: AsyncIOMotorCollection, now: datetime | None = None):
+        """count the whole day again from the records"""
+        self.rollover(now)
+        begin, end = local_day_window(self.day, self.tz)
+        cursor = source.aggregate(pipeline_live_day(begin, end, LIVE_THRESHOLD, LIVE_HAS_MASK))
+        result = await cursor.to_list(length=1)
+        facets = result[0] if result else {}
+        self.staffs = {d["_id"] for d in facets.get("staffs", [])}
+        self.cameras = Counter({d["_id"]: d["count"] for d in facets.get("cameras", [])})
+        self.synced = True
+        self.synced_at = self.updated_at = datetime.now(timezone.utc)
+        self.logger.debug(f"live counters of {source.full_name} synced: {len(self.staffs)} staffs")
+
+    async def watch(self, source: AsyncIOMotorCollection):
+        """follow the inserts of `source` until the change stream is closed.
+        The stream is opened before the resync, so no insert is missed; an insert happening during the resync
+        may be counted twice in the per camera counts, the distinct staffs are not affected."""
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        async with source.watch(pipeline, max_await_time_ms=1000) as stream:
+            await self.resync(source)
+            while stream.alive:
+                change = await stream.try_next()
+                if change is None:
+                    self.rollover()
+                else:
+                    self.apply(change["fullDocument"])
+
+    async def run_forever(self, source: AsyncIOMotorCollection):
+        """watch `source`, resync after every disconnect, until cancelled"""
+        while True:
+            try:
+                await self.watch(source)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                # e.g. not a replica set, only warn once as it will not get better
+                if not self.warned:
+                    self.logger.warning(f"cannot watch {source.full_name}, the live counters are disabled: {e}")
+                    self.warned = True
+            except Exception as e:
+                self.logger.error(f"live counters of {source.full_name} disconnected: {e}")
+            self.synced = False
+            await asyncio.sleep(self.retry_interval)
+
+    def ensure_started(self, source: AsyncIOMotorCollection):
+        """start watching `source`, restart if another collection was watched before"""
+        if self._task is not None and not self._task.done() and self.source == source.full_name:
+            return
+        self.stop()
+        self.source = source.full_name
+        self.synced = False
+        self._task = asyncio.create_task(self.run_forever(source), name=f"live counters of {source.full_name}")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.synced = False
+
+    async def close(self):
+        task = self._task
+        self.stop()
+        if task is not None:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def covers(
+        self, source: AsyncIOMotorCollection, begin: datetime, end: datetime, now: datetime | None = None
+    ) -> bool:
+        """True if [begin, end] is exactly today and the counters of `source` are up to date"""
+        if not self.synced or self.source != source.full_name:
+            return False
+        self.rollover(now)
+        day_begin, day_end = local_day_window(self.day, self.tz)
+        next_begin, _ = local_day_window(self.day + timedelta(days=1), self.tz)
+        return as_utc(begin) == day_begin and day_end <= as_utc(end) < next_begin
+
+    def count_today(
+        self, source: AsyncIOMotorCollection, begin: datetime, end: datetime, now: datetime | None = None
+    ) -> int | None:
+        """the count of distinct staffs if [begin, end] is today, else None.
+        The first call starts the watcher, the counters are used once it is synced"""
+        if getattr(source, "bypass_cache", False):
+            return None
+        self.ensure_started(source)
+        if not self.covers(source, begin, end, now):
+            return None
+        return len(self.staffs)
+
+    def snapshot(self, now: datetime | None = None) -> LiveSnapshot:
+        if self.synced:
+            self.rollover(now)
+        return LiveSnapshot(
+            source=self.source,
+            day=self.day,
+            synced=self.synced,
+            count=len(self.staffs),
+            cameras={str(k): v for k, v in self.cameras.items()},
+            synced_at=self.synced_at,
+            updated_at=self.updated_at,
+        )
@@ -15,6 +15,13 @@ __all__ = [
     "PersonInoutCollection",
     "MongoSampleStateOfStaffModel",
     "MongoStateOfStaffModel",
+    "TimeWindow",
+    "DirectorySummary",
+    "ApproximateCount",
+    "DayInout",
+    "Granularity",
+    "PersonInoutDays",
+    "PersonInoutDaysCollection",
 ]
 
 StaffCodeStr = Annotated[str, "staff code"]
@@ -26,6 +33,7 @@ EmailStr = Annotated[str, "email address"]
 CellphoneStr = Annotated[str, "cellphone number"]
 CameraIdStr = Annotated[str, "camera id"]
 SubIdStr = Annotated[str, "sub id"]
+WindowNameStr = Annotated[str, Field(pattern=r"^[A-Za-z0-9_\-]+$", description="name of a time window")]
 
 
 def validate_query(query_string):
@@ -113,6 +121,26 @@ class PersonInoutCollection(BaseModel):
     values: list[PersonInout]
 
 
+class DayInout(BaseModel):
+    """first and last record of a staff in a local day"""
+
+    date: date
+    first_record: Optional[datetime] = Field(None, description="first record of the day")
+    last_record: Optional[datetime] = Field(None, description="last record of the day")
+
+
+class PersonInoutDays(MongoStaffModel):
+    """a row of the attendance matrix: a staff and their days with at least one record"""
+
+    model_config = ConfigDict(extra="allow")
+    days: list[DayInout] = []
+
+
+class PersonInoutDaysCollection(BaseModel):
+    count: int
+    values: list[PersonInoutDays]
+
+
 class PersonRecord(BaseModel):
     staff_id: StaffCodeStr
     full_name: Optional[FullNameStr] = None
@@ -132,14 +160,59 @@ class PersonRecord(BaseModel):
 class PersonRecordCollection(BaseModel):
     count: Optional[int] = None
     values: list[PersonRecord] = []
+    next: Optional[str] = Field(None, description="token of the next page, None if this is the last page")
+
+
+class TimeWindow(BaseModel):
+    """a closed time range [begin, end]"""
+
+    begin: datetime
+    end: datetime
+
+
+class DirectorySummary(BaseModel):
+    """The counters of the staff directory"""
+
+    people_count: int = Field(0, description="number of distinct staff codes")
+    has_sample_count: int = Field(0, description="number of staffs with face samples")
+    should_checkinout_count: int = Field(0, description="number of active staffs")
+
+
+class ApproximateCount(BaseModel):
+    """The estimated number of distinct staffs, from the merged HyperLogLog sketches"""
+
+    count: int = Field(..., description="estimated number of distinct staffs")
+    error: float = Field(..., description="relative standard error of the estimate")
+    lower: int = Field(..., description="lower bound of the ~95% confidence interval (2 standard errors)")
+    upper: int = Field(..., description="upper bound of the ~95% confidence interval (2 standard errors)")
+    sketched_days: int = Field(0, description="number of whole days answered from the daily sketches")
+
+
+class Granularity(str, Enum):
+    """size of the time buckets of the camera stats"""
+
+    minute_15 = "15min"
+    hour = "hour"
+    day = "day"
+
+    def bin(self) -> tuple[int, str]:
+        """binSize and unit of `$dateTrunc`"""
+        return {"15min": (15, "minute"), "hour": (1, "hour"), "day": (1, "day")}[self.value]
 
 
 class ByDateCam(BaseModel):
-    """The store model for the count of person in a camera in a day."""
+    """The store model for the count of records in a camera in a time bucket (a day by default)."""
 
     date: date
     camera_id: CameraIdStr
     count: int
+    bucket: Optional[datetime] = Field(None, description="start of the time bucket")
+
+    @model_validator(mode="after")
+    def convert_bucket(self) -> "ByDateCam":
+        if self.bucket is not None and self.bucket.tzinfo is None:
+            self.bucket = self.bucket.replace(tzinfo=timezone.utc)
+        return self
 
 
 class ByDateCamCollection(BaseModel):
@@ -1,26 +1,53 @@
+import logging
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 from pydantic import AwareDatetime
-from .models import QueryParamters, StaffCodeStr, MongoSampleStateOfStaffModel, MongoStateOfStaffModel
+from .models import QueryParamters, StaffCodeStr, MongoSampleStateOfStaffModel, MongoStateOfStaffModel, Granularity
+from .keyset import RecordKey, condition_after
+from .compiler import ALWAYS, NEVER, NotCompilable, compile_expr
 
+# matches nothing, with an empty range of the _id index
+MATCH_NOTHING = {"_id": {"$in": []}}
 
-def query_find_staff(query_params: QueryParamters):
+
+def condition_find_staff(query_params: QueryParamters, logger: logging.Logger | None = None) -> Dict:
+    """the OR of all conditions in `query_params`, compiled so that each branch can use an index:
+    the empty lists and the always false custom query are dropped, the custom query becomes a plain filter if possible
+    """
+    if logger is None:
+        logger = logging.getLogger()
+    fields = {
+        "staff_code": query_params.staffcodes,
+        "full_name": query_params.fullnames,
+        "unit": query_params.units,
+        "department": query_params.departments,
+        "title": query_params.titles,
+        "email": query_params.emails,
+        "cellphone": query_params.cellphones,
+    }
+    branches = [{field: {"$in": values}} for field, values in fields.items() if values]
+
+    try:
+        custom = compile_expr(query_params.custom_query)
+    except NotCompilable as e:
+        logger.warning(f"the custom query is kept as an $expr, the staff lookup can not use the indexes: {e}")
+        custom = {"$expr": query_params.custom_query}
+    if custom is ALWAYS:
+        return {}
+    if custom is not NEVER:
+        branches.append(custom)
+
+    if not branches:
+        return MATCH_NOTHING
+    if len(branches) == 1:
+        return branches[0]
+    return {"$or": branches}
+
+
+def query_find_staff(query_params: QueryParamters, logger: logging.Logger | None = None):
     """find staffs in the database by OR all conditions in `query_params`"""
     pipline = [
-        {
-            "$match": {
-                "$or": [
-                    {"staff_code": {"$in": query_params.staffcodes}},
-                    {"full_name": {"$in": query_params.fullnames}},
-                    {"unit": {"$in": query_params.units}},
-                    {"department": {"$in": query_params.departments}},
-                    {"title": {"$in": query_params.titles}},
-                    {"email": {"$in": query_params.emails}},
-                    {"cellphone": {"$in": query_params.cellphones}},
-                    {"$expr": query_params.custom_query},
-                ],
-            }
-        },
+        {"$match": condition_find_staff(query_params, logger)},
         {
             "$project": {
                 "_id": 0,
@@ -92,6 +119,113 @@ def query_find_staff_inout(
     return pipeline
 
 
+def pipeline_inout_join_codes(
+    bodyfacename_collection_name: str,
+    begin: datetime,
+    end: datetime,
+    threshold: float = 0.63,
+    has_mask: bool = False,
+):
+    """the stage 2 of the in-out query, run on a temporary collection of staff codes `{"_id": staff_code}`
+    instead of a huge `$in`. Same documents as `query_find_staff_inout`, the staffs without records are left out.
+    Needs MongoDB 5.0 and the temporary collection in the database of the records."""
+    pipeline = [
+        {
+            "$lookup": {
+                "from": bodyfacename_collection_name,
+                "localField": "_id",
+                "foreignField": "staff_id",
+                "as": "found",
+                "pipeline": [
+                    {
+                        "$match": {
+                            "image_time": {"$gte": begin, "$lte": end},
+                            "face_reg_score": {"$gte": threshold},
+                            "has_mask": has_mask,
+                        },
+                    },
+                    {
+                        "$group": {
+                            "_id": None,
+                            "firstDocument": {"$min": "$image_time"},
+                            "lastDocument": {"$max": "$image_time"},
+                        }
+                    },
+                ],
+            }
+        },
+        {"$unwind": "$found"},
+        {
+            "$project": {
+                "_id": 0,
+                "staff_code": "$_id",
+                "firstDocument": "$found.firstDocument",
+                "lastDocument": "$found.lastDocument",
+            },
+        },
+    ]
+    return pipeline
+
+
+def query_find_staff_inout_days(
+    staffcodes: list[StaffCodeStr],
+    begin: datetime,
+    end: datetime,
+    threshold: float = 0.63,
+    has_mask: bool = False,
+    timezone: str = "Asia/Ho_Chi_Minh",
+):
+    """first and last recognition time of each staff on each local day of [begin, end], in one pass.
+    One document per staff: `{"staff_code", "days": [{"day": local midnight, "first", "last"}]}`, days in order"""
+    pipeline = [
+        {
+            "$match": {
+                "image_time": {
+                    "$gte": begin,
+                    "$lte": end,
+                },
+                "face_reg_score": {
+                    "$gte": threshold,
+                },
+                "has_mask": has_mask,
+                "staff_id": {
+                    "$in": staffcodes,
+                },
+            },
+        },
+        {
+            "$group": {
+                "_id": {
+                    "staff_id": "$staff_id",
+                    "day": {"$dateTrunc": {"date": "$image_time", "unit": "day", "timezone": timezone}},
+                },
+                "first": {"$min": "$image_time"},
+                "last": {"$max": "$image_time"},
+            },
+        },
+        {
+            "$sort": {
+                "_id.staff_id": 1,
+                "_id.day": 1,
+            },
+        },
+        {
+            "$group": {
+                "_id": "$_id.staff_id",
+                "days": {"$push": {"day": "$_id.day", "first": "$first", "last": "$last"}},
+            },
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "staff_code": "$_id",
+                "days": 1,
+            },
+        },
+    ]
+    return pipeline
+
+
 def pipeline_staffs_inou(
     query_params: QueryParamters,
     begin: datetime = "2023-12-27T00:00:00.000+00:00",
@@ -100,78 +234,55 @@ def pipeline_staffs_inou(
     has_mask: bool = False,
     bodyfacename_collection_name: str = "BodyFaceName",
 ):
-    """get staffs min and max recognition time within the windows [begin, end]
+    """get staffs min and max recognition time within the windows [begin, end], in a single `$lookup`.
     All the parameters are optional and will be OR combined.
+    The `localField`/`foreignField` join with a sub-pipeline needs MongoDB 5.0, the sub-query of each staff then
+    uses the index on staff_id. The join collection must be in the same database as the staff collection.
     """
     query = [
         {
-            "$match": query_find_staff(query_params),
+            "$match": condition_find_staff(query_params),
         },
         {
             "$lookup": {
                 "from": bodyfacename_collection_name,
-                "let": {"staff_code_var": "$staff_code"},
+                "localField": "staff_code",
+                "foreignField": "staff_id",
                 "as": "found",
                 "pipeline": [
                     {
                         "$match": {
-                            "$expr": {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            "$staff_id",
-                                            "$$staff_code_var",
-                                        ],
-                                    },
-                                    {
-                                        "$gte": [
-                                            "$image_time",
-                                            begin,
-                                        ],
-                                    },
-                                    {
-                                        "$lte": [
-                                            "$image_time",
-                                            end,
-                                        ],
-                                    },
-                                    {
-                                        "$gte": ["$face_reg_score", threshold],
-                                    },
-                                    {"$eq": ["$has_mask", has_mask]},
-                                ],
-                            },
+                            "image_time": {"$gte": begin, "$lte": end},
+                            "face_reg_score": {"$gte": threshold},
+                            "has_mask": has_mask,
                         },
                     },
-                    {"$project": {"staff_id": 1, "image_time": 1}},
-                    {"$sort": {"image_time": 1}},
                     {
                         "$group": {
-                            "_id": "$staff_id",
-                            "firstDocument": {"$first": "$image_time"},
-                            "lastDocument": {"$last": "$image_time"},
+                            "_id": None,
+                            "firstDocument": {"$min": "$image_time"},
+                            "lastDocument": {"$max": "$image_time"},
                         }
                     },
                 ],
             }
         },
-        {"$unwind": {"path": "$found", "includeArrayIndex": "arrayIndex", "preserveNullAndEmptyArrays": True}},
+        {
+            "$set": {
+                "first_record": {"$first": "$found.firstDocument"},  # fixed field name, do not change it
+                "last_record": {"$first": "$found.lastDocument"},  # fixed field name, do not change it
+            }
+        },
+        # the same fields as the two stage query
         {
             "$project": {
                 "_id": 0,
-                "staff_code": "$staff_code",  # fixed field name, do not change it
-                "full_name": 1,  # fixed field name, do not change it
-                "sex": 1,
-                "cellphone": 1,
-                "email": 1,
-                "unit": 1,
-                "department": 1,
-                "title": 1,
-                "sample_state": 1,
-                "working_state": 1,
-                "first_record": "$found.firstDocument",  # fixed field name, do not change it
-                "last_record": "$found.lastDocument",  # fixed field name, do not change it
-            }
+                "found": 0,
+                "straight_img": 0,
+                "left_img": 0,
+                "right_img": 0,
+                "embeddings": 0,
+            },
         },
     ]
     return query
@@ -196,6 +307,164 @@ def pipeline_count(begin: datetime, end: datetime, threshold: float, has_mask: b
     return pipeline
 
 
+def pipeline_live_day(begin: datetime, end: datetime, threshold: float, has_mask: bool = False):
+    """the distinct staffs and the number of records per camera in [begin, end], in one document:
+    `{"staffs": [{"_id": staff_id}], "cameras": [{"_id": camera_id, "count": n}]}`"""
+    pipeline = [
+        {
+            "$match": {
+                "image_time": {
+                    "$gte": begin,
+                    "$lte": end,
+                },
+                "face_reg_score": {"$gte": threshold},
+                "has_mask": has_mask,
+            }
+        },
+        {
+            "$facet": {
+                "staffs": [{"$group": {"_id": "$staff_id"}}],
+                "cameras": [{"$group": {"_id": "$camera_id", "count": {"$sum": 1}}}],
+            }
+        },
+    ]
+    return pipeline
+
+
+def pipeline_count_windows(
+    windows: Dict[str, Tuple[datetime, datetime]],
+    threshold: float,
+    has_mask: bool = False,
+):
+    """count distinct staffs in many time windows with a single scan.
+    The whole span of all windows is matched once, then each window is counted in its own `$facet` branch.
+    The result is one document: `{name: [{"count": n}]}`, the list is empty when nobody is found.
+    """
+    begin = min(b for b, _ in windows.values())
+    end = max(e for _, e in windows.values())
+    facets = {}
+    for name, (wbegin, wend) in windows.items():
+        facets[name] = [
+            {"$match": {"image_time": {"$gte": wbegin, "$lte": wend}}},
+            {"$group": {"_id": "$staff_id"}},
+            {"$count": "count"},
+        ]
+    pipeline = [
+        {
+            "$match": {
+                "image_time": {
+                    "$gte": begin,
+                    "$lte": end,
+                },
+                "face_reg_score": {"$gte": threshold},
+                "has_mask": has_mask,
+            }
+        },
+        {"$project": {"_id": 0, "staff_id": 1, "image_time": 1}},
+        {"$facet": facets},
+    ]
+    return pipeline
+
+
+def pipeline_distinct_staff(begin: datetime, end: datetime, threshold: float, has_mask: bool = False):
+    """list the distinct staff_id represented in [begin, end], one document per staff"""
+    pipeline = [
+        {
+            "$match": {
+                "image_time": {
+                    "$gte": begin,
+                    "$lte": end,
+                },
+                "face_reg_score": {"$gte": threshold},
+                "has_mask": has_mask,
+            }
+        },
+        {"$group": {"_id": "$staff_id"}},
+    ]
+    return pipeline
+
+
+def pipeline_rollup_refresh(
+    begin: datetime,
+    end: datetime,
+    source: str,
+    rollup_database: str,
+    rollup_collection: str,
+    threshold: float = 0.63,
+    has_mask: bool = False,
+    timezone: str = "Asia/Ho_Chi_Minh",
+):
+    """summarize the records in [begin, end) to (staff_id, local date) -> first, last, count,
+    then merge them into the rollup collection. `begin` must be the first instant of a local day:
+    the summaries of the whole days replace the previous ones, so running it again is safe"""
+    pipeline = [
+        {
+            "$match": {
+                "image_time": {"$gte": begin, "$lt": end},
+                "face_reg_score": {"$gte": threshold},
+                "has_mask": has_mask,
+            },
+        },
+        {
+            "$group": {
+                "_id": {
+                    "staff_id": "$staff_id",
+                    "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$image_time", "timezone": timezone}},
+                },
+                "first": {"$min": "$image_time"},
+                "last": {"$max": "$image_time"},
+                "count": {"$sum": 1},
+            },
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "source": {"$literal": source},
+                "staff_id": "$_id.staff_id",
+                "date": "$_id.date",
+                "first": 1,
+                "last": 1,
+                "count": 1,
+            },
+        },
+        {
+            "$merge": {
+                "into": {"db": rollup_database, "coll": rollup_collection},
+                "on": ["source", "staff_id", "date"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            },
+        },
+    ]
+    return pipeline
+
+
+def pipeline_rollup_inout(source: str, dates: list[str], staffcodes: Optional[list[StaffCodeStr]] = None):
+    """first and last record of each staff over the rollup `dates`, same output as `query_find_staff_inout`"""
+    match = {"source": source, "date": {"$in": dates}}
+    if staffcodes is not None:
+        match["staff_id"] = {"$in": staffcodes}
+    pipeline = [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": "$staff_id",
+                "firstDocument": {"$min": "$first"},
+                "lastDocument": {"$max": "$last"},
+            },
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "staff_code": "$_id",
+                "firstDocument": 1,
+                "lastDocument": 1,
+            },
+        },
+    ]
+    return pipeline
+
+
 def pipeline_count_shoulddiemdanh():
     pipeline = [
         {
@@ -244,6 +513,45 @@ def pipeline_count_has_sample():
     return pipeline
 
 
+def pipeline_directory_summary():
+    """count the distinct non-null staff codes (like `distinct("staff_code")`), only an integer is returned.
+    The leading $sort lets the server walk the staff_code index (DISTINCT_SCAN) instead of the documents,
+    the state counters are counted apart on their own indexes, see `conditions_directory_counts`."""
+    pipeline = [
+        {
+            "$sort": {
+                "staff_code": 1,
+            },
+        },
+        {
+            "$group": {
+                "_id": "$staff_code",
+            },
+        },
+        {
+            "$group": {
+                "_id": None,
+                "people_count": {"$sum": {"$cond": [{"$eq": ["$_id", None]}, 0, 1]}},
+            },
+        },
+        {
+            "$project": {
+                "_id": 0,
+            },
+        },
+    ]
+    return pipeline
+
+
+def conditions_directory_counts() -> Dict[str, Dict]:
+    """the filters of the staff directory counters counting documents (like the pipelines above),
+    each one is answered by `count_documents` on the index of its field"""
+    return {
+        "has_sample_count": {"sample_state": MongoSampleStateOfStaffModel.ready_to_checkin_checkout},
+        "should_checkinout_count": {"working_state": MongoStateOfStaffModel.active},
+    }
+
+
 def condition_count_record_by_id(
     begin: AwareDatetime,
     end: AwareDatetime,
@@ -272,7 +580,10 @@ def pipeline_get_record_by_id(
     has_mark: bool = False,
     offset: int = 0,
     limit: int = 10,
+    after: Optional[RecordKey] = None,
 ):
+    """the records newest first. `_id` breaks the ties so that a page can resume strictly `after` a record
+    with a range predicate, instead of skipping all the previous pages"""
     pipeline = [
         {
             "$match": {
@@ -284,6 +595,7 @@ def pipeline_get_record_by_id(
         {
             "$sort": {
                 "image_time": -1,
+                "_id": -1,
             },
         },
         {
@@ -306,6 +618,8 @@ def pipeline_get_record_by_id(
 
     if staff_id is not None:
         pipeline[0]["$match"]["staff_id"] = staff_id
+    if after is not None:
+        pipeline[0]["$match"].update(condition_after(after))
 
     return pipeline
 
@@ -317,8 +631,13 @@ def pipeline_stat_by_camera(
     threshold: float = 0.63,
     has_mark: bool = False,
     timezone: str = "Asia/Ho_Chi_Minh",
+    granularity: Granularity = Granularity.day,
+    dense: bool = False,
 ):
-    """pipeline for counting the number of records by camera_id and by date"""
+    """pipeline for counting the number of records by camera_id and by time bucket.
+    The buckets are computed with `$dateTrunc` and only the groups are formatted to a date string.
+    If `dense`, the missing buckets between the first and the last one are filled with a count of 0."""
+    bin_size, unit = granularity.bin()
     pipeline = [
         {
             "$match": {
@@ -331,10 +650,11 @@ def pipeline_stat_by_camera(
             "$group": {
                 "_id": {
                     "camera_id": "$camera_id",
-                    "date": {
-                        "$dateToString": {
-                            "format": "%Y-%m-%d",
+                    "bucket": {
+                        "$dateTrunc": {
                             "date": "$image_time",
+                            "unit": unit,
+                            "binSize": bin_size,
                             "timezone": timezone,
                         },
                     },
@@ -345,7 +665,30 @@ def pipeline_stat_by_camera(
             },
         },
         {
-            "$project": {"_id": 0, "date": "$_id.date", "camera_id": "$_id.camera_id", "count": 1},
+            "$project": {"_id": 0, "bucket": "$_id.bucket", "camera_id": "$_id.camera_id", "count": 1},
+        },
+    ]
+    if dense:
+        pipeline.append(
+            {
+                "$densify": {
+                    "field": "bucket",
+                    "partitionByFields": ["camera_id"],
+                    "range": {"step": bin_size, "unit": unit, "bounds": "full"},
+                },
+            }
+        )
+    pipeline += [
+        {
+            "$project": {
+                "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$bucket", "timezone": timezone}},
+                "bucket": 1,
+                "camera_id": 1,
+                "count": {"$ifNull": ["$count", 0]},
+            },
+        },
+        {
+            "$sort": {"camera_id": 1, "bucket": 1},
         },
     ]
     if staff_id is not None:
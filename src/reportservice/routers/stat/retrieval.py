@@ -1,5 +1,8 @@
-from typing import List, Any
+from typing import List, Any, Dict, Set, Tuple, Type, TypeVar, AsyncIterable, AsyncIterator
+from zoneinfo import ZoneInfo
 from datetime import datetime
+from uuid import uuid4
+import asyncio
 import logging
 from motor.motor_asyncio import AsyncIOMotorCollection
 from .models import (
@@ -10,59 +13,120 @@ from .models import (
     PersonRecordCollection,
     ByDateCam,
     ByDateCamCollection,
+    TimeWindow,
+    DirectorySummary,
+    ApproximateCount,
+    DayInout,
+    PersonInoutDays,
+    PersonInoutDaysCollection,
+    MongoStaffModel,
+    Granularity,
 )
+from .rollup import AttendanceRollup
+from .live import LiveCounters
+from .sketches import DailySketches
+from .cache import stat_cache
+from .slicing import time_slicer
+from .keyset import RecordKey, decode_token, encode_token
+from .windows import as_utc, local_date
+from ...settings import settings
+from .directory import directory_cache
+from ..common.concurrency import gather_with_concurrency
 from .queries import (
     pipeline_count,
+    pipeline_count_windows,
+    pipeline_distinct_staff,
     query_find_staff,
     query_find_staff_inout,
-    pipeline_count_shoulddiemdanh,
-    pipeline_count_has_sample,
+    pipeline_inout_join_codes,
+    query_find_staff_inout_days,
+    pipeline_directory_summary,
+    conditions_directory_counts,
     pipeline_get_record_by_id,
     condition_count_record_by_id,
     pipeline_stat_by_camera,
 )
 
+Staff = TypeVar("Staff", bound=MongoStaffModel)
+
+
+async def get_directory_summary(staff_collection: AsyncIOMotorCollection) -> DirectorySummary:
+    """count the people, the people with face sample and the people who should check in/out,
+    each one on its index. The result is cached until the staff collection changes"""
+    summary = directory_cache.get(staff_collection)
+    if summary is not None:
+        return summary
+    generation = directory_cache.generation
+    conditions = conditions_directory_counts()
+    result, *counts = await asyncio.gather(
+        staff_collection.aggregate(pipeline_directory_summary()).to_list(length=1),
+        *[staff_collection.count_documents(condition) for condition in conditions.values()],
+    )
+    summary = DirectorySummary(**(result[0] if result else {}), **dict(zip(conditions, counts, strict=True)))
+    directory_cache.set(staff_collection, summary, generation)
+    return summary
+
 
 async def get_people_count(staff_collection: AsyncIOMotorCollection) -> int:
     """count all people in the database"""
-    count = await staff_collection.distinct("staff_code")
-    return len(count)
+    summary = await get_directory_summary(staff_collection)
+    return summary.people_count
 
 
 async def get_has_sample_count(staff_collection: AsyncIOMotorCollection) -> int:
     """count the number of people who have face sample in the database"""
-    cursor = staff_collection.aggregate(pipeline_count_has_sample())
-    result = await cursor.to_list(length=1)
-    if result:
-        return result[0]["count"]
-    else:
-        return 0
+    summary = await get_directory_summary(staff_collection)
+    return summary.has_sample_count
 
 
 async def get_should_checkinout_count(staff_collection: AsyncIOMotorCollection) -> int:
     """should_diemdanh: count the number of people who should be reminded to check in/out today."""
-    cursor = staff_collection.aggregate(pipeline_count_shoulddiemdanh())
-    result = await cursor.to_list(length=1)
-    if result:
-        return result[0]["count"]
-    else:
-        return 0
+    summary = await get_directory_summary(staff_collection)
+    return summary.should_checkinout_count
 
 
 async def get_inout_count(
     bodyfacename_collection: AsyncIOMotorCollection,
     begin: datetime = "2023-12-27T00:00:00.000+00:00",
     end: datetime = "2023-12-27T23:59:59.999+00:00",
+    rollup: AttendanceRollup | None = None,
+    live: LiveCounters | None = None,
 ) -> int:
-    """Get the count of people represented in a given time range"""
+    """Get the count of people represented in a given time range.
+    If `live` is given and the time range is exactly today, the count is read from the live counters.
+    If `rollup` is given, the closed days are read from it and only the remaining parts from the raw records."""
     if not isinstance(begin, datetime):
         begin = datetime.fromisoformat(begin)
     if not isinstance(end, datetime):
         end = datetime.fromisoformat(end)
+
+    if live is not None:
+        count = live.count_today(bodyfacename_collection, begin, end)
+        if count is not None:
+            return count
+
+    if rollup is not None:
+        split = await rollup.split(bodyfacename_collection, begin, end)
+        if split.dates:
+            staff_ids = await rollup.staff_ids(bodyfacename_collection, split.dates)
+            for raw_begin, raw_end in split.raw_windows:
+                pipeline = pipeline_distinct_staff(raw_begin, raw_end, 0.63)
+                async for document in stat_cache.stream(bodyfacename_collection, pipeline, raw_end):
+                    staff_ids.add(document["_id"])
+            return len(staff_ids)
+
+    return await count_distinct_staffs(bodyfacename_collection, begin, end)
+
+
+async def count_distinct_staffs(collection: AsyncIOMotorCollection, begin: datetime, end: datetime) -> int:
+    """count the staffs represented in [begin, end] from the raw records, long windows are queried in slices"""
+    if time_slicer.should_slice(begin, end):
+        parts = await time_slicer.run("count_inout", begin, end, lambda b, e: get_distinct_staffs(collection, b, e))
+        return len(set().union(*parts))
+
     pipeline = pipeline_count(begin, end, 0.63)
     # Execute the pipeline
-    cursor = bodyfacename_collection.aggregate(pipeline)
-    result = await cursor.to_list(length=1)
+    result = await stat_cache.aggregate(collection, pipeline, end)
 
     if not result:
         return 0
@@ -70,6 +134,203 @@ async def get_inout_count(
         return result[0]["count"]
 
 
+async def get_distinct_staffs(
+    bodyfacename_collection: AsyncIOMotorCollection, begin: datetime, end: datetime, threshold: float = 0.63
+) -> Set[str]:
+    """the staff_id represented in [begin, end], a slice of a long window"""
+    pipeline = pipeline_distinct_staff(begin, end, threshold)
+    documents = stat_cache.stream(bodyfacename_collection, pipeline, end, time_slicer.max_time_ms)
+    return {document["_id"] async for document in documents}
+
+
+async def get_inout_count_approximate(
+    bodyfacename_collection: AsyncIOMotorCollection,
+    sketches: DailySketches,
+    begin: datetime = "2023-12-27T00:00:00.000+00:00",
+    end: datetime = "2023-12-27T23:59:59.999+00:00",
+) -> ApproximateCount:
+    """Estimate the count of people represented in a given time range by merging the daily sketches"""
+    if not isinstance(begin, datetime):
+        begin = datetime.fromisoformat(begin)
+    if not isinstance(end, datetime):
+        end = datetime.fromisoformat(end)
+    return await sketches.estimate(bodyfacename_collection, begin, end)
+
+
+async def get_inout_count_windows(
+    bodyfacename_collection: AsyncIOMotorCollection,
+    windows: Dict[str, TimeWindow | Tuple[datetime, datetime]],
+    threshold: float = 0.63,
+    has_mask: bool = False,
+) -> Dict[str, int]:
+    """Get the count of people represented in each named time window, scanning the records only once"""
+    if not windows:
+        return {}
+    _windows = {}
+    for name, window in windows.items():
+        begin, end = (window.begin, window.end) if isinstance(window, TimeWindow) else window
+        if not isinstance(begin, datetime):
+            begin = datetime.fromisoformat(begin)
+        if not isinstance(end, datetime):
+            end = datetime.fromisoformat(end)
+        # the windows may mix naive and aware datetimes, which can not be compared
+        _windows[name] = (as_utc(begin), as_utc(end))
+
+    pipeline = pipeline_count_windows(_windows, threshold, has_mask)
+    result = await stat_cache.aggregate(bodyfacename_collection, pipeline, max(e for _, e in _windows.values()))
+    facets = result[0] if result else {}
+    return {name: facets[name][0]["count"] if facets.get(name) else 0 for name in _windows}
+
+
+def index_staffs(staffs: List[Staff]) -> Dict[str, Staff]:
+    """index the staffs by staff_code. If a staff_code appears twice, the first one wins"""
+    index: Dict[str, Staff] = {}
+    for staff in staffs:
+        index.setdefault(staff.staff_code, staff)
+    return index
+
+
+def merge_inout_document(index: Dict[str, PersonInout], document: Dict[str, Any]) -> PersonInout | None:
+    """fill the first and last record of a stage 2 document into the indexed staff, return the filled staff.
+    If the staff already has records (from another part of the window), keep the earliest and the latest."""
+    staff = index.get(document["staff_code"])
+    if staff is not None:
+        first, last = document["firstDocument"], document["lastDocument"]
+        if staff.first_record is None or (first is not None and first < staff.first_record):
+            staff.first_record = first
+        if staff.last_record is None or (last is not None and last > staff.last_record):
+            staff.last_record = last
+    return staff
+
+
+async def consume_inout_stream(index: Dict[str, PersonInout], documents: AsyncIterable[Dict[str, Any]]) -> int:
+    """merge the stage 2 documents into `index` as they arrive, return the number of merged documents"""
+    merged = 0
+    async for document in documents:
+        if merge_inout_document(index, document) is not None:
+            merged += 1
+    return merged
+
+
+async def yield_inout_stream(
+    index: Dict[str, PersonInout], documents: AsyncIterable[Dict[str, Any]], yielded: Set[int]
+) -> AsyncIterator[PersonInout]:
+    """merge the stage 2 documents into `index` and yield each filled staff as soon as its document arrives.
+    The staffs are yielded only once, `yielded` collects their `id()`"""
+    async for document in documents:
+        staff = merge_inout_document(index, document)
+        if staff is not None and id(staff) not in yielded:
+            yielded.add(id(staff))
+            yield staff
+
+
+async def find_staffs(
+    staff_collection: AsyncIOMotorCollection,
+    query_params: QueryParamters,
+    logger: logging.Logger,
+    model: Type[Staff] = PersonInout,
+) -> List[Staff]:
+    """first stage of the in-out queries: the staffs matching `query_params`"""
+    stage1 = query_find_staff(query_params, logger)
+    logger.debug(f"running in-out pipeline stage1: {stage1}")
+    cursor1 = staff_collection.aggregate(stage1)
+    staffs: List[Staff] = []
+    async for document in cursor1:
+        staffs.append(model.model_validate(document))
+
+    logger.debug(f"running in-out pipeline stage1 found {len(staffs)} staffs")
+    return staffs
+
+
+async def _people_inout_parts(
+    staff_collection: AsyncIOMotorCollection,
+    bodyfacename_collection: AsyncIOMotorCollection,
+    query_params: QueryParamters,
+    begin: datetime,
+    end: datetime,
+    logger: logging.Logger,
+    rollup: AttendanceRollup | None = None,
+) -> Tuple[List[PersonInout], Dict[str, PersonInout], List[AsyncIterable[Dict[str, Any]]]]:
+    """run the first stage, return the staffs, their index and the streams of stage 2 documents to merge in"""
+    # NOTE: need to use two stage query here because the $lookup stage can not use index
+    # might be fixed in the future
+
+    # first stage: find all the staffs
+    final_result = await find_staffs(staff_collection, query_params, logger)
+
+    # second stage: find in-out information related to the first stage
+    index = index_staffs(final_result)
+    staffcodes = list(index.keys())
+    windows = [(begin, end)]
+    parts: List[AsyncIterable[Dict[str, Any]]] = []
+    if rollup is not None:
+        split = await rollup.split(bodyfacename_collection, begin, end)
+        if split.dates:
+            logger.debug(f"running in-out stage2 on the rollup for {len(split.dates)} days")
+            parts.append(rollup.inout(bodyfacename_collection, split.dates, staffcodes))
+            windows = split.raw_windows
+
+    for window_begin, window_end in windows:
+        parts.extend(inout_stage2_parts(bodyfacename_collection, staffcodes, window_begin, window_end, logger))
+
+    return final_result, index, parts
+
+
+def inout_stage2_parts(
+    bodyfacename_collection: AsyncIOMotorCollection,
+    staffcodes: List[str],
+    begin: datetime,
+    end: datetime,
+    logger: logging.Logger,
+) -> List[AsyncIterable[Dict[str, Any]]]:
+    """the streams of stage 2 documents of [begin, end]: one `$in` query per chunk of INOUT_CHUNK_SIZE staff codes,
+    or a join against a temporary collection of the codes above INOUT_TEMP_JOIN_THRESHOLD (if not 0)"""
+    threshold = settings.INOUT_TEMP_JOIN_THRESHOLD
+    if threshold and len(staffcodes) > threshold:
+        return [stream_inout_temp_join(bodyfacename_collection, staffcodes, begin, end, logger)]
+
+    size = max(settings.INOUT_CHUNK_SIZE, 1)
+    parts: List[AsyncIterable[Dict[str, Any]]] = []
+    for i in range(0, len(staffcodes), size):
+        chunk = staffcodes[i : i + size]
+        stage2 = query_find_staff_inout(chunk, begin, end, 0.63, False)
+        logger.debug(f"running in-out pipeline stage2 on {len(chunk)} staff codes")
+        parts.append(stat_cache.stream(bodyfacename_collection, stage2, end))
+    return parts
+
+
+async def stream_inout_temp_join(
+    bodyfacename_collection: AsyncIOMotorCollection,
+    staffcodes: List[str],
+    begin: datetime,
+    end: datetime,
+    logger: logging.Logger,
+) -> AsyncIterator[Dict[str, Any]]:
+    """the stage 2 documents, joined from a temporary collection of the staff codes, dropped at the end"""
+    temp = bodyfacename_collection.database[f"tmp_inout_{uuid4().hex}"]
+    try:
+        await temp.insert_many([{"_id": code} for code in set(staffcodes)], ordered=False)
+        logger.debug(f"running in-out pipeline stage2 joined from {temp.name} with {len(staffcodes)} staff codes")
+        pipeline = pipeline_inout_join_codes(bodyfacename_collection.name, begin, end, 0.63, False)
+        async for document in temp.aggregate(pipeline):
+            yield document
+    finally:
+        await temp.drop()
+
+
+async def consume_inout_parts(
+    index: Dict[str, PersonInout], parts: List[AsyncIterable[Dict[str, Any]]], logger: logging.Logger
+) -> int:
+    """merge all the stage 2 streams into `index`, at most QUERY_CONCURRENCY of them at the same time.
+    Return the number of merged documents"""
+    merged = await gather_with_concurrency(
+        settings.QUERY_CONCURRENCY,
+        {f"in-out stage2 part {i}": consume_inout_stream(index, part) for i, part in enumerate(parts)},
+        logger,
+    )
+    return sum(merged.values())
+
+
 async def get_people_inout(
     staff_collection: AsyncIOMotorCollection,
     bodyfacename_collection: AsyncIOMotorCollection,
@@ -77,11 +338,13 @@ async def get_people_inout(
     begin: datetime = "2023-12-27T00:00:00.000+00:00",
     end: datetime = "2023-12-27T23:59:59.999+00:00",
     logger: logging.Logger | None = None,
+    rollup: AttendanceRollup | None = None,
 ) -> PersonInoutCollection:
     """
     query the first and last recognition time of each staffcode in the database
     Please note that the order in result might not be the same as the order of `staffcodes`.
     The length of result should be the same as the length of `staffcodes`.
+    If `rollup` is given, the closed days are read from it and only the remaining parts from the raw records.
     """
     if logger is None:
         logger = logging.getLogger()
@@ -93,40 +356,117 @@ async def get_people_inout(
     if query_params.is_empty():
         return PersonInoutCollection(count=0, values=[])
 
-    # NOTE: need to use two stage query here because the $lookup stage can not use index
-    # might be fixed in the future
+    final_result, index, parts = await _people_inout_parts(
+        staff_collection, bodyfacename_collection, query_params, begin, end, logger, rollup
+    )
+    # now merge the results of stage1 and stage2 together
+    merged = await consume_inout_parts(index, parts, logger)
 
-    # first stage: find all the staffs
-    stage1 = query_find_staff(query_params)
-    logger.debug(f"running in-out pipeline stage1: {stage1}")
-    cursor1 = staff_collection.aggregate(stage1)
-    final_result: List[PersonInout] = []
-    async for document in cursor1:
-        staff = PersonInout.model_validate(document)
-        final_result.append(staff)
+    logger.debug(f"running in-out pipeline stage2 merged {merged} documents")
 
-    logger.debug(f"running in-out pipeline stage1 result: {final_result}")
+    return PersonInoutCollection(count=len(final_result), values=final_result)
 
-    # second stage: find in-out information related to the first stage
-    staffcodes = [staff.staff_code for staff in final_result]
-    stage2 = query_find_staff_inout(staffcodes, begin, end, 0.63, False)
-    logger.debug(f"running in-out pipeline stage2: {stage2}")
-    cursor2 = bodyfacename_collection.aggregate(stage2)
 
-    # now merge the results of stage1 and stage2 together
-    _stage2_result: List[Any] = []
-    async for document in cursor2:
-        _stage2_result.append(document)
-        staffcode = document["staff_code"]
-        for staff in final_result:
-            if staff.staff_code == staffcode:
-                staff.first_record = document["firstDocument"]
-                staff.last_record = document["lastDocument"]
-                break
-
-    logger.debug(f"running in-out pipeline stage2 result: {_stage2_result}")
+async def iter_people_inout(
+    staff_collection: AsyncIOMotorCollection,
+    bodyfacename_collection: AsyncIOMotorCollection,
+    query_params: QueryParamters,
+    begin: datetime = "2023-12-27T00:00:00.000+00:00",
+    end: datetime = "2023-12-27T23:59:59.999+00:00",
+    logger: logging.Logger | None = None,
+    rollup: AttendanceRollup | None = None,
+) -> AsyncIterator[PersonInout]:
+    """same as `get_people_inout`, but yield the staffs one by one.
+    When stage 2 is a single pipeline, each staff is yielded as soon as its document arrives,
+    then the staffs without any record. Otherwise (rollup, several chunks of staff codes), the parts are merged
+    before yielding."""
+    if logger is None:
+        logger = logging.getLogger()
+    if not isinstance(begin, datetime):
+        begin = datetime.fromisoformat(begin)
+    if not isinstance(end, datetime):
+        end = datetime.fromisoformat(end)
 
-    return PersonInoutCollection(count=len(final_result), values=final_result)
+    if query_params.is_empty():
+        return
+
+    final_result, index, parts = await _people_inout_parts(
+        staff_collection, bodyfacename_collection, query_params, begin, end, logger, rollup
+    )
+    yielded: Set[int] = set()
+    if len(parts) == 1:
+        async for staff in yield_inout_stream(index, parts[0], yielded):
+            yield staff
+    else:
+        await consume_inout_parts(index, parts, logger)
+
+    for staff in final_result:
+        if id(staff) not in yielded:
+            yield staff
+
+
+async def iter_people_inout_range(
+    staff_collection: AsyncIOMotorCollection,
+    bodyfacename_collection: AsyncIOMotorCollection,
+    query_params: QueryParamters,
+    begin: datetime,
+    end: datetime,
+    logger: logging.Logger | None = None,
+    timezone: str | None = None,
+) -> AsyncIterator[PersonInoutDays]:
+    """the first and last recognition time of each staff on each local day of [begin, end].
+    Stage 2 is a single aggregation for the whole range, grouped by staff and local day.
+    Each staff is yielded as soon as its document arrives, then the staffs without any record."""
+    if logger is None:
+        logger = logging.getLogger()
+    if timezone is None:
+        timezone = settings.TIMEZONE
+    if not isinstance(begin, datetime):
+        begin = datetime.fromisoformat(begin)
+    if not isinstance(end, datetime):
+        end = datetime.fromisoformat(end)
+
+    if query_params.is_empty():
+        return
+
+    final_result = await find_staffs(staff_collection, query_params, logger, PersonInoutDays)
+    index = index_staffs(final_result)
+
+    tz = ZoneInfo(timezone)
+    stage2 = query_find_staff_inout_days(list(index.keys()), begin, end, 0.63, False, timezone)
+    logger.debug(f"running in-out range pipeline stage2: {stage2}")
+    yielded: Set[int] = set()
+    async for document in stat_cache.stream(bodyfacename_collection, stage2, end):
+        staff = index.get(document["staff_code"])
+        if staff is None:
+            continue
+        staff.days = [
+            DayInout(date=local_date(day["day"], tz), first_record=day["first"], last_record=day["last"])
+            for day in document["days"]
+        ]
+        yielded.add(id(staff))
+        yield staff
+
+    for staff in final_result:
+        if id(staff) not in yielded:
+            yield staff
+
+
+async def get_people_inout_range(
+    staff_collection: AsyncIOMotorCollection,
+    bodyfacename_collection: AsyncIOMotorCollection,
+    query_params: QueryParamters,
+    begin: datetime,
+    end: datetime,
+    logger: logging.Logger | None = None,
+    timezone: str | None = None,
+) -> PersonInoutDaysCollection:
+    """same as `iter_people_inout_range`, collected"""
+    staffs = iter_people_inout_range(
+        staff_collection, bodyfacename_collection, query_params, begin, end, logger, timezone
+    )
+    values = [staff async for staff in staffs]
+    return PersonInoutDaysCollection(count=len(values), values=values)
 
 
 async def get_person_count_by_id(
@@ -145,9 +485,16 @@ async def get_person_count_by_id(
     if not isinstance(end, datetime):
         end = datetime.fromisoformat(end)
 
-    condition = condition_count_record_by_id(begin, end, staff_code, face_reg_score_threshold, has_mask)
-    count = await bodyfacename_collection.count_documents(condition)
-    return count
+    async def count(slice_begin: datetime, slice_end: datetime, max_time_ms: int | None = None) -> int:
+        condition = condition_count_record_by_id(
+            slice_begin, slice_end, staff_code, face_reg_score_threshold, has_mask
+        )
+        return await stat_cache.count_documents(bodyfacename_collection, condition, slice_end, max_time_ms)
+
+    if time_slicer.should_slice(begin, end):
+        parts = await time_slicer.run("person_count", begin, end, lambda b, e: count(b, e, time_slicer.max_time_ms))
+        return sum(parts)
+    return await count(begin, end)
 
 
 async def get_person_record_by_id(
@@ -161,7 +508,11 @@ async def get_person_record_by_id(
     limit: int = 10,
     enable_count: bool = False,
     logger: logging.Logger | None = None,
+    after: str | None = None,
 ) -> PersonRecordCollection:
+    """the records newest first, `limit` at a time.
+    The next page is read with `after=ret.next`, its cost does not depend on how deep the page is.
+    Raise QueryException if `after` is not a valid token."""
     if logger is None:
         logger = logging.getLogger()
     if not isinstance(begin, datetime):
@@ -175,19 +526,65 @@ async def get_person_record_by_id(
             bodyfacename_collection, staff_code, begin, end, face_reg_score_threshold, has_mask, logger
         )
 
+    records = iter_person_record_by_id(
+        bodyfacename_collection,
+        staff_code,
+        begin,
+        end,
+        face_reg_score_threshold,
+        has_mask,
+        offset,
+        limit,
+        logger,
+        after,
+        page=ret,
+    )
+    ret.values = [record async for record in records]
+    return ret
+
+
+async def iter_person_record_by_id(
+    bodyfacename_collection: AsyncIOMotorCollection,
+    staff_code: str | None = None,
+    begin: datetime = "2023-12-27T00:00:00.000+00:00",
+    end: datetime = "2023-12-27T23:59:59.999+00:00",
+    face_reg_score_threshold: float = 0.63,
+    has_mask: bool = False,
+    offset: int = 0,
+    limit: int = 10,
+    logger: logging.Logger | None = None,
+    after: str | None = None,
+    page: PersonRecordCollection | None = None,
+) -> AsyncIterator[PersonRecord]:
+    """yield the records of `get_person_record_by_id` one by one, as they come from the cursor.
+    The token of the next page is set in `page.next` once the records are exhausted."""
+    if logger is None:
+        logger = logging.getLogger()
+    if not isinstance(begin, datetime):
+        begin = datetime.fromisoformat(begin)
+    if not isinstance(end, datetime):
+        end = datetime.fromisoformat(end)
+
     if limit == 0:
-        return ret
+        return
 
-    pipeline = pipeline_get_record_by_id(begin, end, staff_code, face_reg_score_threshold, has_mask, offset, limit)
+    key = decode_token(after) if after is not None else None
+    # one more record tells whether there is a next page
+    pipeline = pipeline_get_record_by_id(
+        begin, end, staff_code, face_reg_score_threshold, has_mask, offset, limit + 1, key
+    )
     logger.debug(f"running get_person_record_by_id pipeline: {pipeline}")
-    cursor = bodyfacename_collection.aggregate(pipeline)
-    final_result: List[PersonRecord] = []
+    cursor = stat_cache.stream(bodyfacename_collection, pipeline, end)
+    count = 0
+    last: Dict[str, Any] | None = None
     async for document in cursor:
-        record = PersonRecord.model_validate(document)
-        final_result.append(record)
-
-    ret.values = final_result
-    return ret
+        if count == limit:
+            if page is not None:
+                page.next = encode_token(RecordKey(last["image_time"], last["_id"]))
+            continue
+        count += 1
+        last = document
+        yield PersonRecord.model_validate(document)
 
 
 async def get_record_count_by_date_cam(
@@ -198,7 +595,12 @@ async def get_record_count_by_date_cam(
     face_reg_score_threshold: float = 0.63,
     has_mask: bool = False,
     logger: logging.Logger | None = None,
+    granularity: Granularity = Granularity.day,
+    dense: bool = False,
 ) -> ByDateCamCollection:
+    """count the records of each camera in each time bucket of `granularity`, in the local timezone.
+    If `dense`, the empty buckets between the first and the last one are returned with a count of 0.
+    Long windows which are not `dense` are queried in slices, the buckets of the slices are merged."""
     if logger is None:
         logger = logging.getLogger()
     if not isinstance(begin, datetime):
@@ -206,12 +608,40 @@ async def get_record_count_by_date_cam(
     if not isinstance(end, datetime):
         end = datetime.fromisoformat(end)
 
-    pipeline = pipeline_stat_by_camera(begin, end, staff_code, face_reg_score_threshold, has_mask)
-    logger.debug(f"running get_record_count_by_date_cam pipeline: {pipeline}")
-    cursor = bodyfacename_collection.aggregate(pipeline)
-    final_result: List[ByDateCam] = []
-    async for document in cursor:
-        record = ByDateCam.model_validate(document)
-        final_result.append(record)
+    async def buckets(slice_begin: datetime, slice_end: datetime, max_time_ms: int | None = None) -> List[ByDateCam]:
+        pipeline = pipeline_stat_by_camera(
+            slice_begin,
+            slice_end,
+            staff_code,
+            face_reg_score_threshold,
+            has_mask,
+            settings.TIMEZONE,
+            granularity,
+            dense,
+        )
+        logger.debug(f"running get_record_count_by_date_cam pipeline: {pipeline}")
+        cursor = stat_cache.stream(bodyfacename_collection, pipeline, slice_end, max_time_ms)
+        return [ByDateCam.model_validate(document) async for document in cursor]
+
+    # the empty buckets between two slices could not be filled, `dense` queries are never sliced
+    if not dense and time_slicer.should_slice(begin, end):
+        parts = await time_slicer.run("by_date_cam", begin, end, lambda b, e: buckets(b, e, time_slicer.max_time_ms))
+        final_result = merge_date_cam(parts)
+    else:
+        final_result = await buckets(begin, end)
 
     return ByDateCamCollection(count=len(final_result), values=final_result)
+
+
+def merge_date_cam(parts: List[List[ByDateCam]]) -> List[ByDateCam]:
+    """concatenate the buckets of the slices, in the order of the pipeline (camera, then time).
+    A bucket larger than a slice is split between slices, its counts are summed."""
+    merged: Dict[Tuple[str, Any], ByDateCam] = {}
+    for part in parts:
+        for record in part:
+            key = (record.camera_id, record.bucket or record.date)
+            if key in merged:
+                merged[key].count += record.count
+            else:
+                merged[key] = record
+    return [merged[key] for key in sorted(merged, key=lambda k: (k[0], str(k[1])))]
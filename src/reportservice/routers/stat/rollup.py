@@ -0,0 +1,165 @@
+"""Daily attendance rollup: (staff_id, local date) -> first, last, count
+
+The rollup collection lives in the report database and is filled from the BodyFaceName collection.
+A state document per source collection remembers the window already summarized:
+all the records with `since <= image_time < watermark` are in the rollup.
+Records can be inserted long after their image_time (delayed camera uploads, backfills), so each refresh
+summarizes again the whole local days of a trailing re-check window, and replaces their summaries: a refresh
+run twice, or by two workers at the same time, writes the same documents. Records inserted later than the
+re-check window after their day are only picked up by a rebuild.
+Only the default recognition conditions (threshold 0.63, no mask) are summarized.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Optional, Set
+from zoneinfo import ZoneInfo
+from pydantic import BaseModel
+from motor.motor_asyncio import AsyncIOMotorCollection
+from .models import StaffCodeStr
+from .queries import pipeline_rollup_refresh, pipeline_rollup_inout
+from .windows import DaySplit, as_utc, local_date, local_day_begin, split_closed_days
+
+ROLLUP_THRESHOLD = 0.63
+ROLLUP_HAS_MASK = False
+
+
+class RollupState(BaseModel):
+    source: str
+    since: Optional[datetime] = None
+    watermark: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+class AttendanceRollup:
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        state_collection: AsyncIOMotorCollection,
+        tz: str = "Asia/Ho_Chi_Minh",
+        lag: timedelta = timedelta(minutes=5),
+        history: timedelta = timedelta(days=62),
+        recheck_days: int = 2,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        if logger is None:
+            logger = logging.getLogger()
+        self.collection = collection
+        self.state_collection = state_collection
+        self.timezone = tz
+        self.tz = ZoneInfo(tz)
+        self.lag = lag
+        self.history = history
+        self.recheck_days = recheck_days  # closed local days summarized again by each refresh
+        self.logger = logger
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def source_name(source: AsyncIOMotorCollection) -> str:
+        return source.full_name
+
+    async def init(self):
+        """create the unique index required by the $merge stage"""
+        await self.collection.create_index([("source", 1), ("staff_id", 1), ("date", 1)], unique=True)
+        await self.collection.create_index([("source", 1), ("date", 1), ("staff_id", 1)])
+
+    async def get_state(self, source: AsyncIOMotorCollection) -> RollupState:
+        name = self.source_name(source)
+        doc = await self.state_collection.find_one({"_id": name})
+        if doc is None:
+            return RollupState(source=name)
+        doc.pop("_id")
+        return RollupState(source=name, **doc)
+
+    def recheck_begin(self, state: RollupState) -> datetime:
+        """the first instant of the oldest local day summarized again by the next refresh"""
+        day = local_date(as_utc(state.watermark), self.tz) - timedelta(days=self.recheck_days)
+        return max(as_utc(state.since), local_day_begin(day, self.tz))
+
+    async def refresh(self, source: AsyncIOMotorCollection, now: datetime | None = None) -> RollupState:
+        """summarize the whole local days from the re-check window to now - lag"""
+        async with self._lock:
+            state = await self.get_state(source)
+            if now is None:
+                now = datetime.now(timezone.utc)
+            upper = as_utc(now) - self.lag
+            if state.watermark is None:
+                state.since = local_day_begin(local_date(upper - self.history, self.tz), self.tz)
+                lower = state.since
+            elif upper <= as_utc(state.watermark):
+                return state
+            else:
+                lower = self.recheck_begin(state)
+
+            pipeline = pipeline_rollup_refresh(
+                lower,
+                upper,
+                state.source,
+                self.collection.database.name,
+                self.collection.name,
+                ROLLUP_THRESHOLD,
+                ROLLUP_HAS_MASK,
+                self.timezone,
+            )
+            self.logger.debug(f"refreshing rollup of {state.source} in [{lower}, {upper})")
+            async for _ in source.aggregate(pipeline):
+                pass
+
+            # the watermark never goes back if another worker refreshed further meanwhile
+            await self.state_collection.update_one(
+                {"_id": state.source},
+                {
+                    "$setOnInsert": {"since": state.since},
+                    "$max": {"watermark": upper},
+                    "$set": {"updated_at": datetime.now(timezone.utc)},
+                },
+                upsert=True,
+            )
+            return await self.get_state(source)
+
+    async def rebuild(self, source: AsyncIOMotorCollection, now: datetime | None = None) -> RollupState:
+        """drop everything of `source` then summarize again from `now - history`"""
+        async with self._lock:
+            name = self.source_name(source)
+            self.logger.info(f"rebuilding rollup of {name}")
+            await self.collection.delete_many({"source": name})
+            await self.state_collection.delete_one({"_id": name})
+        return await self.refresh(source, now)
+
+    async def split(self, source: AsyncIOMotorCollection, begin: datetime, end: datetime) -> DaySplit:
+        """split [begin, end] into the closed days in the rollup and the remaining raw windows"""
+        state = await self.get_state(source)
+        if state.watermark is None or state.since is None:
+            return DaySplit([], [(begin, end)])
+        return split_closed_days(begin, end, state.since, state.watermark, self.tz)
+
+    async def staff_ids(self, source: AsyncIOMotorCollection, dates: List) -> Set[StaffCodeStr]:
+        """all the staffs represented in the rollup `dates`"""
+        ids = await self.collection.distinct(
+            "staff_id", {"source": self.source_name(source), "date": {"$in": [str(d) for d in dates]}}
+        )
+        return set(ids)
+
+    def inout(self, source: AsyncIOMotorCollection, dates: List, staffcodes: List[StaffCodeStr] | None = None):
+        """a cursor of the first and last record of each staff over the rollup `dates`"""
+        pipeline = pipeline_rollup_inout(self.source_name(source), [str(d) for d in dates], staffcodes)
+        return self.collection.aggregate(pipeline)
+
+    async def run_forever(
+        self,
+        get_source: Callable[[], Awaitable[AsyncIOMotorCollection | None]],
+        interval: float,
+    ):
+        """refresh the rollup every `interval` seconds, until cancelled"""
+        while True:
+            try:
+                source = await get_source()
+                if source is not None:
+                    state = await self.refresh(source)
+                    self.logger.debug(f"rollup of {state.source} is up to {state.watermark}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"cannot refresh the rollup: {e}")
+            await asyncio.sleep(interval)
@@ -1,70 +1,262 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Optional, Dict
 from pydantic import AwareDatetime, NonNegativeInt
-from fastapi import APIRouter, Body
+from fastapi import APIRouter, Body, HTTPException, Query, Request
 from ..common import DepStaffCollection, DepBodyFaceNameCollection, DepLogger
+from .dependencies import DepRollup, DepLive, DepSketches
+from ..common.streaming import NDJSON_MEDIA_TYPE, NDJSON_RESPONSES, ndjson_response, wants_ndjson
+from ..common.columnar import ARROW_MEDIA_TYPE, PARQUET_MEDIA_TYPE, ExportFormat, columnar_response
+from ...settings import settings
+from ...indexes import FACE_INDEXES, STAFF_INDEXES, IndexBootstrapMode, ensure_indexes
 from .retrieval import (
     get_inout_count,
+    get_inout_count_approximate,
+    get_inout_count_windows,
     get_people_count,
-    get_people_inout,
+    get_directory_summary,
+    iter_people_inout,
+    get_people_inout_range,
+    iter_people_inout_range,
     get_has_sample_count,
     get_should_checkinout_count,
+    get_person_count_by_id,
     get_person_record_by_id,
+    iter_person_record_by_id,
     get_record_count_by_date_cam,
 )
-from .models import QueryParamters, PersonInoutCollection, PersonRecordCollection, StaffCodeStr, ByDateCamCollection
+from .rollup import RollupState
+from .strategy import InoutStrategyName, StrategyBenchmark, benchmark_inout_strategies, get_people_inout_adaptive
+from .live import LiveSnapshot
+from .trusted import trusted_response
+from .cache import stat_cache
+from .directory import directory_cache
+from ..common import CacheStats
+from .explain import (
+    ExplainCollection,
+    ExplainRecorder,
+    IndexReport,
+    explain_aggregate,
+    generated_pipelines,
+    summarize_plan,
+)
+from .models import (
+    QueryParamters,
+    QueryException,
+    PersonInout,
+    PersonInoutCollection,
+    PersonInoutDaysCollection,
+    PersonRecord,
+    PersonRecordCollection,
+    StaffCodeStr,
+    ByDateCamCollection,
+    DirectorySummary,
+    ApproximateCount,
+    Granularity,
+    TimeWindow,
+    WindowNameStr,
+)
 
 
 router = APIRouter()
 
+# for the `responses` argument of the routes which can stream NDJSON or export arrow / parquet
+EXPORT_RESPONSES: Dict[int | str, Dict[str, Any]] = {
+    200: {
+        "content": {NDJSON_MEDIA_TYPE: {}, ARROW_MEDIA_TYPE: {}, PARQUET_MEDIA_TYPE: {}},
+        "description": "one document per line then a trailer line, an Arrow IPC stream or a Parquet file",
+    }
+}
+
 
 @router.get("/count_inout")
 async def api_get_inout_count(
     bodyfacename_collection: DepBodyFaceNameCollection,
+    rollup: DepRollup,
+    live: DepLive,
+    sketches: DepSketches,
     begin: datetime = "2023-12-27T00:00:00.000+00:00",
     end: datetime = "2023-12-27T23:59:59.999+00:00",
-) -> int:
-    """Get the count of people represented in a given time range"""
-    return await get_inout_count(bodyfacename_collection, begin, end)
+    approximate: bool = False,
+    explain: bool = False,
+) -> int | ApproximateCount | ExplainCollection:
+    """Get the count of people represented in a given time range.
+    Today (local timezone) is answered from the live counters once they are synced.
+    If approximate is true, estimate the count from the daily sketches and return it with its error bounds.
+    If explain is true, return the execution stats of the pipelines instead"""
+    recorder = ExplainRecorder(enabled=explain)
+    if approximate:
+        if sketches is None:
+            raise HTTPException(status_code=404, detail="The daily sketches are disabled")
+        estimate = await get_inout_count_approximate(recorder.wrap(bodyfacename_collection), sketches, begin, end)
+        return trusted_response(await recorder.result(estimate))
+    count = await get_inout_count(recorder.wrap(bodyfacename_collection), begin, end, rollup=rollup, live=live)
+    return await recorder.result(count)
+
+
+@router.post("/count_inout_windows")
+async def api_get_inout_count_windows(
+    bodyfacename_collection: DepBodyFaceNameCollection,
+    windows: Dict[WindowNameStr, TimeWindow] = Body(
+        ...,
+        examples=[
+            {
+                "checkin": {"begin": "2023-12-27T07:00:00+07:00", "end": "2023-12-27T09:00:00+07:00"},
+                "checkout": {"begin": "2023-12-27T17:00:00+07:00", "end": "2023-12-27T19:00:00+07:00"},
+            }
+        ],
+    ),
+    explain: bool = False,
+) -> Dict[str, int] | ExplainCollection:
+    """Get the count of people represented in each named time range, all counted in a single aggregation"""
+    recorder = ExplainRecorder(enabled=explain)
+    counts = await get_inout_count_windows(recorder.wrap(bodyfacename_collection), windows)
+    return await recorder.result(counts)
 
 
 @router.get("/count_people")
-async def api_get_people_count(staff_collection: DepStaffCollection) -> int:
+async def api_get_people_count(staff_collection: DepStaffCollection, explain: bool = False) -> int | ExplainCollection:
     """Count all people in the database"""
-    return await get_people_count(staff_collection)
+    recorder = ExplainRecorder(enabled=explain)
+    count = await get_people_count(recorder.wrap(staff_collection))
+    return await recorder.result(count)
 
 
 @router.get("/count_has_sample")
-async def api_get_has_sample_count(staff_collection: DepStaffCollection) -> int:
+async def api_get_has_sample_count(
+    staff_collection: DepStaffCollection, explain: bool = False
+) -> int | ExplainCollection:
     """Count the number of people who have face sample in the database"""
-    return await get_has_sample_count(staff_collection)
+    recorder = ExplainRecorder(enabled=explain)
+    count = await get_has_sample_count(recorder.wrap(staff_collection))
+    return await recorder.result(count)
 
 
 @router.get("/count_should_checkinout")
-async def api_get_should_checkinout_count(staff_collection: DepStaffCollection) -> int:
+async def api_get_should_checkinout_count(
+    staff_collection: DepStaffCollection, explain: bool = False
+) -> int | ExplainCollection:
     """should_diemdanh: count the number of people who should be reminded to check in/out today."""
-    return await get_should_checkinout_count(staff_collection)
+    recorder = ExplainRecorder(enabled=explain)
+    count = await get_should_checkinout_count(recorder.wrap(staff_collection))
+    return await recorder.result(count)
+
+
+@router.get("/directory_summary")
+async def api_get_directory_summary(
+    staff_collection: DepStaffCollection, explain: bool = False
+) -> DirectorySummary | ExplainCollection:
+    """Get count_people, count_has_sample and count_should_checkinout at once, in a single aggregation"""
+    recorder = ExplainRecorder(enabled=explain)
+    summary = await get_directory_summary(recorder.wrap(staff_collection))
+    return await recorder.result(summary)
 
 
-@router.post("/people_inout", response_model=PersonInoutCollection)
+@router.post("/people_inout", response_model=PersonInoutCollection | ExplainCollection, responses=EXPORT_RESPONSES)
 async def api_get_people_inout(
+    request: Request,
     staff_collection: DepStaffCollection,
     bodyfacename_collection: DepBodyFaceNameCollection,
     logger: DepLogger,
+    rollup: DepRollup,
     query_params: QueryParamters = Body(...),
     begin: datetime = "2023-12-27T00:00:00.000+00:00",
     end: datetime = "2023-12-27T23:59:59.999+00:00",
-) -> PersonInoutCollection:
-    """Query the first and last recognition time of each staffcode in the database"""
-    peopleinout = await get_people_inout(
-        staff_collection, bodyfacename_collection, query_params=query_params, begin=begin, end=end, logger=logger
+    stream: bool = False,
+    strategy: InoutStrategyName = InoutStrategyName.auto,
+    export_format: ExportFormat = Query(ExportFormat.json, alias="format"),
+    explain: bool = False,
+) -> PersonInoutCollection | ExplainCollection:
+    """Query the first and last recognition time of each staffcode in the database.
+    `strategy` is two_stage, lookup (a single $lookup aggregation) or auto, chosen from the expected number of staffs.
+    With `stream=true` or `Accept: application/x-ndjson`, the staffs are streamed one per line as they are found,
+    followed by a trailer line `{"count": n}`, always with the two stage query.
+    With `format=arrow` or `format=parquet`, the staffs are streamed as an Arrow IPC stream or a Parquet file,
+    in record batches of a fixed number of rows, also with the two stage query"""
+    columnar = export_format != ExportFormat.json
+    if not explain and (columnar or wants_ndjson(request, stream)):
+        staffs = iter_people_inout(
+            staff_collection, bodyfacename_collection, query_params, begin, end, logger, rollup=rollup
+        )
+        if columnar:
+            return await columnar_response(
+                staffs, PersonInout, export_format, settings.EXPORT_CHUNK_SIZE, filename="people_inout"
+            )
+        return await ndjson_response(staffs)
+
+    recorder = ExplainRecorder(enabled=explain)
+    try:
+        peopleinout = await get_people_inout_adaptive(
+            recorder.wrap(staff_collection),
+            recorder.wrap(bodyfacename_collection),
+            query_params=query_params,
+            begin=begin,
+            end=end,
+            logger=logger,
+            rollup=rollup,
+            strategy=strategy,
+        )
+    except QueryException as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    return trusted_response(await recorder.result(peopleinout))
+
+
+@router.post("/people_inout/benchmark")
+async def api_benchmark_people_inout(
+    staff_collection: DepStaffCollection,
+    bodyfacename_collection: DepBodyFaceNameCollection,
+    logger: DepLogger,
+    query_params: QueryParamters = Body(...),
+    begin: datetime = "2023-12-27T00:00:00.000+00:00",
+    end: datetime = "2023-12-27T23:59:59.999+00:00",
+    repeat: int = Query(3, ge=1, le=10),
+) -> StrategyBenchmark:
+    """Run the in-out query with every strategy on the real data, bypassing the caches.
+    Return the best time of each strategy, the fastest one and the one `auto` would choose"""
+    return await benchmark_inout_strategies(
+        staff_collection, bodyfacename_collection, query_params, begin, end, logger, repeat
     )
 
-    return peopleinout
+
+MAX_RANGE_DAYS = 366
+
+
+@router.post(
+    "/people_inout_range", response_model=PersonInoutDaysCollection | ExplainCollection, responses=NDJSON_RESPONSES
+)
+async def api_get_people_inout_range(
+    request: Request,
+    staff_collection: DepStaffCollection,
+    bodyfacename_collection: DepBodyFaceNameCollection,
+    logger: DepLogger,
+    begin: AwareDatetime,
+    end: AwareDatetime,
+    query_params: QueryParamters = Body(...),
+    stream: bool = False,
+    explain: bool = False,
+) -> PersonInoutDaysCollection | ExplainCollection:
+    """Query the first and last recognition time of each staff on each local day of [begin, end],
+    e.g. a monthly attendance matrix, in a single aggregation over the whole range.
+    Only the days with at least one record are listed for each staff.
+    With `stream=true` or `Accept: application/x-ndjson`, the staffs are streamed one per line as they are found,
+    followed by a trailer line `{"count": n}`"""
+    if end - begin > timedelta(days=MAX_RANGE_DAYS):
+        raise HTTPException(status_code=400, detail=f"The range can not be longer than {MAX_RANGE_DAYS} days")
+
+    if not explain and wants_ndjson(request, stream):
+        staffs = iter_people_inout_range(staff_collection, bodyfacename_collection, query_params, begin, end, logger)
+        return await ndjson_response(staffs)
+
+    recorder = ExplainRecorder(enabled=explain)
+    matrix = await get_people_inout_range(
+        recorder.wrap(staff_collection), recorder.wrap(bodyfacename_collection), query_params, begin, end, logger
+    )
+    return trusted_response(await recorder.result(matrix))
 
 
-@router.get("/person_record")
+@router.get("/person_record", responses=EXPORT_RESPONSES)
 async def api_get_person_record_by_id(
+    request: Request,
     bodyfacename_collection: DepBodyFaceNameCollection,
     logger: DepLogger,
     staff_id: Optional[StaffCodeStr] = None,
@@ -75,11 +267,21 @@ async def api_get_person_record_by_id(
     offset: NonNegativeInt = 0,
     limit: NonNegativeInt = 10,
     count: bool = False,
-) -> PersonRecordCollection:
+    after: Optional[str] = None,
+    stream: bool = False,
+    export_format: ExportFormat = Query(ExportFormat.json, alias="format"),
+    explain: bool = False,
+) -> PersonRecordCollection | ExplainCollection:
     """Get the recognition record of a person by staff_code.
     If both begin and end are not provided, the function will return the records for today (local timezone).
     If only begin is provided, the function will return the records from begin to now.
     If limit is larger than 100, it will be set to 100 to prevent the server from being overloaded.
+    The records are sorted newest first, pass the `next` token of a page as `after` to get the following page.
+    Prefer `after` to `offset` for deep pages, its cost does not depend on the page number.
+    With `stream=true` or `Accept: application/x-ndjson`, the records are streamed one per line,
+    followed by a trailer line `{"count": n, "total": count or null, "next": token or null}`.
+    With `format=arrow` or `format=parquet`, the records of the page are streamed as an Arrow IPC stream or a Parquet
+    file, without the count and the `next` token.
     """
     if begin is None and end is None:
         begin = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).astimezone()
@@ -91,18 +293,53 @@ async def api_get_person_record_by_id(
     if limit > 100:
         limit = 100
 
-    return await get_person_record_by_id(
-        bodyfacename_collection=bodyfacename_collection,
-        staff_code=staff_id,
-        begin=begin,
-        end=end,
-        face_reg_score_threshold=face_reg_score_threshold,
-        has_mask=has_mask,
-        offset=offset,
-        limit=limit,
-        logger=logger,
-        enable_count=count,
-    )
+    columnar = export_format != ExportFormat.json
+    if not explain and (columnar or wants_ndjson(request, stream)):
+        page = PersonRecordCollection()
+        if count and not columnar:
+            page.count = await get_person_count_by_id(
+                bodyfacename_collection, staff_id, begin, end, face_reg_score_threshold, has_mask, logger
+            )
+        records = iter_person_record_by_id(
+            bodyfacename_collection,
+            staff_id,
+            begin,
+            end,
+            face_reg_score_threshold,
+            has_mask,
+            offset,
+            limit,
+            logger,
+            after,
+            page=page,
+        )
+        try:
+            if columnar:
+                return await columnar_response(
+                    records, PersonRecord, export_format, settings.EXPORT_CHUNK_SIZE, filename="person_record"
+                )
+            return await ndjson_response(records, lambda n: {"count": n, "total": page.count, "next": page.next})
+        except QueryException as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+
+    recorder = ExplainRecorder(enabled=explain)
+    try:
+        records = await get_person_record_by_id(
+            bodyfacename_collection=recorder.wrap(bodyfacename_collection),
+            staff_code=staff_id,
+            begin=begin,
+            end=end,
+            face_reg_score_threshold=face_reg_score_threshold,
+            has_mask=has_mask,
+            offset=offset,
+            limit=limit,
+            logger=logger,
+            enable_count=count,
+            after=after,
+        )
+    except QueryException as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    return trusted_response(await recorder.result(records))
 
 
 @router.get("/by_date_cam_stats")
@@ -114,10 +351,15 @@ async def api_get_record_count_by_date_cam(
     end: Optional[AwareDatetime] = None,
     face_reg_score_threshold: float = 0.63,
     has_mask: bool = False,
-) -> ByDateCamCollection:
+    granularity: Granularity = Granularity.day,
+    dense: bool = False,
+    explain: bool = False,
+) -> ByDateCamCollection | ExplainCollection:
     """Get the recognition record of a person by staff_code.
     If both begin and end are not provided, the function will return the records for the last 7 days (local timezone).
     If only begin is provided, the function will return the records from begin to now.
+    The records are counted per camera in buckets of `granularity` (15min, hour or day), `bucket` is the start
+    of each bucket. If `dense` is true, the empty buckets between the first and the last one have a count of 0.
     """
     if begin is None and end is None:
         begin = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).astimezone() - timedelta(days=7)
@@ -126,6 +368,97 @@ async def api_get_record_count_by_date_cam(
     if end is None:
         end = datetime.now().astimezone()
 
-    return await get_record_count_by_date_cam(
-        bodyfacename_collection, staff_id, begin, end, face_reg_score_threshold, has_mask, logger
+    recorder = ExplainRecorder(enabled=explain)
+    stats = await get_record_count_by_date_cam(
+        recorder.wrap(bodyfacename_collection),
+        staff_id,
+        begin,
+        end,
+        face_reg_score_threshold,
+        has_mask,
+        logger,
+        granularity=granularity,
+        dense=dense,
     )
+    return trusted_response(await recorder.result(stats))
+
+
+@router.get("/cache")
+async def api_get_cache_stats() -> CacheStats:
+    """Get the size and the hit/miss counters of the stat result cache"""
+    return stat_cache.stats()
+
+
+@router.delete("/cache")
+async def api_clear_cache(logger: DepLogger) -> CacheStats:
+    """Drop all the cached stat results and staff directory counters"""
+    logger.info("Clearing the stat result cache")
+    stat_cache.clear()
+    directory_cache.invalidate()
+    return stat_cache.stats()
+
+
+@router.get("/live")
+async def api_get_live_snapshot(bodyfacename_collection: DepBodyFaceNameCollection, live: DepLive) -> LiveSnapshot:
+    """Get the live counters of today: distinct staffs and records per camera.
+    The first call starts the watcher, `synced` is false until the counters are ready"""
+    if live is None:
+        raise HTTPException(status_code=404, detail="The live counters are disabled")
+    live.ensure_started(bodyfacename_collection)
+    return live.snapshot()
+
+
+def _require_rollup(rollup: DepRollup):
+    if rollup is None:
+        raise HTTPException(status_code=404, detail="The attendance rollup is disabled")
+    return rollup
+
+
+@router.get("/rollup")
+async def api_get_rollup_state(bodyfacename_collection: DepBodyFaceNameCollection, rollup: DepRollup) -> RollupState:
+    """Get the window already summarized in the daily attendance rollup"""
+    return await _require_rollup(rollup).get_state(bodyfacename_collection)
+
+
+@router.post("/rollup/refresh")
+async def api_refresh_rollup(bodyfacename_collection: DepBodyFaceNameCollection, rollup: DepRollup) -> RollupState:
+    """Summarize the new records into the daily attendance rollup now"""
+    return await _require_rollup(rollup).refresh(bodyfacename_collection)
+
+
+@router.post("/rollup/rebuild")
+async def api_rebuild_rollup(
+    bodyfacename_collection: DepBodyFaceNameCollection, rollup: DepRollup, logger: DepLogger
+) -> RollupState:
+    """Drop the daily attendance rollup and summarize all the records again"""
+    logger.info(f"Rebuilding the attendance rollup of {bodyfacename_collection.full_name}")
+    return await _require_rollup(rollup).rebuild(bodyfacename_collection)
+
+
+@router.get("/indexes")
+async def api_get_indexes(
+    staff_collection: DepStaffCollection,
+    bodyfacename_collection: DepBodyFaceNameCollection,
+    logger: DepLogger,
+    staff_id: StaffCodeStr = "0",
+    begin: Optional[AwareDatetime] = None,
+    end: Optional[AwareDatetime] = None,
+) -> IndexReport:
+    """Show the recommended indexes of the FaceID collections, and whether the generated pipelines use an index
+    or do a COLLSCAN. The pipelines are explained (not executed) with `staff_id` and [begin, end], default today.
+    """
+    if begin is None:
+        begin = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).astimezone()
+    if end is None:
+        end = begin + timedelta(days=1) - timedelta(milliseconds=1)
+
+    report = IndexReport()
+    report.indexes += await ensure_indexes(bodyfacename_collection, FACE_INDEXES, IndexBootstrapMode.dry_run, logger)
+    report.indexes += await ensure_indexes(staff_collection, STAFF_INDEXES, IndexBootstrapMode.dry_run, logger)
+
+    collections = {"face": bodyfacename_collection, "staff": staff_collection}
+    for name, target, pipeline in generated_pipelines(begin, end, staff_id):
+        collection = collections[target]
+        explain = await explain_aggregate(collection, pipeline)
+        report.plans.append(summarize_plan(name, collection.full_name, explain))
+    return report
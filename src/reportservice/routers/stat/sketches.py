@@ -0,0 +1,145 @@
+"""Daily HyperLogLog sketches of the distinct staffs
+
+The sketch of a closed local day (ended more than `lag` ago) is built from the BodyFaceName collection in background
+and stored in the report database, one document per (source collection, date, precision). The last `recheck_days`
+closed days are sketched again by each refresh, for the records uploaded late.
+The count of any range merges the stored sketches of its whole days with sketches of the head and tail windows and
+of the days not sketched yet, built on the fly from the records, one window at a time.
+Only the default recognition conditions (threshold 0.63, no mask) are counted.
+"""
+
+import asyncio
+import logging
+import math
+from datetime import date, datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List
+from zoneinfo import ZoneInfo
+from bson import Binary
+from motor.motor_asyncio import AsyncIOMotorCollection
+from ..common.concurrency import gather_with_concurrency
+from ...settings import settings
+from .hll import HyperLogLog
+from .models import ApproximateCount
+from .queries import pipeline_distinct_staff
+from .windows import as_utc, local_date, local_day_begin, local_day_window, split_closed_days
+
+SKETCH_THRESHOLD = 0.63
+SKETCH_HAS_MASK = False
+
+
+class DailySketches:
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        tz: str = "Asia/Ho_Chi_Minh",
+        precision: int = 12,
+        lag: timedelta = timedelta(minutes=10),
+        history: timedelta = timedelta(days=62),
+        recheck_days: int = 2,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        if logger is None:
+            logger = logging.getLogger()
+        self.collection = collection
+        self.tz = ZoneInfo(tz)
+        self.precision = precision
+        self.lag = lag
+        self.history = history  # how many days back the refresher sketches
+        self.recheck_days = recheck_days  # closed days sketched again by each refresh
+        self.logger = logger
+
+    async def init(self):
+        await self.collection.create_index([("source", 1), ("date", 1), ("precision", 1)], unique=True)
+
+    async def load(self, source: AsyncIOMotorCollection, dates: List[date]) -> Dict[date, HyperLogLog]:
+        """the stored sketches of `dates`, the missing days are not in the result"""
+        if not dates:
+            return {}
+        condition = {"source": source.full_name, "precision": self.precision, "date": {"$in": [str(d) for d in dates]}}
+        return {
+            date.fromisoformat(doc["date"]): HyperLogLog(self.precision, doc["registers"])
+            async for doc in self.collection.find(condition)
+        }
+
+    async def sketch_window(self, source: AsyncIOMotorCollection, begin: datetime, end: datetime) -> HyperLogLog:
+        """the sketch of the distinct staffs in [begin, end], read from the records.
+        The ids are hashed as they come from the cursor, they are neither kept nor cached"""
+        sketch = HyperLogLog(self.precision)
+        pipeline = pipeline_distinct_staff(begin, end, SKETCH_THRESHOLD, SKETCH_HAS_MASK)
+        async for document in source.aggregate(pipeline):
+            sketch.add(document["_id"])
+        return sketch
+
+    async def build(self, source: AsyncIOMotorCollection, day: date) -> HyperLogLog:
+        """sketch the closed day `day` and store it"""
+        begin, end = local_day_window(day, self.tz)
+        sketch = await self.sketch_window(source, begin, end)
+        await self.collection.update_one(
+            {"source": source.full_name, "date": str(day), "precision": self.precision},
+            {"$set": {"registers": Binary(sketch.to_bytes()), "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+        self.logger.debug(f"sketch of {source.full_name} on {day} stored")
+        return sketch
+
+    async def refresh(self, source: AsyncIOMotorCollection, now: datetime | None = None) -> List[date]:
+        """sketch the closed days of the last `history` which are not stored yet, and the last `recheck_days`
+        closed days again. Return the dates sketched"""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        until = as_utc(now) - self.lag
+        since = local_day_begin(local_date(until - self.history, self.tz), self.tz)
+        split = split_closed_days(since, until, since, until, self.tz)
+        condition = {"source": source.full_name, "precision": self.precision}
+        stored = set(await self.collection.distinct("date", condition))
+        recheck = set(split.dates[-self.recheck_days :]) if self.recheck_days > 0 else set()
+        dates = [d for d in split.dates if str(d) not in stored or d in recheck]
+        # one day at a time, the refresher must not compete with the requests
+        for day in dates:
+            await self.build(source, day)
+        return dates
+
+    async def estimate(
+        self, source: AsyncIOMotorCollection, begin: datetime, end: datetime, now: datetime | None = None
+    ) -> ApproximateCount:
+        """estimate the number of distinct staffs in [begin, end]. The days not sketched yet are read from the
+        records like the head and tail windows, nothing is stored on the request path"""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        split = split_closed_days(begin, end, begin, as_utc(now) - self.lag, self.tz)
+        stored = await self.load(source, split.dates)
+        windows = split.raw_windows + [local_day_window(d, self.tz) for d in split.dates if d not in stored]
+        raw = {f"{b}/{e}": self.sketch_window(source, b, e) for b, e in windows}
+        built = await gather_with_concurrency(settings.QUERY_CONCURRENCY, raw, self.logger)
+
+        sketch = HyperLogLog(self.precision)
+        for part in [*stored.values(), *built.values()]:
+            sketch.merge(part)
+        count = len(sketch)
+        margin = 2 * sketch.error * count
+        return ApproximateCount(
+            count=count,
+            error=sketch.error,
+            lower=max(0, math.floor(count - margin)),
+            upper=math.ceil(count + margin),
+            sketched_days=len(stored),
+        )
+
+    async def run_forever(
+        self,
+        get_source: Callable[[], Awaitable[AsyncIOMotorCollection | None]],
+        interval: float,
+    ):
+        """sketch the days as they close, every `interval` seconds, until cancelled"""
+        while True:
+            try:
+                source = await get_source()
+                if source is not None:
+                    built = await self.refresh(source)
+                    if built:
+                        self.logger.debug(f"{len(built)} daily sketches of {source.full_name} built")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"cannot build the daily sketches: {e}")
+            await asyncio.sleep(interval)
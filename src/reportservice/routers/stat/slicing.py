@@ -0,0 +1,103 @@
+"""Time-sliced execution of the queries over long windows
+
+A month or a quarter long aggregation can run longer than the socket timeout. Long windows are split along the local
+day (or hour) boundaries, the slices are queried concurrently, at most `limit` at the same time and each one bounded
+by `max_time_ms` on the server, then the partial results are merged by the caller:
+a set union for the distinct staffs, a sum for the counts, a concatenation for the camera buckets.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Awaitable, Callable, List, TypeVar
+from zoneinfo import ZoneInfo
+from ..common.concurrency import gather_with_concurrency
+from ...settings import settings
+from .windows import Window, as_utc, local_date, local_day_begin
+
+T = TypeVar("T")
+
+# mongo stores datetime with millisecond precision, [begin, end] windows are closed on both sides
+_EPSILON = timedelta(milliseconds=1)
+
+
+class SliceUnit(str, Enum):
+    day = "day"
+    hour = "hour"
+
+
+def next_boundary(dt: datetime, unit: SliceUnit, tz: ZoneInfo) -> datetime:
+    """the first local day (or hour) boundary strictly after `dt`, in UTC"""
+    if unit == SliceUnit.day:
+        return local_day_begin(local_date(dt, tz) + timedelta(days=1), tz)
+    hour = as_utc(dt).astimezone(tz).replace(minute=0, second=0, microsecond=0)
+    return hour.astimezone(timezone.utc) + timedelta(hours=1)
+
+
+def slice_window(begin: datetime, end: datetime, unit: SliceUnit, tz: ZoneInfo) -> List[Window]:
+    """split [begin, end] into contiguous [begin, end] slices which do not cross a local day (or hour) boundary"""
+    begin, end = as_utc(begin), as_utc(end)
+    slices: List[Window] = []
+    lower = begin
+    while lower <= end:
+        upper = next_boundary(lower, unit, tz)
+        slices.append((lower, min(upper - _EPSILON, end)))
+        lower = upper
+    return slices
+
+
+class TimeSlicer:
+    def __init__(
+        self,
+        unit: SliceUnit = SliceUnit.day,
+        min_span: timedelta = timedelta(days=7),
+        limit: int = 4,
+        max_time_ms: int | None = None,
+        tz: str = "Asia/Ho_Chi_Minh",
+        logger: logging.Logger | None = None,
+    ) -> None:
+        if logger is None:
+            logger = logging.getLogger()
+        self.unit = SliceUnit(unit)
+        self.min_span = min_span
+        self.limit = limit
+        self.max_time_ms = max_time_ms
+        self.tz = ZoneInfo(tz)
+        self.logger = logger
+
+    def should_slice(self, begin: datetime, end: datetime) -> bool:
+        return as_utc(end) - as_utc(begin) > self.min_span
+
+    def slices(self, begin: datetime, end: datetime) -> List[Window]:
+        return slice_window(begin, end, self.unit, self.tz)
+
+    async def run(
+        self, name: str, begin: datetime, end: datetime, query: Callable[[datetime, datetime], Awaitable[T]]
+    ) -> List[T]:
+        """run `query(slice_begin, slice_end)` on every slice of [begin, end], return the results in time order"""
+        windows = self.slices(begin, end)
+        start = time.perf_counter()
+        done = 0
+
+        async def _run(slice_begin: datetime, slice_end: datetime) -> T:
+            nonlocal done
+            result = await query(slice_begin, slice_end)
+            done += 1
+            self.logger.debug(f"{name}: {done}/{len(windows)} slices done")
+            return result
+
+        results = await gather_with_concurrency(
+            self.limit, {f"{name} [{b.isoformat()}, {e.isoformat()}]": _run(b, e) for b, e in windows}, self.logger
+        )
+        self.logger.info(f"{name}: {len(windows)} slices in {time.perf_counter() - start:.1f} s")
+        return list(results.values())
+
+
+time_slicer = TimeSlicer(
+    unit=settings.SLICE_UNIT,
+    min_span=timedelta(days=settings.SLICE_MIN_DAYS),
+    limit=settings.QUERY_CONCURRENCY,
+    max_time_ms=settings.SLICE_MAX_TIME_MS,
+    tz=settings.TIMEZONE,
+)
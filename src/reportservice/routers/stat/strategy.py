@@ -0,0 +1,216 @@
+"""Strategies of the in-out queries
+
+- two_stage: find the staffs, then the first and last records of all their staff codes with one `$in`,
+  merged in python. It can read the closed days from the rollup.
+- lookup: a single aggregation on the staff collection, joining the records of each staff with `$lookup`.
+
+Since MongoDB 5.0 the sub-query of the `$lookup` uses the index on staff_id, and for a few staffs the single
+aggregation saves a round trip. For many staffs the `$in` of the two stage query is read with one index scan,
+while the `$lookup` runs one sub-query per staff. `auto` picks the lookup only for a few expected staffs.
+"""
+
+import logging
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from enum import Enum
+from typing import Dict, Tuple
+from pydantic import BaseModel, Field
+from motor.motor_asyncio import AsyncIOMotorCollection
+from ...settings import settings
+from .models import PersonInout, PersonInoutCollection, QueryException, QueryParamters
+from .cache import UncachedCollection
+from .queries import pipeline_staffs_inou
+from .retrieval import get_people_inout
+from .rollup import AttendanceRollup
+
+LOOKUP_MIN_VERSION = (5, 0)
+
+
+class InoutStrategyName(str, Enum):
+    auto = "auto"
+    two_stage = "two_stage"
+    lookup = "lookup"
+
+
+class InoutStrategy(ABC):
+    name: InoutStrategyName
+    min_version: Tuple[int, ...] | None = None  # major, minor version of the server, if it needs a recent one
+
+    def supports(
+        self, staff_collection: AsyncIOMotorCollection, bodyfacename_collection: AsyncIOMotorCollection
+    ) -> bool:
+        return True
+
+    @abstractmethod
+    async def run(
+        self,
+        staff_collection: AsyncIOMotorCollection,
+        bodyfacename_collection: AsyncIOMotorCollection,
+        query_params: QueryParamters,
+        begin: datetime,
+        end: datetime,
+        logger: logging.Logger,
+        rollup: AttendanceRollup | None = None,
+    ) -> PersonInoutCollection: ...
+
+
+class TwoStageStrategy(InoutStrategy):
+    name = InoutStrategyName.two_stage
+
+    async def run(self, staff_collection, bodyfacename_collection, query_params, begin, end, logger, rollup=None):
+        return await get_people_inout(
+            staff_collection, bodyfacename_collection, query_params, begin, end, logger, rollup=rollup
+        )
+
+
+class LookupStrategy(InoutStrategy):
+    name = InoutStrategyName.lookup
+    min_version = LOOKUP_MIN_VERSION
+
+    def supports(self, staff_collection, bodyfacename_collection) -> bool:
+        # $lookup only joins a collection of the same database
+        return staff_collection.database.name == bodyfacename_collection.database.name
+
+    async def run(self, staff_collection, bodyfacename_collection, query_params, begin, end, logger, rollup=None):
+        if query_params.is_empty():
+            return PersonInoutCollection(count=0, values=[])
+        pipeline = pipeline_staffs_inou(query_params, begin, end, 0.63, False, bodyfacename_collection.name)
+        logger.debug(f"running in-out lookup pipeline: {pipeline}")
+        values = [PersonInout.model_validate(document) async for document in staff_collection.aggregate(pipeline)]
+        return PersonInoutCollection(count=len(values), values=values)
+
+
+STRATEGIES: Dict[InoutStrategyName, InoutStrategy] = {
+    InoutStrategyName.two_stage: TwoStageStrategy(),
+    InoutStrategyName.lookup: LookupStrategy(),
+}
+
+# major, minor version of the servers, by client
+_server_versions: Dict[int, Tuple[int, ...]] = {}
+
+
+async def server_version(collection: AsyncIOMotorCollection) -> Tuple[int, ...]:
+    client = collection.database.client
+    if id(client) not in _server_versions:
+        info = await client.server_info()
+        _server_versions[id(client)] = tuple(info.get("versionArray", [0, 0])[:2])
+    return _server_versions[id(client)]
+
+
+async def version_supported(strategy: InoutStrategy, collection: AsyncIOMotorCollection) -> bool:
+    """True if the server of `collection` is recent enough for `strategy`"""
+    return strategy.min_version is None or await server_version(collection) >= strategy.min_version
+
+
+def expected_staff_count(query_params: QueryParamters) -> int | None:
+    """the number of staffs the query should find, None if it can not be told without running it.
+    A staff code, a full name, an email or a cellphone is expected to match about one staff."""
+    if query_params.units or query_params.departments or query_params.titles:
+        return None
+    if query_params.custom_query != QueryParamters().custom_query:
+        return None
+    return (
+        len(query_params.staffcodes)
+        + len(query_params.fullnames)
+        + len(query_params.emails)
+        + len(query_params.cellphones)
+    )
+
+
+async def choose_strategy(
+    staff_collection: AsyncIOMotorCollection,
+    bodyfacename_collection: AsyncIOMotorCollection,
+    query_params: QueryParamters,
+    begin: datetime,
+    end: datetime,
+    rollup: AttendanceRollup | None = None,
+) -> InoutStrategy:
+    """the lookup for a few expected staffs on a recent server, when the rollup would not help. Else two stage"""
+    two_stage, lookup = STRATEGIES[InoutStrategyName.two_stage], STRATEGIES[InoutStrategyName.lookup]
+    expected = expected_staff_count(query_params)
+    if expected is None or expected > settings.INOUT_LOOKUP_MAX_STAFFS:
+        return two_stage
+    if not lookup.supports(staff_collection, bodyfacename_collection):
+        return two_stage
+    if not await version_supported(lookup, staff_collection):
+        return two_stage
+    if rollup is not None and (await rollup.split(bodyfacename_collection, begin, end)).dates:
+        return two_stage
+    return lookup
+
+
+async def get_people_inout_adaptive(
+    staff_collection: AsyncIOMotorCollection,
+    bodyfacename_collection: AsyncIOMotorCollection,
+    query_params: QueryParamters,
+    begin: datetime = "2023-12-27T00:00:00.000+00:00",
+    end: datetime = "2023-12-27T23:59:59.999+00:00",
+    logger: logging.Logger | None = None,
+    rollup: AttendanceRollup | None = None,
+    strategy: InoutStrategyName = InoutStrategyName.auto,
+) -> PersonInoutCollection:
+    """same as `get_people_inout`, with the query strategy chosen by `strategy`.
+    Raise QueryException if the strategy can not run on these collections"""
+    if logger is None:
+        logger = logging.getLogger()
+    if not isinstance(begin, datetime):
+        begin = datetime.fromisoformat(begin)
+    if not isinstance(end, datetime):
+        end = datetime.fromisoformat(end)
+
+    if strategy == InoutStrategyName.auto:
+        chosen = await choose_strategy(staff_collection, bodyfacename_collection, query_params, begin, end, rollup)
+    else:
+        chosen = STRATEGIES[strategy]
+        if not chosen.supports(staff_collection, bodyfacename_collection):
+            raise QueryException(f"the {strategy.value} strategy needs the collections in the same database")
+        if not await version_supported(chosen, staff_collection):
+            version = ".".join(map(str, chosen.min_version))
+            raise QueryException(f"the {strategy.value} strategy needs MongoDB {version} or later")
+    logger.debug(f"running in-out query with the {chosen.name.value} strategy")
+    return await chosen.run(staff_collection, bodyfacename_collection, query_params, begin, end, logger, rollup)
+
+
+class StrategyBenchmark(BaseModel):
+    count: int = Field(description="number of staffs found")
+    timings: Dict[InoutStrategyName, float] = Field(description="best time of each strategy, in seconds")
+    winner: InoutStrategyName
+    chosen: InoutStrategyName = Field(description="the strategy `auto` would choose")
+
+
+async def benchmark_inout_strategies(
+    staff_collection: AsyncIOMotorCollection,
+    bodyfacename_collection: AsyncIOMotorCollection,
+    query_params: QueryParamters,
+    begin: datetime,
+    end: datetime,
+    logger: logging.Logger | None = None,
+    repeat: int = 3,
+) -> StrategyBenchmark:
+    """run the query with every supported strategy, `repeat` times each, and record the best time of each.
+    The caches are bypassed so that every run reaches mongo"""
+    if logger is None:
+        logger = logging.getLogger()
+    staff_collection = UncachedCollection(staff_collection)
+    bodyfacename_collection = UncachedCollection(bodyfacename_collection)
+    timings: Dict[InoutStrategyName, float] = {}
+    count = 0
+    for name, strategy in STRATEGIES.items():
+        if not strategy.supports(staff_collection, bodyfacename_collection):
+            continue
+        if not await version_supported(strategy, staff_collection):
+            continue
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = await strategy.run(staff_collection, bodyfacename_collection, query_params, begin, end, logger)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+        count = result.count
+    chosen = await choose_strategy(staff_collection, bodyfacename_collection, query_params, begin, end)
+    benchmark = StrategyBenchmark(
+        count=count, timings=timings, winner=min(timings, key=timings.get), chosen=chosen.name
+    )
+    logger.info(f"in-out strategies on {count} staffs: {benchmark.model_dump_json()}")
+    return benchmark
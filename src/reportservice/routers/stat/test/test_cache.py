@@ -0,0 +1,98 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from ..cache import ResultCache
+from ...common.lru import LRUCache
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __aiter__(self):
+        self._iter = iter(self.documents)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration from None
+
+
+class FakeCollection:
+    full_name = "FaceID.BodyFaceName"
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.calls = 0
+
+    def aggregate(self, pipeline):
+        self.calls += 1
+        return FakeCursor(self.documents)
+
+    async def count_documents(self, condition):
+        self.calls += 1
+        return len(self.documents)
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # b is the least recently used
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    cache.set("d", 4, ttl=-1)  # already expired
+    assert cache.get("d") is None
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions) == (2, 2, 2)
+
+
+def test_result_cache_ttl():
+    cache = ResultCache(ttl_closed=1000, ttl_open=10, closed_after=timedelta(minutes=10))
+    now = datetime(2023, 12, 28, tzinfo=timezone.utc)
+    assert cache.ttl(datetime(2023, 12, 27), now) == 1000
+    assert cache.ttl(now - timedelta(minutes=1), now) == 10
+
+
+@pytest.mark.asyncio
+async def test_result_cache_aggregate():
+    cache = ResultCache()
+    collection = FakeCollection([{"count": 1}])
+    pipeline = [{"$match": {"image_time": {"$gte": datetime(2023, 12, 27)}}}]
+    end = datetime(2023, 12, 27, tzinfo=timezone.utc)
+    assert await cache.aggregate(collection, pipeline, end) == [{"count": 1}]
+    assert await cache.aggregate(collection, pipeline, end) == [{"count": 1}]
+    assert collection.calls == 1
+    assert cache.stats().hits == 1
+
+    # another window is another entry
+    other = [{"$match": {"image_time": {"$gte": datetime(2023, 12, 26)}}}]
+    await cache.aggregate(collection, other, end)
+    assert collection.calls == 2
+
+    assert await cache.count_documents(collection, {}, end) == 1
+    assert await cache.count_documents(collection, {}, end) == 1
+    assert collection.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_result_cache_too_large():
+    cache = ResultCache(max_documents=2)
+    collection = FakeCollection([{"i": i} for i in range(3)])
+    end = datetime(2023, 12, 27, tzinfo=timezone.utc)
+    assert len(await cache.aggregate(collection, [], end)) == 3
+    assert len(await cache.aggregate(collection, [], end)) == 3
+    assert collection.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_result_cache_bypass():
+    cache = ResultCache()
+    collection = FakeCollection([{"count": 1}])
+    collection.bypass_cache = True
+    end = datetime(2023, 12, 27, tzinfo=timezone.utc)
+    await cache.aggregate(collection, [], end)
+    await cache.aggregate(collection, [], end)
+    assert collection.calls == 2
@@ -0,0 +1,84 @@
+import logging
+import pytest
+from datetime import datetime
+from ..compiler import ALWAYS, NEVER, NotCompilable, compile_expr
+from ..models import QueryParamters
+from ..queries import MATCH_NOTHING, condition_find_staff, pipeline_staffs_inou
+
+
+@pytest.mark.parametrize(
+    "expr, expected",
+    [
+        ({"$eq": [1, 0]}, NEVER),
+        ({"$eq": [1, 1]}, ALWAYS),
+        ({"$eq": ["$unit", "BigHospital"]}, {"unit": "BigHospital"}),
+        ({"$ne": ["$unit", "BigHospital"]}, {"unit": {"$ne": "BigHospital"}}),
+        ({"$lt": [5, "$age"]}, {"age": {"$gt": 5}}),
+        ({"$gte": ["$created", datetime(2023, 1, 1)]}, {"created": {"$gte": datetime(2023, 1, 1)}}),
+        ({"$in": ["$unit", ["a", "b"]]}, {"unit": {"$in": ["a", "b"]}}),
+        ({"$in": ["$unit", []]}, NEVER),
+        (
+            {"$and": [{"$eq": ["$unit", "BigHospital"]}, {"$eq": ["$department", "Mamachue"]}]},
+            {"$and": [{"unit": "BigHospital"}, {"department": "Mamachue"}]},
+        ),
+        ({"$and": [{"$eq": ["$unit", "a"]}, {"$eq": [1, 1]}]}, {"unit": "a"}),
+        ({"$and": [{"$eq": ["$unit", "a"]}, {"$eq": [1, 0]}]}, NEVER),
+        ({"$or": [{"$eq": ["$unit", "a"]}, {"$eq": [1, 1]}]}, ALWAYS),
+        ({"$or": [{"$eq": [1, 0]}, {"$eq": [2, 0]}]}, NEVER),
+    ],
+)
+def test_compile_expr(expr, expected):
+    assert compile_expr(expr) == expected
+
+
+@pytest.mark.parametrize(
+    "expr, field, op, value",
+    [
+        ({"$lt": ["$age", 5]}, "age", "$lt", 5),
+        ({"$lte": ["$age", 5]}, "age", "$lte", 5),
+        ({"$gt": [5, "$age"]}, "age", "$lt", 5),
+        ({"$gte": [datetime(2023, 1, 1), "$created"]}, "created", "$lte", datetime(2023, 1, 1)),
+    ],
+)
+def test_compile_expr_lower_than(expr, field, op, value):
+    # in an expression, null and missing are lower than any number or date
+    assert compile_expr(expr) == {"$or": [{field: {op: value}}, {field: None}]}
+
+
+@pytest.mark.parametrize(
+    "expr",
+    [
+        {"$eq": ["$unit", "$department"]},
+        {"$eq": ["$unit", None]},
+        {"$eq": [1, "1"]},
+        {"$gt": ["$unit", "a"]},
+        {"$regexMatch": {"input": "$unit", "regex": "^Big"}},
+        {"$eq": ["$$NOW", 1]},
+        {"$and": [{"$eq": ["$unit", "a"]}, {"$strLenCP": "$unit"}]},
+    ],
+)
+def test_compile_expr_not_compilable(expr):
+    with pytest.raises(NotCompilable):
+        compile_expr(expr)
+
+
+def test_condition_find_staff():
+    assert condition_find_staff(QueryParamters()) == MATCH_NOTHING
+    assert condition_find_staff(QueryParamters(staffcodes=["1"])) == {"staff_code": {"$in": ["1"]}}
+    assert condition_find_staff(QueryParamters(units=["a"], custom_query={"$eq": ["$title", "b"]})) == {
+        "$or": [{"unit": {"$in": ["a"]}}, {"title": "b"}]
+    }
+    assert condition_find_staff(QueryParamters(units=["a"], custom_query={"$eq": [1, 1]})) == {}
+
+
+def test_condition_find_staff_warns(caplog):
+    custom_query = {"$regexMatch": {"input": "$unit", "regex": "^Big"}}
+    with caplog.at_level(logging.WARNING):
+        condition = condition_find_staff(QueryParamters(staffcodes=["1"], custom_query=custom_query))
+    assert condition["$or"][1] == {"$expr": custom_query}
+    assert "can not use the indexes" in caplog.text
+
+
+def test_pipeline_staffs_inou():
+    pipeline = pipeline_staffs_inou(QueryParamters(staffcodes=["1"]))
+    assert pipeline[0]["$match"] == {"staff_code": {"$in": ["1"]}}
@@ -0,0 +1,64 @@
+import pytest
+from ..directory import DirectoryCache
+from ..models import DirectorySummary
+
+
+class FakeStream:
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.alive = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.alive = False
+
+    async def try_next(self):
+        if not self.changes:
+            self.alive = False
+            return None
+        return self.changes.pop(0)
+
+
+class FakeCollection:
+    full_name = "FaceID.Staff"
+
+    def __init__(self, changes=()):
+        self.changes = changes
+
+    def watch(self, **kwargs):
+        return FakeStream(self.changes)
+
+
+def test_directory_cache():
+    cache = DirectoryCache(ttl=60)
+    collection = FakeCollection()
+    assert cache.get(collection) is None
+    summary = DirectorySummary(people_count=3, has_sample_count=2, should_checkinout_count=1)
+    cache.set(collection, summary, cache.generation)
+    assert cache.get(collection) == summary
+    cache.invalidate(collection)
+    assert cache.get(collection) is None
+
+    # counted before a change: not cached
+    generation = cache.generation
+    cache.invalidate(collection)
+    cache.set(collection, summary, generation)
+    assert cache.get(collection) is None
+
+    collection.bypass_cache = True
+    cache.set(collection, summary, cache.generation)
+    assert cache.get(collection) is None
+
+
+@pytest.mark.asyncio
+async def test_directory_cache_watch():
+    cache = DirectoryCache(ttl=60)
+    collection = FakeCollection([None, {"operationType": "update"}])
+    invalidated = []
+    cache.invalidate = invalidated.append
+    await cache.watch(collection, 60)
+    # once when the stream is opened, once for the update
+    assert invalidated == [collection, collection]
+    assert cache.watching == collection.full_name
@@ -0,0 +1,83 @@
+import pytest
+from ..explain import ExplainRecorder, summarize_execution, summarize_plan, winning_plans
+
+PUSHED_DOWN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "FETCH",
+            "inputStage": {"stage": "IXSCAN", "indexName": "staff_code_1"},
+        },
+        "rejectedPlans": [{"stage": "COLLSCAN"}],
+    }
+}
+
+CURSOR_STAGE = {
+    "stages": [
+        {"$cursor": {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}},
+        {"$group": {}},
+    ]
+}
+
+
+def test_winning_plans():
+    assert len(winning_plans(PUSHED_DOWN)) == 1
+    assert len(winning_plans(CURSOR_STAGE)) == 1
+    assert winning_plans({}) == []
+
+
+def test_summarize_plan():
+    summary = summarize_plan("query_find_staff", "FaceID.staffs", PUSHED_DOWN)
+    assert summary.stages == ["FETCH", "IXSCAN"]
+    assert summary.indexes == ["staff_code_1"]
+    assert summary.collscan is False  # the rejected plan is ignored
+
+    summary = summarize_plan("count_inout", "FaceID.BodyFaceName", CURSOR_STAGE)
+    assert summary.collscan is True
+    assert summary.indexes == []
+
+
+EXECUTION = {
+    "stages": [
+        {
+            "$cursor": {
+                "queryPlanner": {"winningPlan": {"stage": "FETCH"}},
+                "executionStats": {
+                    "nReturned": 100,
+                    "executionTimeMillis": 12,
+                    "totalKeysExamined": 100,
+                    "totalDocsExamined": 100,
+                    "executionStages": {
+                        "stage": "FETCH",
+                        "docsExamined": 100,
+                        "executionTimeMillisEstimate": 5,
+                        "inputStage": {
+                            "stage": "IXSCAN",
+                            "indexName": "has_mask_image_time_score",
+                            "keysExamined": 100,
+                            "executionTimeMillisEstimate": 2,
+                        },
+                    },
+                },
+            },
+        },
+        {"$group": {}, "nReturned": 2, "executionTimeMillisEstimate": 10},
+    ]
+}
+
+
+def test_summarize_execution():
+    stats = summarize_execution("aggregate", "FaceID.BodyFaceName", [], EXECUTION)
+    assert stats.docs_examined == 100
+    assert stats.keys_examined == 100
+    assert stats.execution_time_ms == 12
+    assert stats.indexes == ["has_mask_image_time_score"]
+    assert [stage.stage for stage in stats.stages] == ["FETCH", "IXSCAN", "$group"]
+    assert stats.stages[-1].n_returned == 2
+
+
+@pytest.mark.asyncio
+async def test_explain_recorder_disabled():
+    recorder = ExplainRecorder(enabled=False)
+    collection = object()
+    assert recorder.wrap(collection) is collection
+    assert await recorder.result(42) == 42
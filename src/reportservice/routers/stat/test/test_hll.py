@@ -0,0 +1,41 @@
+import pytest
+from ..hll import HyperLogLog
+
+
+def test_empty():
+    sketch = HyperLogLog()
+    assert len(sketch) == 0
+    assert sketch.to_bytes() == bytes(4096)
+
+
+@pytest.mark.parametrize("n", [10, 1000, 50000])
+def test_estimate(n):
+    sketch = HyperLogLog(12)
+    sketch.update(f"staff-{i}" for i in range(n))
+    # duplicates do not change the estimate
+    sketch.update(f"staff-{i}" for i in range(n // 2))
+    assert abs(len(sketch) - n) <= 3 * sketch.error * n + 1
+
+
+def test_merge_is_union():
+    monday, tuesday, both = HyperLogLog(10), HyperLogLog(10), HyperLogLog(10)
+    monday.update(range(0, 3000))
+    tuesday.update(range(2000, 5000))
+    both.update(range(0, 5000))
+    assert monday.merge(tuesday).to_bytes() == both.to_bytes()
+
+
+def test_roundtrip():
+    sketch = HyperLogLog(8)
+    sketch.update(range(100))
+    again = HyperLogLog(8, sketch.to_bytes())
+    assert len(again) == len(sketch)
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        HyperLogLog(2)
+    with pytest.raises(ValueError):
+        HyperLogLog(8, bytes(10))
+    with pytest.raises(ValueError):
+        HyperLogLog(8).merge(HyperLogLog(9))
@@ -0,0 +1,30 @@
+import pytest
+from datetime import datetime, timezone
+from bson import ObjectId
+from ..keyset import RecordKey, condition_after, decode_token, encode_token
+from ..models import QueryException
+from ..queries import pipeline_get_record_by_id
+
+
+def test_token_roundtrip():
+    # naive UTC, as read from mongo
+    key = RecordKey(datetime(2023, 12, 27, 8, 30, 0, 123000), ObjectId())
+    token = encode_token(key)
+    assert "=" not in token
+    assert decode_token(token) == key
+
+
+@pytest.mark.parametrize("token", ["", "abc", encode_token(RecordKey("not a date", 1))])
+def test_token_invalid(token):
+    with pytest.raises(QueryException):
+        decode_token(token)
+
+
+def test_pipeline_after():
+    key = RecordKey(datetime(2023, 12, 27, tzinfo=timezone.utc), ObjectId())
+    begin, end = datetime(2023, 12, 26, tzinfo=timezone.utc), datetime(2023, 12, 28, tzinfo=timezone.utc)
+    pipeline = pipeline_get_record_by_id(begin, end, "abc", after=key)
+    match = pipeline[0]["$match"]
+    assert match["$or"] == condition_after(key)["$or"]
+    assert match["staff_id"] == "abc"
+    assert pipeline[1]["$sort"] == {"image_time": -1, "_id": -1}
@@ -0,0 +1,77 @@
+import pytest
+from datetime import date, datetime, timedelta, timezone
+from ..live import LiveCounters
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def to_list(self, length=None):
+        return self.documents
+
+
+class FakeCollection:
+    full_name = "FaceID.BodyFaceName"
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def aggregate(self, pipeline):
+        return FakeCursor(self.documents)
+
+
+# 2023-12-27 10:00 in Asia/Ho_Chi_Minh
+NOW = datetime(2023, 12, 27, 3, tzinfo=timezone.utc)
+DAY_BEGIN = datetime(2023, 12, 26, 17, tzinfo=timezone.utc)
+DAY_END = DAY_BEGIN + timedelta(days=1) - timedelta(milliseconds=1)
+
+
+def record(staff_id, camera_id, image_time, score=0.9, has_mask=False):
+    return {
+        "staff_id": staff_id,
+        "camera_id": camera_id,
+        "image_time": image_time,
+        "face_reg_score": score,
+        "has_mask": has_mask,
+    }
+
+
+@pytest.mark.asyncio
+async def test_live_resync_and_apply():
+    live = LiveCounters(tz="Asia/Ho_Chi_Minh")
+    source = FakeCollection([{"staffs": [{"_id": "a"}], "cameras": [{"_id": "cam1", "count": 3}]}])
+    live.source = source.full_name
+    await live.resync(source, NOW)
+    assert live.day == date(2023, 12, 27)
+    assert live.synced
+
+    live.apply(record("b", "cam1", NOW), NOW)
+    live.apply(record("a", "cam2", NOW), NOW)
+    live.apply(record("c", "cam2", NOW, score=0.1), NOW)  # below the threshold
+    live.apply(record("d", "cam2", NOW, has_mask=True), NOW)
+    live.apply(record("e", "cam2", DAY_BEGIN - timedelta(seconds=1)), NOW)  # yesterday
+    assert live.staffs == {"a", "b"}
+    assert live.snapshot(NOW).cameras == {"cam1": 4, "cam2": 1}
+
+    assert live.covers(source, DAY_BEGIN, DAY_END, NOW)
+    assert live.covers(source, DAY_BEGIN, DAY_END + timedelta(microseconds=999), NOW)
+    assert not live.covers(source, DAY_BEGIN, NOW, NOW)
+    assert not live.covers(source, DAY_BEGIN - timedelta(days=1), DAY_END, NOW)
+
+    # midnight
+    tomorrow = NOW + timedelta(days=1)
+    live.rollover(tomorrow)
+    assert live.day == date(2023, 12, 28)
+    assert live.staffs == set()
+    assert not live.covers(source, DAY_BEGIN, DAY_END, tomorrow)
+
+
+@pytest.mark.asyncio
+async def test_live_not_synced():
+    live = LiveCounters(tz="Asia/Ho_Chi_Minh")
+    source = FakeCollection([])
+    live.source = source.full_name
+    assert not live.covers(source, DAY_BEGIN, DAY_END, NOW)
+    source.bypass_cache = True
+    assert live.count_today(source, DAY_BEGIN, DAY_END, NOW) is None
@@ -0,0 +1,116 @@
+import time
+import pytest
+from datetime import datetime, timedelta
+from ..models import PersonInout
+import logging
+from ..retrieval import (
+    index_staffs,
+    merge_inout_document,
+    consume_inout_stream,
+    consume_inout_parts,
+    inout_stage2_parts,
+    yield_inout_stream,
+)
+from ....settings import settings
+
+
+def _make_staffs(n: int):
+    return [
+        PersonInout(
+            staff_code=str(i),
+            sample_state="ready_to_checkin_checkout",
+            working_state="active",
+        )
+        for i in range(n)
+    ]
+
+
+def _make_documents(n: int):
+    first = datetime(2023, 12, 27, 7)
+    return [
+        {"staff_code": str(i), "firstDocument": first, "lastDocument": first + timedelta(hours=9)}
+        for i in range(n - 1, -1, -2)
+    ]
+
+
+async def _aiter(documents):
+    for document in documents:
+        yield document
+
+
+def test_merge_inout_document():
+    staffs = _make_staffs(3)
+    index = index_staffs(staffs + [PersonInout(staff_code="1", sample_state="no_sample", working_state="zombie")])
+    assert len(index) == 3
+    assert index["1"] is staffs[1]  # first one wins
+
+    document = {"staff_code": "1", "firstDocument": datetime(2023, 1, 1), "lastDocument": datetime(2023, 1, 2)}
+    assert merge_inout_document(index, document) is staffs[1]
+    assert staffs[1].first_record == datetime(2023, 1, 1)
+    assert staffs[1].last_record == datetime(2023, 1, 2)
+
+    assert merge_inout_document(index, {**document, "staff_code": "unknown"}) is None
+
+
+@pytest.mark.asyncio
+async def test_consume_inout_stream():
+    staffs = _make_staffs(10)
+    merged = await consume_inout_stream(index_staffs(staffs), _aiter(_make_documents(10)))
+    assert merged == 5
+    assert sum(staff.first_record is not None for staff in staffs) == 5
+
+
+@pytest.mark.asyncio
+async def test_yield_inout_stream():
+    staffs = _make_staffs(10)
+    documents = _make_documents(10)
+    yielded = set()
+    streamed = [
+        staff async for staff in yield_inout_stream(index_staffs(staffs), _aiter(documents + documents), yielded)
+    ]
+    # in the order of the documents, each staff only once
+    assert [staff.staff_code for staff in streamed] == [d["staff_code"] for d in documents]
+    assert yielded == {id(staff) for staff in streamed}
+
+
+@pytest.mark.asyncio
+async def test_consume_inout_stream_benchmark():
+    """the merge should scale linearly with the number of staffs"""
+    timings = {}
+    for n in [1000, 10000, 50000]:
+        staffs = _make_staffs(n)
+        documents = _make_documents(n)
+        best = float("inf")
+        for _ in range(3):
+            start = time.perf_counter()
+            await consume_inout_stream(index_staffs(staffs), _aiter(documents))
+            best = min(best, time.perf_counter() - start)
+        timings[n] = best
+    # a quadratic merge would be 2500 times slower at 50k than at 1k
+    assert timings[50000] / timings[1000] < 200, f"merge timings: {timings}"
+
+
+@pytest.mark.asyncio
+async def test_consume_inout_parts():
+    staffs = _make_staffs(10)
+    documents = _make_documents(10)
+    # the same staffs in two parts of the window, the earliest and the latest record win
+    later = [{**d, "firstDocument": d["firstDocument"] + timedelta(days=1)} for d in documents]
+    later = [{**d, "lastDocument": d["lastDocument"] + timedelta(days=1)} for d in later]
+    merged = await consume_inout_parts(index_staffs(staffs), [_aiter(later), _aiter(documents)], logging.getLogger())
+    assert merged == 10
+    filled = [staff for staff in staffs if staff.first_record is not None]
+    assert len(filled) == 5
+    assert all(staff.last_record - staff.first_record == timedelta(days=1, hours=9) for staff in filled)
+
+
+def test_inout_stage2_parts(monkeypatch):
+    monkeypatch.setattr(settings, "INOUT_CHUNK_SIZE", 4)
+    monkeypatch.setattr(settings, "INOUT_TEMP_JOIN_THRESHOLD", 0)
+    begin, end = datetime(2023, 12, 27), datetime(2023, 12, 28)
+    codes = [str(i) for i in range(10)]
+    assert len(inout_stage2_parts(None, codes, begin, end, logging.getLogger())) == 3
+    assert inout_stage2_parts(None, [], begin, end, logging.getLogger()) == []
+
+    monkeypatch.setattr(settings, "INOUT_TEMP_JOIN_THRESHOLD", 5)
+    assert len(inout_stage2_parts(None, codes, begin, end, logging.getLogger())) == 1
@@ -0,0 +1,74 @@
+from datetime import datetime
+from ..models import Granularity
+from ..queries import (
+    pipeline_count_windows,
+    pipeline_directory_summary,
+    conditions_directory_counts,
+    pipeline_rollup_refresh,
+    pipeline_stat_by_camera,
+    query_find_staff_inout_days,
+)
+
+
+def test_pipeline_count_windows():
+    windows = {
+        "checkin": (datetime(2023, 12, 27, 7), datetime(2023, 12, 27, 9)),
+        "checkout": (datetime(2023, 12, 27, 17), datetime(2023, 12, 27, 19)),
+    }
+    pipeline = pipeline_count_windows(windows, 0.63)
+    match = pipeline[0]["$match"]
+    assert match["image_time"] == {"$gte": datetime(2023, 12, 27, 7), "$lte": datetime(2023, 12, 27, 19)}
+    assert match["has_mask"] is False
+    facets = pipeline[-1]["$facet"]
+    assert set(facets.keys()) == {"checkin", "checkout"}
+    assert facets["checkin"][0]["$match"]["image_time"] == {
+        "$gte": datetime(2023, 12, 27, 7),
+        "$lte": datetime(2023, 12, 27, 9),
+    }
+
+
+def test_pipeline_directory_summary():
+    pipeline = pipeline_directory_summary()
+    # sorted on staff_code first, so the server can answer the distinct codes from the index
+    assert [next(iter(stage)) for stage in pipeline] == ["$sort", "$group", "$group", "$project"]
+    assert pipeline[0]["$sort"] == {"staff_code": 1}
+    assert pipeline[1]["$group"] == {"_id": "$staff_code"}
+    assert set(pipeline[2]["$group"]) == {"_id", "people_count"}
+    # the other counters are indexed count_documents, one field each
+    conditions = conditions_directory_counts()
+    assert set(conditions) == {"has_sample_count", "should_checkinout_count"}
+    assert all(len(condition) == 1 for condition in conditions.values())
+
+
+def test_query_find_staff_inout_days():
+    begin, end = datetime(2023, 12, 1), datetime(2023, 12, 31, 23, 59, 59)
+    pipeline = query_find_staff_inout_days(["a", "b"], begin, end, 0.63, False, "Asia/Ho_Chi_Minh")
+    match = pipeline[0]["$match"]
+    assert match["staff_id"] == {"$in": ["a", "b"]}
+    assert match["image_time"] == {"$gte": begin, "$lte": end}
+    day = pipeline[1]["$group"]["_id"]["day"]["$dateTrunc"]
+    assert day == {"date": "$image_time", "unit": "day", "timezone": "Asia/Ho_Chi_Minh"}
+    # one document per staff
+    assert pipeline[3]["$group"]["_id"] == "$_id.staff_id"
+
+
+def test_pipeline_stat_by_camera_granularity():
+    begin, end = datetime(2023, 12, 27), datetime(2023, 12, 28)
+    pipeline = pipeline_stat_by_camera(begin, end, granularity=Granularity.minute_15)
+    bucket = pipeline[1]["$group"]["_id"]["bucket"]["$dateTrunc"]
+    assert (bucket["binSize"], bucket["unit"]) == (15, "minute")
+    assert "$densify" not in [next(iter(stage)) for stage in pipeline]
+
+    pipeline = pipeline_stat_by_camera(begin, end, granularity=Granularity.hour, dense=True)
+    densify = next(stage["$densify"] for stage in pipeline if "$densify" in stage)
+    assert densify["range"]["step"] == 1
+    assert densify["range"]["unit"] == "hour"
+    assert densify["partitionByFields"] == ["camera_id"]
+
+
+def test_pipeline_rollup_refresh():
+    begin, end = datetime(2023, 12, 26, 17), datetime(2023, 12, 28, 3)
+    pipeline = pipeline_rollup_refresh(begin, end, "faceid.BodyFaceName", "report", "rollup")
+    assert pipeline[0]["$match"]["image_time"] == {"$gte": begin, "$lt": end}
+    # whole days are summarized again, their summaries are replaced rather than added up
+    assert pipeline[-1]["$merge"]["whenMatched"] == "replace"
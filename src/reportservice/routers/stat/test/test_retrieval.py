@@ -1,18 +1,30 @@
 import json
 import pytest
+from datetime import timedelta
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
 from ..retrieval import (
     get_people_count,
+    get_directory_summary,
     get_inout_count,
+    get_inout_count_approximate,
+    get_inout_count_windows,
     get_people_inout,
     get_has_sample_count,
     get_should_checkinout_count,
     get_person_count_by_id,
     get_person_record_by_id,
+    get_people_inout_range,
     get_record_count_by_date_cam,
 )
 from ..queries import query_find_staff
-from ..models import PersonInout, PersonInoutCollection, QueryParamters
+from ..explain import explain_aggregate, summarize_plan
+from ..rollup import AttendanceRollup
+from ..sketches import DailySketches
+from ..slicing import SliceUnit, time_slicer
+from ..strategy import InoutStrategyName, benchmark_inout_strategies, get_people_inout_adaptive
+from ....settings import settings
+from ....indexes import STAFF_INDEXES, ensure_indexes
+from ..models import Granularity, PersonInout, PersonInoutCollection, QueryParamters
 from ...common import AppConfigModel
 from ...common.conftest import appconfig
 
@@ -62,6 +74,17 @@ async def test_get_inout_count(fixture_bodyfacename_collection, test_time):
         ret = await get_inout_count(fixture_bodyfacename_collection, begin="1", end=end)
 
 
+@pytest.mark.asyncio
+async def test_get_inout_count_windows(fixture_bodyfacename_collection, test_time):
+    begin, end = test_time
+    ret = await get_inout_count_windows(
+        fixture_bodyfacename_collection, {"day": (begin, end), "reverse": (end, begin)}
+    )
+    assert ret == {"day": 2, "reverse": 0}
+    assert ret["day"] == await get_inout_count(fixture_bodyfacename_collection, begin, end)
+    assert await get_inout_count_windows(fixture_bodyfacename_collection, {}) == {}
+
+
 @pytest.mark.asyncio
 async def test_get_stage1(fixture_staff_collection, avai_staff):
     query_params = QueryParamters()
@@ -182,3 +205,210 @@ async def test_get_record_count_by_date_cam(fixture_bodyfacename_collection, tes
 
     records = await get_record_count_by_date_cam(fixture_bodyfacename_collection, "267817", begin, end, 0.1, False)
     assert records.count == 1
+
+    # the hourly buckets split the daily ones
+    daily = await get_record_count_by_date_cam(fixture_bodyfacename_collection, None, begin, end, 0.1, False)
+    hourly = await get_record_count_by_date_cam(
+        fixture_bodyfacename_collection, None, begin, end, 0.1, False, granularity=Granularity.hour
+    )
+    assert sum(r.count for r in hourly.values) == sum(r.count for r in daily.values)
+    assert all(r.bucket.minute == 0 for r in hourly.values)
+
+    dense = await get_record_count_by_date_cam(
+        fixture_bodyfacename_collection, None, begin, end, 0.1, False, granularity=Granularity.hour, dense=True
+    )
+    assert dense.count >= hourly.count
+    assert sum(r.count for r in dense.values) == sum(r.count for r in hourly.values)
+
+
+@pytest.fixture
+def fixture_rollup(testsettings, random_database_name) -> AttendanceRollup:
+    mongodb_client = AsyncIOMotorClient(testsettings.DB_URL, uuidRepresentation="standard")
+    db = mongodb_client[random_database_name]
+    return AttendanceRollup(db["TestRollup"], db["TestRollupState"], tz="UTC", history=timedelta(days=7))
+
+
+@pytest.mark.asyncio
+async def test_rollup(
+    fixture_rollup, fixture_staff_collection, fixture_bodyfacename_collection, test_time, avai_staff
+):
+    begin, end = test_time
+    await fixture_rollup.init()
+    state = await fixture_rollup.rebuild(fixture_bodyfacename_collection, now=end + timedelta(days=2))
+    assert state.watermark is not None
+
+    split = await fixture_rollup.split(fixture_bodyfacename_collection, begin, end)
+    assert split.dates == [begin.date()]
+    assert split.raw_windows == []
+
+    raw = await get_inout_count(fixture_bodyfacename_collection, begin, end)
+    assert raw == await get_inout_count(fixture_bodyfacename_collection, begin, end, rollup=fixture_rollup)
+
+    query_params = QueryParamters(staffcodes=avai_staff)
+    raw = await get_people_inout(fixture_staff_collection, fixture_bodyfacename_collection, query_params, begin, end)
+    rolled = await get_people_inout(
+        fixture_staff_collection, fixture_bodyfacename_collection, query_params, begin, end, rollup=fixture_rollup
+    )
+    assert {p.staff_code: (p.first_record, p.last_record) for p in raw.values} == {
+        p.staff_code: (p.first_record, p.last_record) for p in rolled.values
+    }
+
+    # nothing new to summarize
+    again = await fixture_rollup.refresh(fixture_bodyfacename_collection, now=end + timedelta(days=2))
+    assert again.watermark == state.watermark
+
+    # the days of the re-check window are summarized again, not added up twice
+    before = await fixture_rollup.collection.find({}, {"_id": 0}).sort([("staff_id", 1), ("date", 1)]).to_list(None)
+    later = await fixture_rollup.refresh(fixture_bodyfacename_collection, now=end + timedelta(days=2, hours=1))
+    assert later.watermark > state.watermark
+    after = await fixture_rollup.collection.find({}, {"_id": 0}).sort([("staff_id", 1), ("date", 1)]).to_list(None)
+    assert after == before
+
+
+@pytest.mark.asyncio
+async def test_get_directory_summary(fixture_staff_collection):
+    summary = await get_directory_summary(fixture_staff_collection)
+    assert summary.people_count == await get_people_count(fixture_staff_collection)
+    assert summary.has_sample_count == 723
+    assert summary.should_checkinout_count == 723 - 2
+
+
+@pytest.mark.asyncio
+async def test_get_person_record_by_id_keyset(fixture_bodyfacename_collection, test_time):
+    begin, end = test_time
+    first = await get_person_record_by_id(fixture_bodyfacename_collection, "267817", begin, end, 0.1, False)
+    rest = await get_person_record_by_id(fixture_bodyfacename_collection, "267817", begin, end, 0.1, False, 10, 100)
+    expected = first.values + rest.values
+
+    pages = []
+    after = None
+    while True:
+        records = await get_person_record_by_id(
+            fixture_bodyfacename_collection, "267817", begin, end, 0.1, False, limit=10, after=after
+        )
+        pages.append(records.values)
+        after = records.next
+        if after is None:
+            break
+    assert [len(page) for page in pages] == [10, 10, 10, 10, 8]
+    assert [r for page in pages for r in page] == expected
+
+
+@pytest.mark.asyncio
+async def test_get_people_inout_range(fixture_staff_collection, fixture_bodyfacename_collection, test_time):
+    begin, end = test_time
+    query_params = QueryParamters(staffcodes=["267817", "unknown"])
+    inout = await get_people_inout(fixture_staff_collection, fixture_bodyfacename_collection, query_params, begin, end)
+    matrix = await get_people_inout_range(
+        fixture_staff_collection, fixture_bodyfacename_collection, query_params, begin - timedelta(days=3), end
+    )
+    assert matrix.count == inout.count
+    first_records = {staff.staff_code: staff.first_record for staff in inout.values}
+    for staff in matrix.values:
+        if first_records[staff.staff_code] is None:
+            assert staff.days == []
+        else:
+            assert min(day.first_record for day in staff.days) == first_records[staff.staff_code]
+
+
+@pytest.fixture
+def fixture_sketches(testsettings, random_database_name) -> DailySketches:
+    mongodb_client = AsyncIOMotorClient(testsettings.DB_URL, uuidRepresentation="standard")
+    return DailySketches(mongodb_client[random_database_name]["TestSketch"], tz="UTC")
+
+
+@pytest.mark.asyncio
+async def test_get_inout_count_approximate(fixture_sketches, fixture_bodyfacename_collection, test_time):
+    begin, end = test_time
+    sketches = fixture_sketches
+    await sketches.init()
+    exact = await get_inout_count(fixture_bodyfacename_collection, begin, end)
+
+    # nothing is sketched on the request path, the days not sketched yet are read from the records
+    estimate = await get_inout_count_approximate(fixture_bodyfacename_collection, sketches, begin, end)
+    assert estimate.lower <= exact <= estimate.upper
+    assert estimate.sketched_days == 0
+    assert await sketches.collection.count_documents({}) == 0
+
+    # the refresher sketches the closed days once, then only the re-check window again
+    now = end + timedelta(days=1)
+    built = await sketches.refresh(fixture_bodyfacename_collection, now)
+    assert len(built) == 62 and built[-1] == end.date()
+    assert await sketches.refresh(fixture_bodyfacename_collection, now) == built[-2:]
+
+    again = await get_inout_count_approximate(fixture_bodyfacename_collection, sketches, begin, end)
+    assert again.count == estimate.count
+    assert again.sketched_days == 1
+
+
+@pytest.mark.asyncio
+async def test_sliced_queries(monkeypatch, fixture_bodyfacename_collection, test_time):
+    begin, end = test_time
+    count = await get_inout_count(fixture_bodyfacename_collection, begin, end)
+    records = await get_person_count_by_id(fixture_bodyfacename_collection, None, begin, end, 0.1, False)
+    buckets = await get_record_count_by_date_cam(fixture_bodyfacename_collection, None, begin, end, 0.1, False)
+
+    monkeypatch.setattr(time_slicer, "min_span", timedelta(0))
+    monkeypatch.setattr(time_slicer, "unit", SliceUnit.hour)
+    monkeypatch.setattr(settings, "STAT_CACHE_ENABLED", False)
+    assert await get_inout_count(fixture_bodyfacename_collection, begin, end) == count
+    assert await get_person_count_by_id(fixture_bodyfacename_collection, None, begin, end, 0.1, False) == records
+    sliced = await get_record_count_by_date_cam(fixture_bodyfacename_collection, None, begin, end, 0.1, False)
+    assert sliced == buckets
+
+
+@pytest.mark.asyncio
+async def test_find_staff_uses_indexes(fixture_staff_collection, avai_staff):
+    await ensure_indexes(fixture_staff_collection, STAFF_INDEXES)
+    custom_query = {"$and": [{"$eq": ["$unit", "BigHospital"]}, {"$eq": ["$department", "Mamachue"]}]}
+    for query_params in [
+        QueryParamters(staffcodes=avai_staff),
+        QueryParamters(staffcodes=avai_staff, units=["BigHospital"]),
+        QueryParamters(custom_query=custom_query),
+    ]:
+        explain = await explain_aggregate(fixture_staff_collection, query_find_staff(query_params))
+        plan = summarize_plan("query_find_staff", fixture_staff_collection.full_name, explain)
+        assert not plan.collscan, plan
+        assert "IXSCAN" in plan.stages, plan
+
+
+@pytest.mark.asyncio
+async def test_inout_strategies(fixture_staff_collection, fixture_bodyfacename_collection, test_time, avai_staff):
+    begin, end = test_time
+    query_params = QueryParamters(staffcodes=avai_staff)
+    results = {}
+    for name in [InoutStrategyName.two_stage, InoutStrategyName.lookup]:
+        ret = await get_people_inout_adaptive(
+            fixture_staff_collection, fixture_bodyfacename_collection, query_params, begin, end, strategy=name
+        )
+        results[name] = {p.staff_code: (p.first_record, p.last_record) for p in ret.values}
+    assert results[InoutStrategyName.two_stage] == results[InoutStrategyName.lookup]
+
+    benchmark = await benchmark_inout_strategies(
+        fixture_staff_collection, fixture_bodyfacename_collection, query_params, begin, end, repeat=2
+    )
+    assert benchmark.count == len(avai_staff), f"in-out strategies on the test data: {benchmark}"
+    assert set(benchmark.timings) == {InoutStrategyName.two_stage, InoutStrategyName.lookup}
+
+
+@pytest.mark.asyncio
+async def test_people_inout_chunks(
+    monkeypatch, fixture_staff_collection, fixture_bodyfacename_collection, test_time, avai_staff
+):
+    begin, end = test_time
+    query_params = QueryParamters(staffcodes=avai_staff)
+
+    async def inout():
+        staffs, records = fixture_staff_collection, fixture_bodyfacename_collection
+        ret = await get_people_inout(staffs, records, query_params, begin, end)
+        return {p.staff_code: (p.first_record, p.last_record) for p in ret.values}
+
+    expected = await inout()
+    monkeypatch.setattr(settings, "STAT_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "INOUT_CHUNK_SIZE", 1)
+    assert await inout() == expected
+
+    monkeypatch.setattr(settings, "INOUT_TEMP_JOIN_THRESHOLD", 1)
+    assert await inout() == expected
+    names = await fixture_bodyfacename_collection.database.list_collection_names()
+    assert not [name for name in names if name.startswith("tmp_inout_")]
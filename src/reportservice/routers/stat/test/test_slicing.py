@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from ..models import ByDateCam
+from ..retrieval import merge_date_cam
+from ..slicing import SliceUnit, TimeSlicer, slice_window
+from ..windows import as_utc, local_day_begin
+
+TZ = ZoneInfo("Asia/Ho_Chi_Minh")
+MS = timedelta(milliseconds=1)
+
+
+def test_slice_window_days():
+    begin = datetime(2023, 12, 20, 8, tzinfo=TZ)
+    end = datetime(2023, 12, 23, 12, tzinfo=TZ)
+    slices = slice_window(begin, end, SliceUnit.day, TZ)
+    assert len(slices) == 4
+    assert slices[0] == (as_utc(begin), local_day_begin(date(2023, 12, 21), TZ) - MS)
+    assert slices[-1] == (local_day_begin(date(2023, 12, 23), TZ), as_utc(end))
+    # contiguous, nothing lost between two slices
+    for i in range(1, len(slices)):
+        assert slices[i][0] - slices[i - 1][1] == MS
+
+
+def test_slice_window_hours():
+    begin = datetime(2023, 12, 20, 8, 30, tzinfo=TZ)
+    end = datetime(2023, 12, 20, 11, tzinfo=TZ)
+    slices = slice_window(begin, end, SliceUnit.hour, TZ)
+    assert [b.astimezone(TZ).hour for b, _ in slices] == [8, 9, 10, 11]
+    assert slices[-1] == (as_utc(end), as_utc(end))
+    assert slice_window(end, begin, SliceUnit.hour, TZ) == []
+
+
+@pytest.mark.asyncio
+async def test_time_slicer_run():
+    slicer = TimeSlicer(min_span=timedelta(days=7), limit=2, tz="UTC")
+    begin = datetime(2023, 12, 1, tzinfo=timezone.utc)
+    end = datetime(2023, 12, 31, 23, 59, 59, 999000, tzinfo=timezone.utc)
+    assert slicer.should_slice(begin, end)
+    assert not slicer.should_slice(begin, begin + timedelta(days=7))
+
+    running = 0
+    peak = 0
+
+    async def query(slice_begin, slice_end):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+        return slice_begin.day
+
+    days = await slicer.run("test", begin, end, query)
+    assert days == list(range(1, 32))
+    assert peak == 2
+
+
+def test_merge_date_cam():
+    bucket = datetime(2023, 12, 27, tzinfo=timezone.utc)
+
+    def record(camera_id, count, hours=0):
+        return ByDateCam(
+            date=date(2023, 12, 27), camera_id=camera_id, count=count, bucket=bucket + timedelta(hours=hours)
+        )
+
+    # the same day bucket split between two hour slices is summed
+    merged = merge_date_cam([[record("b", 1), record("a", 2)], [record("a", 3), record("a", 4, 1)]])
+    assert [(r.camera_id, r.count) for r in merged] == [("a", 5), ("a", 4), ("b", 1)]
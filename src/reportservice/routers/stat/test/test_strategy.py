@@ -0,0 +1,54 @@
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+from ..models import QueryException, QueryParamters
+from ..strategy import (
+    InoutStrategyName,
+    _server_versions,
+    choose_strategy,
+    expected_staff_count,
+    get_people_inout_adaptive,
+)
+
+
+def _collection(database: str, client: object):
+    return SimpleNamespace(name="collection", database=SimpleNamespace(name=database, client=client))
+
+
+def test_expected_staff_count():
+    assert expected_staff_count(QueryParamters(staffcodes=["1", "2"], emails=["a@b.c"])) == 3
+    assert expected_staff_count(QueryParamters(staffcodes=["1"], units=["BigHospital"])) is None
+    assert expected_staff_count(QueryParamters(custom_query={"$eq": ["$unit", "a"]})) is None
+
+
+@pytest.mark.asyncio
+async def test_choose_strategy():
+    recent, old = object(), object()
+    _server_versions[id(recent)] = (7, 0)
+    _server_versions[id(old)] = (4, 4)
+    begin, end = datetime(2023, 12, 27), datetime(2023, 12, 28)
+    few = QueryParamters(staffcodes=["1", "2"])
+
+    async def choose(staffs, records, query_params=few):
+        strategy = await choose_strategy(staffs, records, query_params, begin, end)
+        return strategy.name
+
+    staffs, records = _collection("FaceID", recent), _collection("FaceID", recent)
+    assert await choose(staffs, records) == InoutStrategyName.lookup
+    assert await choose(staffs, records, QueryParamters(staffcodes=[str(i) for i in range(1000)])) == "two_stage"
+    assert await choose(staffs, records, QueryParamters(units=["BigHospital"])) == InoutStrategyName.two_stage
+    # $lookup can not join another database
+    assert await choose(staffs, _collection("Other", recent)) == InoutStrategyName.two_stage
+    # the sub-query of $lookup does not use the indexes before 5.0
+    assert await choose(_collection("FaceID", old), _collection("FaceID", old)) == InoutStrategyName.two_stage
+
+
+@pytest.mark.asyncio
+async def test_explicit_strategy_checks_version():
+    old = object()
+    _server_versions[id(old)] = (4, 4)
+    staffs, records = _collection("FaceID", old), _collection("FaceID", old)
+    with pytest.raises(QueryException, match="MongoDB 5.0"):
+        await get_people_inout_adaptive(
+            staffs, records, QueryParamters(staffcodes=["1"]), strategy=InoutStrategyName.lookup
+        )
@@ -0,0 +1,76 @@
+import json
+import time
+from datetime import datetime
+from ..models import PersonInout, PersonInoutCollection
+from ..trusted import trusted_response
+from ....settings import settings
+
+
+def _documents(n: int) -> list:
+    """staffs with their records, as read from the database"""
+    return [
+        {
+            "staff_code": str(i),
+            "full_name": f"Staff {i}",
+            "email": f"staff{i}@example.com",
+            "sample_state": "ready_to_checkin_checkout",
+            "working_state": "active",
+            "first_record": datetime(2023, 12, 27, 8),
+            "last_record": datetime(2023, 12, 27, 17),
+            "custom_field": i,
+        }
+        for i in range(n)
+    ]
+
+
+def _collection(n: int) -> PersonInoutCollection:
+    staffs = [PersonInout.model_validate(document) for document in _documents(n)]
+    return PersonInoutCollection(count=n, values=staffs)
+
+
+def _best_of(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _validated_json(collection: PersonInoutCollection) -> bytes:
+    """what FastAPI does with a returned model: dump, validate against the response model, encode"""
+    validated = PersonInoutCollection.model_validate(collection.model_dump())
+    return json.dumps(validated.model_dump(mode="json")).encode()
+
+
+def test_trusted_response(monkeypatch):
+    collection = _collection(3)
+    monkeypatch.setattr(settings, "TRUSTED_RESPONSES", True)
+    monkeypatch.setattr(settings, "DEBUG_MODE", False)
+    response = trusted_response(collection)
+    assert json.loads(response.body) == json.loads(_validated_json(collection))
+    assert trusted_response(3) == 3
+
+    monkeypatch.setattr(settings, "DEBUG_MODE", True)
+    assert trusted_response(collection) is collection
+
+
+def test_trusted_response_benchmark():
+    """serializing once should be clearly faster than validating the response again"""
+    collection = _collection(10000)
+    timings = {
+        "validated": _best_of(lambda: _validated_json(collection)),
+        "trusted": _best_of(collection.model_dump_json),
+    }
+    assert timings["trusted"] < timings["validated"], f"response timings for 10000 staffs: {timings}"
+
+
+def test_read_benchmark():
+    """reading the documents with `model_construct` instead of validating them brings nothing to win"""
+    documents = _documents(10000)
+    timings = {
+        "validated": _best_of(lambda: [PersonInout.model_validate(document) for document in documents]),
+        "constructed": _best_of(lambda: [PersonInout.model_construct(**document) for document in documents]),
+    }
+    # a margin for the noise of the test machines, the validation is usually the fastest
+    assert timings["validated"] < 1.5 * timings["constructed"], f"read timings for 10000 staffs: {timings}"
@@ -0,0 +1,56 @@
+from datetime import datetime, date, timedelta, timezone
+from zoneinfo import ZoneInfo
+from ..rollup import AttendanceRollup, RollupState
+from ..windows import split_closed_days, local_day_begin, as_utc
+
+TZ = ZoneInfo("Asia/Ho_Chi_Minh")
+
+
+def test_local_day_begin():
+    assert local_day_begin(date(2023, 12, 27), TZ) == datetime(2023, 12, 26, 17, tzinfo=timezone.utc)
+    assert as_utc(datetime(2023, 12, 27)) == datetime(2023, 12, 27, tzinfo=timezone.utc)
+
+
+def test_split_closed_days():
+    since = local_day_begin(date(2023, 12, 1), TZ)
+    until = datetime(2023, 12, 27, 10, tzinfo=TZ)  # watermark is in the middle of the 27th
+
+    # whole days, ended by the open day
+    begin = local_day_begin(date(2023, 12, 20), TZ)
+    end = datetime(2023, 12, 27, 23, 59, 59, 999999, tzinfo=TZ)
+    split = split_closed_days(begin, end, since, until, TZ)
+    assert split.dates == [date(2023, 12, 20) + timedelta(days=i) for i in range(7)]
+    assert split.raw_windows == [(local_day_begin(date(2023, 12, 27), TZ), as_utc(end))]
+
+    # partial head and tail
+    begin = datetime(2023, 12, 20, 8, tzinfo=TZ)
+    end = datetime(2023, 12, 23, 12, tzinfo=TZ)
+    split = split_closed_days(begin, end, since, until, TZ)
+    assert split.dates == [date(2023, 12, 21), date(2023, 12, 22)]
+    assert split.raw_windows[0] == (as_utc(begin), local_day_begin(date(2023, 12, 21), TZ) - timedelta(milliseconds=1))
+    assert split.raw_windows[1] == (local_day_begin(date(2023, 12, 23), TZ), as_utc(end))
+
+    # a single partial day is never taken from the rollup
+    split = split_closed_days(begin, begin + timedelta(hours=2), since, until, TZ)
+    assert split.dates == []
+    assert split.raw_windows == [(begin, begin + timedelta(hours=2))]
+
+    # before the rollup started
+    begin = local_day_begin(date(2023, 11, 29), TZ)
+    end = local_day_begin(date(2023, 12, 3), TZ) - timedelta(milliseconds=1)
+    split = split_closed_days(begin, end, since, until, TZ)
+    assert split.dates == [date(2023, 12, 1), date(2023, 12, 2)]
+    assert split.raw_windows == [(as_utc(begin), since - timedelta(milliseconds=1))]
+
+    # reversed window
+    assert split_closed_days(end, begin, since, until, TZ) == ([], [])
+
+
+def test_rollup_recheck_begin():
+    rollup = AttendanceRollup(None, None, tz="Asia/Ho_Chi_Minh", recheck_days=2)
+    since = local_day_begin(date(2023, 12, 1), TZ)
+    state = RollupState(source="s", since=since, watermark=datetime(2023, 12, 27, 10, tzinfo=timezone.utc))
+    # the watermark is on the local 2023-12-27, the 25th and the 26th are checked again
+    assert rollup.recheck_begin(state) == local_day_begin(date(2023, 12, 25), TZ)
+    state.watermark = since + timedelta(hours=5)
+    assert rollup.recheck_begin(state) == since
@@ -0,0 +1,26 @@
+"""Trusted responses: serialize the stat models once, without validating them again
+
+The stat models are validated once when they are read from the FaceID database: pydantic-core is fast at that, and
+`model_construct` is no faster (about 10% slower on the 10000 staffs of `test_read_benchmark`) while it would skip the
+coercion of the stored values. When a route returns a model, FastAPI dumps it to a dict,
+validates the dict again against the response model, then encodes it: for large responses this is several times
+the cost of the read itself. A trusted response skips these steps and sends `model_dump_json()` directly.
+Strict validation of the responses is used when `settings.TRUSTED_RESPONSES` is off, and always in debug mode.
+"""
+
+from typing import Any
+from fastapi import Response
+from pydantic import BaseModel
+from ...settings import settings
+
+
+def trusted_responses() -> bool:
+    return settings.TRUSTED_RESPONSES and not settings.DEBUG_MODE
+
+
+def trusted_response(value: Any) -> Any:
+    """with trusted responses, serialize the model at once so FastAPI does not validate it again
+    against the response model. Otherwise return `value` unchanged"""
+    if not isinstance(value, BaseModel) or not trusted_responses():
+        return value
+    return Response(content=value.model_dump_json(), media_type="application/json")
@@ -0,0 +1,74 @@
+"""split time windows along local day boundaries"""
+
+from datetime import datetime, date, time, timedelta, timezone
+from typing import List, NamedTuple, Tuple
+from zoneinfo import ZoneInfo
+
+Window = Tuple[datetime, datetime]
+
+# mongo stores datetime with millisecond precision, [begin, end] windows are closed on both sides
+_EPSILON = timedelta(milliseconds=1)
+
+
+def as_utc(dt: datetime) -> datetime:
+    """naive datetimes are treated as UTC, the same way mongo does"""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def local_day_begin(d: date, tz: ZoneInfo) -> datetime:
+    """the first instant of the local day `d`, in UTC"""
+    return datetime.combine(d, time.min, tzinfo=tz).astimezone(timezone.utc)
+
+
+def local_day_window(d: date, tz: ZoneInfo) -> Window:
+    """[begin, end] of the local day `d`, in UTC"""
+    return local_day_begin(d, tz), local_day_begin(d + timedelta(days=1), tz) - _EPSILON
+
+
+def local_date(dt: datetime, tz: ZoneInfo) -> date:
+    return as_utc(dt).astimezone(tz).date()
+
+
+class DaySplit(NamedTuple):
+    """`dates` are whole local days which can be answered from pre-computed data,
+    `raw_windows` are the remaining parts of the window which must be read from the raw records"""
+
+    dates: List[date]
+    raw_windows: List[Window]
+
+
+def split_closed_days(begin: datetime, end: datetime, since: datetime, until: datetime, tz: ZoneInfo) -> DaySplit:
+    """split [begin, end] into whole local days fully inside [since, until) and the raw head/tail windows.
+    The whole days are always contiguous, so there is at most one head and one tail window.
+    """
+    begin, end, since, until = as_utc(begin), as_utc(end), as_utc(since), as_utc(until)
+    if begin > end:
+        return DaySplit([], [])
+
+    lower = max(begin, since)
+    first_day = local_date(lower, tz)
+    if local_day_begin(first_day, tz) < lower:
+        first_day += timedelta(days=1)
+
+    dates: List[date] = []
+    day = first_day
+    while True:
+        next_begin = local_day_begin(day + timedelta(days=1), tz)
+        if next_begin - _EPSILON > end or next_begin > until:
+            break
+        dates.append(day)
+        day += timedelta(days=1)
+
+    if not dates:
+        return DaySplit([], [(begin, end)])
+
+    raw_windows: List[Window] = []
+    head_end = local_day_begin(dates[0], tz) - _EPSILON
+    if begin <= head_end:
+        raw_windows.append((begin, head_end))
+    tail_begin = local_day_begin(dates[-1] + timedelta(days=1), tz)
+    if tail_begin <= end:
+        raw_windows.append((tail_begin, end))
+    return DaySplit(dates, raw_windows)
@@ -1,5 +1,6 @@
 """load config"""
 
+from enum import Enum
 from pydantic import MongoDsn, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from dynaconf import Dynaconf
@@ -10,6 +11,18 @@ dynasettings = Dynaconf(
 )
 
 
+class IndexBootstrapMode(str, Enum):
+    create = "create"  # create the missing indexes
+    dry_run = "dry_run"  # only report the missing indexes
+    off = "off"  # do nothing
+
+
+class ExecutorKind(str, Enum):
+    process = "process"
+    thread = "thread"
+    off = "off"  # run the stages on the event loop
+
+
 class CommonSettingsModel(BaseSettings):
     LOG_FILE: str = "log/debug.log"
     APP_NAME: str = "FARM"
@@ -31,6 +44,11 @@ class DatabaseSettingsModel(BaseSettings):
     DB_COLLECTION_TASK: str
     DB_COLLECTION_SCHEDULER: str
     DB_COLLECTION_LOG: str
+    DB_COLLECTION_ROLLUP: str = "ReportDailyAttendance"
+    DB_COLLECTION_ROLLUP_STATE: str = "ReportDailyAttendanceState"
+    DB_COLLECTION_SKETCH: str = "ReportDailySketch"
+    DB_BUCKET_EXCEL: str = "ReportContentExcel"  # GridFS bucket of the large excel files of the contents
+    DB_INDEX_BOOTSTRAP: IndexBootstrapMode = IndexBootstrapMode.dry_run  # at startup, only log the missing indexes
 
     @field_validator("DB_URL")
     @classmethod
@@ -38,7 +56,46 @@ class DatabaseSettingsModel(BaseSettings):
         return str(MongoDsn(v))
 
 
-class AppSettingsModel(CommonSettingsModel, ServerSettingsModel, DatabaseSettingsModel):
+class QuerySettingsModel(BaseSettings):
+    QUERY_CONCURRENCY: int = 4  # max number of report queries running at the same time
+    TIMEZONE: str = "Asia/Ho_Chi_Minh"  # local timezone, used to split the records into days
+    ROLLUP_ENABLED: bool = False  # keep the daily attendance rollup up to date in background
+    ROLLUP_REFRESH_INTERVAL: int = 300  # seconds between two rollup refreshes
+    ROLLUP_LAG: int = 300  # seconds, records newer than now - lag are left for the next refresh
+    ROLLUP_HISTORY_DAYS: int = 62  # how many days the first refresh (or a rebuild) goes back
+    ROLLUP_RECHECK_DAYS: int = 2  # closed days summarized again by each refresh, for the records uploaded late
+    STAT_CACHE_ENABLED: bool = True  # cache the results of the stat queries in memory
+    STAT_CACHE_MAXSIZE: int = 512  # max number of cached results
+    STAT_CACHE_MAX_DOCUMENTS: int = 20000  # results larger than this are never cached
+    STAT_CACHE_TTL_CLOSED: int = 3600  # seconds to keep the result of a closed window, late records show up after it
+    STAT_CACHE_TTL_OPEN: int = 15  # seconds to keep the result of a window which includes now
+    STAT_CACHE_CLOSED_AFTER: int = 600  # a window is closed once its end is older than this (late records)
+    DIRECTORY_CACHE_ENABLED: bool = True  # cache the staff directory counters in memory
+    DIRECTORY_CACHE_TTL: int = 300  # seconds, the only invalidation when the staff collection can not be watched
+    DIRECTORY_WATCH_INTERVAL: int = 60  # seconds before the watched staff collection is resolved again
+    TEMPLATE_CACHE_MAXSIZE: int = 32  # parsed excel templates of the contents kept in memory
+    EXCEL_INLINE_MAX_SIZE: int = 1048576  # bytes, larger excel files of the contents are stored in GridFS
+    EXCEL_MIGRATE_AT_STARTUP: bool = True  # move the excel files kept as base64 strings, in background
+    RENDER_EXECUTOR: ExecutorKind = ExecutorKind.process  # where the report tables and excel files are built
+    RENDER_WORKERS: int = 2  # processes (or threads) of the render executor
+    LIVE_ENABLED: bool = True  # answer the "today" counts from counters kept up to date by a change stream
+    LIVE_RETRY_INTERVAL: int = 60  # seconds before watching again after a disconnect
+    SLICE_MIN_DAYS: int = 7  # windows longer than this are split into slices queried concurrently
+    SLICE_UNIT: str = "day"  # day / hour, the size of the slices
+    SLICE_MAX_TIME_MS: int = 120000  # server side time limit of each slice
+    INOUT_CHUNK_SIZE: int = 2000  # staff codes per stage 2 query of the in-out queries, the chunks run concurrently
+    INOUT_TEMP_JOIN_THRESHOLD: int = 0  # above this many staff codes, join a temporary collection of codes. 0: never
+    INOUT_LOOKUP_MAX_STAFFS: int = 50  # the auto in-out strategy uses a single $lookup up to this many staffs
+    EXPORT_CHUNK_SIZE: int = 10000  # rows per record batch (parquet row group) of the arrow / parquet exports
+    SKETCH_ENABLED: bool = False  # keep the daily sketches of the approximate counts up to date in background
+    SKETCH_PRECISION: int = 12  # 2^p registers per daily sketch, relative error ~1.04 / sqrt(2^p), 1.6% for 12
+    SKETCH_REFRESH_INTERVAL: int = 600  # seconds between two background builds of the closed days sketches
+    SKETCH_HISTORY_DAYS: int = 62  # how many closed days are sketched in background
+    SKETCH_RECHECK_DAYS: int = 2  # closed days sketched again by each refresh, for the records uploaded late
+    TRUSTED_RESPONSES: bool = True  # serialize the stat responses without validating them again, off in debug
+
+
+class AppSettingsModel(CommonSettingsModel, ServerSettingsModel, DatabaseSettingsModel, QuerySettingsModel):
     model_config = SettingsConfigDict(extra="ignore")
 
 
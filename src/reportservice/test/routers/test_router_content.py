@@ -36,6 +36,40 @@ def test_list_contents(testclient: TestClient):
     assert response.status_code == 200
 
 
+def test_list_contents_fields(testclient: TestClient, createtestcontent: str):
+    response = testclient.get(f"{PREFIX}/", params={"fields": "name,attach"})
+    assert response.status_code == 200
+    content = next(c for c in response.json() if c["_id"] == createtestcontent)
+    assert content == {"_id": createtestcontent, "name": "test content", "attach": False}
+
+    # the templates are not listed by default
+    content = next(c for c in testclient.get(f"{PREFIX}/").json() if c["_id"] == createtestcontent)
+    assert "body_template" not in content and content["name"] == "test content"
+
+    response = testclient.get(f"{PREFIX}/", params={"fields": "excel"})
+    assert response.status_code == 400
+
+
+def test_list_contents_pages(testclient: TestClient, createtestcontent: str):
+    ids, after = [], None
+    while True:
+        params = {"limit": 1, "fields": "name"}
+        if after is not None:
+            params["after"] = after
+        response = testclient.get(f"{PREFIX}/", params=params)
+        assert response.status_code == 200
+        ids += [content["_id"] for content in response.json()]
+        if (after := response.headers.get("X-Next-Token")) is None:
+            break
+    assert ids == [content["_id"] for content in testclient.get(f"{PREFIX}/").json()]
+    assert createtestcontent in ids
+
+    response = testclient.get(f"{PREFIX}/", params={"stream": True, "limit": 1})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[-1]["count"] == 1
+    assert (lines[-1]["next"] is None) == (len(ids) == 1)
+
+
 def test_get_content1(testclient: TestClient):
     # testcase: get a non-exist content
     response = testclient.get(f"{PREFIX}/non")
@@ -124,6 +158,16 @@ def test_download_excel2(testclient: TestClient, createtestcontent: str):
     assert response.status_code == 200
 
 
+def test_download_excel3(testclient: TestClient, createtestcontent: str, excelbytes):
+    response = testclient.get(f"{PREFIX}/{createtestcontent}/download")
+    assert response.content == excelbytes
+
+    # the metadata only has the reference of the file
+    content = testclient.get(f"{PREFIX}/{createtestcontent}").json()
+    assert "excel" not in content
+    assert content["excel_ref"]["size"] == len(excelbytes)
+
+
 def test_update_content(testclient: TestClient, createtestcontent: str):
     payload = json.dumps({"description": "change the description to this informative one"})
     response = testclient.put(f"{PREFIX}/{createtestcontent}", data=payload)
@@ -1,10 +1,21 @@
 import json
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
 from fastapi.testclient import TestClient
+from ...settings import settings
+from ...routers.stat import DailySketches
 
 PREFIX = "/stat"
 
 
+@pytest.fixture(autouse=True, params=[False, True], ids=["validated", "trusted"])
+def trusted_responses(request, monkeypatch):
+    """every route answered both ways: validated again (the session default) and serialized as trusted"""
+    monkeypatch.setattr(settings, "TRUSTED_RESPONSES", request.param)
+    return request.param
+
+
 @pytest.fixture(scope="session")
 def _payload(test_time):
     begin, end = test_time
@@ -18,18 +29,117 @@ def test_api_get_inout_count(testclient: TestClient, _payload, generate_conf):
     assert response.status_code == 200, response.json()
 
 
+def test_api_get_inout_count_approximate(testclient: TestClient, _payload, generate_conf, monkeypatch):  # noqa: F811
+    # the sketches are disabled by default
+    response = testclient.get(f"{PREFIX}/count_inout", params={"approximate": True, **_payload})
+    assert response.status_code == 404, response.json()
+
+    collection = testclient.app.mongodb_client[settings.DB_REPORT_NAME][settings.DB_COLLECTION_SKETCH]
+    monkeypatch.setattr(testclient.app, "sketches", DailySketches(collection, tz=settings.TIMEZONE))
+    response = testclient.get(f"{PREFIX}/count_inout", params={"approximate": True, **_payload})
+    assert response.status_code == 200, response.json()
+    estimate = response.json()
+    assert estimate["lower"] <= 2 <= estimate["upper"]
+    assert estimate["error"] < 0.02
+
+
+def test_api_get_inout_count_windows(testclient: TestClient, _payload, generate_conf):  # noqa: F811
+    body = {"day": _payload, "reverse": {"begin": _payload["end"], "end": _payload["begin"]}}
+    response = testclient.post(f"{PREFIX}/count_inout_windows", data=json.dumps(body))
+    assert response.status_code == 200, response.json()
+    assert response.json() == {"day": 2, "reverse": 0}
+
+    response = testclient.post(f"{PREFIX}/count_inout_windows", data=json.dumps({"$bad": _payload}))
+    assert response.status_code == 422, response.json()
+
+    # naive datetimes are UTC, they can be mixed with aware ones
+    naive = {"begin": _payload["begin"].replace("+00:00", ""), "end": _payload["end"]}
+    response = testclient.post(f"{PREFIX}/count_inout_windows", data=json.dumps({"day": _payload, "naive": naive}))
+    assert response.status_code == 200, response.json()
+    assert response.json() == {"day": 2, "naive": 2}
+
+
+def test_api_get_live_snapshot(testclient: TestClient, generate_conf):  # noqa: F811
+    response = testclient.get(f"{PREFIX}/live")
+    assert response.status_code == 200, response.json()
+    assert response.json()["source"] is not None
+
+
 def test_api_get_people_count(testclient: TestClient, _payload, generate_conf):  # noqa: F811
     response = testclient.get(f"{PREFIX}/count_people", params=_payload)
     assert response.text == "723"
     assert response.status_code == 200, response.json()
 
 
+def test_api_get_directory_summary(testclient: TestClient, generate_conf):  # noqa: F811
+    response = testclient.get(f"{PREFIX}/directory_summary")
+    assert response.status_code == 200, response.json()
+    assert response.json() == {"people_count": 723, "has_sample_count": 723, "should_checkinout_count": 721}
+
+
 def test_api_get_people_inout(testclient: TestClient, _payload, generate_conf):  # noqa: F811
     body = {"staff_codes": ["abc"]}
     response = testclient.post(f"{PREFIX}/people_inout", params=_payload, data=json.dumps(body))
     assert response.status_code == 200, response.json()
 
 
+def test_api_get_people_inout_stream(testclient: TestClient, _payload, generate_conf):  # noqa: F811
+    body = {"staffcodes": ["267817"]}
+    params = {"stream": True, **_payload}
+    response = testclient.post(f"{PREFIX}/people_inout", params=params, data=json.dumps(body))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[-1] == {"count": len(lines) - 1}
+
+    expected = testclient.post(f"{PREFIX}/people_inout", params=_payload, data=json.dumps(body)).json()
+    assert sorted(lines[:-1], key=lambda x: x["staff_code"]) == sorted(
+        expected["values"], key=lambda x: x["staff_code"]
+    )
+
+
+def test_api_get_people_inout_arrow(testclient: TestClient, _payload, generate_conf):  # noqa: F811
+    body = {"staffcodes": ["267817"]}
+    params = {"format": "arrow", **_payload}
+    response = testclient.post(f"{PREFIX}/people_inout", params=params, data=json.dumps(body))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/vnd.apache.arrow.stream")
+    table = pa.ipc.open_stream(response.content).read_all()
+
+    expected = testclient.post(f"{PREFIX}/people_inout", params=_payload, data=json.dumps(body)).json()
+    assert sorted(table.column("staff_code").to_pylist()) == sorted(x["staff_code"] for x in expected["values"])
+
+
+def test_api_benchmark_people_inout(testclient: TestClient, _payload, generate_conf):  # noqa: F811
+    body = {"staffcodes": ["267817"]}
+    response = testclient.post(f"{PREFIX}/people_inout/benchmark", params=_payload, data=json.dumps(body))
+    assert response.status_code == 200, response.json()
+    benchmark = response.json()
+    assert benchmark["winner"] in benchmark["timings"]
+
+    params = {"strategy": benchmark["chosen"], **_payload}
+    response = testclient.post(f"{PREFIX}/people_inout", params=params, data=json.dumps(body))
+    assert response.status_code == 200, response.json()
+    assert response.json()["count"] == benchmark["count"]
+
+
+def test_api_get_people_inout_range(testclient: TestClient, _payload, generate_conf):  # noqa: F811
+    body = {"staffcodes": ["267817"]}
+    response = testclient.post(f"{PREFIX}/people_inout_range", params=_payload, data=json.dumps(body))
+    assert response.status_code == 200, response.json()
+    assert response.json()["count"] == len(response.json()["values"])
+
+    response = testclient.post(
+        f"{PREFIX}/people_inout_range", params={"stream": True, **_payload}, data=json.dumps(body)
+    )
+    assert response.status_code == 200
+    assert json.loads(response.text.splitlines()[-1])["count"] == len(response.text.splitlines()) - 1
+
+    params = {"begin": "2023-01-01T00:00:00+07:00", "end": "2024-12-31T00:00:00+07:00"}
+    response = testclient.post(f"{PREFIX}/people_inout_range", params=params, data=json.dumps(body))
+    assert response.status_code == 400, response.json()
+
+
 def test_api_get_has_sample_count(testclient: TestClient, _payload, generate_conf):  # noqa: F811
     response = testclient.get(f"{PREFIX}/count_has_sample", params=_payload)
     assert response.text == "723"
@@ -56,6 +166,45 @@ def test_api_get_person_record_by_id(testclient: TestClient, _payload, generate_
     response = testclient.get(f"{PREFIX}/person_record", params=params)
     assert response.status_code == 200, response.json()
     assert 48 == response.json()["count"]
+    assert response.json()["next"] is not None
+
+    params["after"] = response.json()["next"]
+    response = testclient.get(f"{PREFIX}/person_record", params=params)
+    assert response.status_code == 200, response.json()
+    assert len(response.json()["values"]) == 10
+
+    params["after"] = "not a token"
+    response = testclient.get(f"{PREFIX}/person_record", params=params)
+    assert response.status_code == 400, response.json()
+
+
+def test_api_get_person_record_stream(testclient: TestClient, _payload, generate_conf):  # noqa: F811
+    params = {"staff_id": "267817", "face_reg_score_threshold": 0.1, "count": True, **_payload}
+    headers = {"Accept": "application/x-ndjson"}
+    response = testclient.get(f"{PREFIX}/person_record", params=params, headers=headers)
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 11
+    assert lines[-1]["count"] == 10
+    assert lines[-1]["total"] == 48
+    assert lines[-1]["next"] is not None
+
+    params["after"] = "not a token"
+    response = testclient.get(f"{PREFIX}/person_record", params=params, headers=headers)
+    assert response.status_code == 400
+
+
+def test_api_get_person_record_parquet(testclient: TestClient, _payload, generate_conf):  # noqa: F811
+    params = {"staff_id": "267817", "face_reg_score_threshold": 0.1, "format": "parquet", **_payload}
+    response = testclient.get(f"{PREFIX}/person_record", params=params)
+    assert response.status_code == 200
+    table = pq.read_table(pa.BufferReader(response.content))
+    assert table.num_rows == 10
+    assert set(table.column("staff_id").to_pylist()) == {"267817"}
+
+    params["after"] = "not a token"
+    response = testclient.get(f"{PREFIX}/person_record", params=params)
+    assert response.status_code == 400
 
 
 def test_api_get_record_count_by_date_cam(testclient: TestClient, _payload, generate_conf):  # noqa: F811
@@ -63,3 +212,34 @@ def test_api_get_record_count_by_date_cam(testclient: TestClient, _payload, gene
     response = testclient.get(f"{PREFIX}/by_date_cam_stats", params=params)
     assert response.status_code == 200, response.json()
     assert 5 == response.json()["count"], response.json()
+
+    params["granularity"] = "15min"
+    response = testclient.get(f"{PREFIX}/by_date_cam_stats", params=params)
+    assert response.status_code == 200, response.json()
+    assert all(value["bucket"] is not None for value in response.json()["values"])
+
+    params["granularity"] = "week"
+    response = testclient.get(f"{PREFIX}/by_date_cam_stats", params=params)
+    assert response.status_code == 422, response.json()
+
+
+def test_api_get_indexes(testclient: TestClient, _payload, generate_conf):  # noqa: F811
+    response = testclient.get(f"{PREFIX}/indexes", params={"staff_id": "267817", **_payload})
+    assert response.status_code == 200, response.json()
+    report = response.json()
+    assert len(report["indexes"]) > 0
+    assert {plan["name"] for plan in report["plans"]} >= {"query_find_staff", "count_inout"}
+
+
+def test_api_explain(testclient: TestClient, _payload, generate_conf):  # noqa: F811
+    response = testclient.get(f"{PREFIX}/count_inout", params={"explain": True, **_payload})
+    assert response.status_code == 200, response.json()
+    explain = response.json()
+    assert explain["count"] == 1
+    assert explain["values"][0]["operation"] == "aggregate"
+    assert "docs_examined" in explain["values"][0]
+
+    body = {"staffcodes": ["267817"]}
+    response = testclient.post(f"{PREFIX}/people_inout", params={"explain": True, **_payload}, data=json.dumps(body))
+    assert response.status_code == 200, response.json()
+    assert response.json()["count"] == 2  # stage 1 and stage 2